@@ -7,3 +7,4 @@ admin.site.register(Customer)
 admin.site.register(Pizza)
 admin.site.register(Order)
 admin.site.register(OrderItem)
+admin.site.register(Task)
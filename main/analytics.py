@@ -0,0 +1,147 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import F, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from main.models import DailyPizzaSales, DailyTypeSales, Order, OrderItem, Pizza, RollupWatermark
+
+ROLLUP_NAME = 'daily_sales'
+# заказы последней минуты еще могут дописываться в незавершенных транзакциях, поэтому сводка до них не доходит
+ROLLUP_LAG = datetime.timedelta(minutes=1)
+ROLLUP_STEP = datetime.timedelta(days=1)
+REPORT_GROUPS = ('pizza', 'type')
+
+
+def _apply(model, key_field, rows):
+    """
+    Прибавление количества и выручки к строкам сводки за дни из rows (недостающие строки создаются).
+
+    :param model: DailyPizzaSales или DailyTypeSales
+    :param key_field: Поле, по которому строки различаются внутри дня (pizza_id или type)
+    :param rows: Словарь {(день, ключ): (количество, выручка)}
+    """
+    existing = {
+        (row.day, getattr(row, key_field)): row
+        for row in model.objects.filter(day__in={day for day, key in rows},
+                                        **{f'{key_field}__in': {key for day, key in rows}})
+    }
+    changed, new = [], []
+    for (day, key), (quantity, revenue) in rows.items():
+        row = existing.get((day, key))
+        if row is None:
+            new.append(model(day=day, quantity=quantity, revenue=revenue, **{key_field: key}))
+        else:
+            row.quantity += quantity
+            row.revenue += revenue
+            changed.append(row)
+    model.objects.bulk_update(changed, ['quantity', 'revenue'])
+    model.objects.bulk_create(new)
+
+
+def apply_sales(sales):
+    """
+    Прибавление продаж к дневным сводкам по пиццам и по типам.
+
+    :param sales: Строки с днем (day), ID пиццы (pizza_id), типом (pizza__type), количеством (sold) и выручкой
+        (revenue); пара (день, пицца) встречается не больше одного раза
+    :return: Количество учтенных пицц.
+    """
+    by_pizza, by_type = {}, {}
+    for row in sales:
+        by_pizza[row['day'], row['pizza_id']] = (row['sold'], row['revenue'])
+        quantity, revenue = by_type.get((row['day'], row['pizza__type']), (0, 0))
+        by_type[row['day'], row['pizza__type']] = (quantity + row['sold'], revenue + row['revenue'])
+    if by_pizza:
+        _apply(DailyPizzaSales, 'pizza_id', by_pizza)
+        _apply(DailyTypeSales, 'type', by_type)
+    return sum(sold for sold, revenue in by_pizza.values())
+
+
+def rollup_sales(now=None, step=ROLLUP_STEP):
+    """
+    Перенос оформленных заказов в дневные сводки по пиццам и по типам. Обрабатываются только заказы, оформленные
+    после отметки RollupWatermark, шагами по step: каждый шаг - одна агрегация по индексу order_completed_date_idx
+    и одна транзакция, в которой сдвигается отметка. Повторный запуск продолжает с места остановки.
+
+    :param now: Текущий момент (для тестов)
+    :param step: Размер шага
+    :return: Количество учтенных пицц.
+    """
+    cutoff = (now or timezone.now()) - ROLLUP_LAG
+    watermark = RollupWatermark.objects.filter(name=ROLLUP_NAME).first()
+    if watermark is None:
+        first = Order.objects.filter(complete=True).aggregate(first=Min('date_ordered'))['first']
+        watermark, created = RollupWatermark.objects.get_or_create(name=ROLLUP_NAME,
+                                                                   defaults={'position': first or cutoff})
+
+    processed = 0
+    while watermark.position < cutoff:
+        with transaction.atomic():
+            watermark = RollupWatermark.objects.select_for_update().get(name=ROLLUP_NAME)
+            start = watermark.position
+            end = min(start + step, cutoff)
+            if start >= end:
+                break
+            sales = (OrderItem.objects
+                     .filter(order__complete=True, order__date_ordered__gte=start, order__date_ordered__lt=end,
+                             pizza__isnull=False, quantity__gt=0)
+                     .annotate(day=TruncDate('order__date_ordered'))
+                     .values('day', 'pizza_id', 'pizza__type')
+                     .annotate(sold=Sum('quantity'), revenue=Sum(F('quantity') * F('pizza__price')))
+                     .order_by())
+            processed += apply_sales(sales)
+            watermark.position = end
+            watermark.save(update_fields=['position'])
+    return processed
+
+
+def reset_rollups():
+    """
+    Удаление сводок и отметки: следующий rollup_sales пересчитает с начала все заказы, оставшиеся в таблицах
+    (заказы из архива учитывает archive.rebuild_rollups).
+    """
+    with transaction.atomic():
+        DailyPizzaSales.objects.all().delete()
+        DailyTypeSales.objects.all().delete()
+        RollupWatermark.objects.filter(name=ROLLUP_NAME).delete()
+
+
+def get_rollup_position():
+    """
+    Момент, до которого заказы учтены в сводках (None, если сводки еще не строились).
+    """
+    return RollupWatermark.objects.filter(name=ROLLUP_NAME).values_list('position', flat=True).first()
+
+
+def sales_report(start, end, group='pizza'):
+    """
+    Продажи за период из дневных сводок.
+
+    :param start: Первый день периода
+    :param end: Последний день периода
+    :param group: Группировка: по пиццам (pizza) или по типам (type)
+    :return: Список словарей с названием (name), количеством (quantity) и выручкой (revenue) по убыванию выручки.
+    """
+    if group == 'type':
+        types = dict(Pizza.TYPE_VARIANTS)
+        rows = (DailyTypeSales.objects.filter(day__range=(start, end)).values('type')
+                .annotate(sold=Sum('quantity'), total=Sum('revenue')).order_by('-total'))
+        return [{'name': types.get(row['type'], row['type']), 'quantity': row['sold'], 'revenue': row['total']}
+                for row in rows]
+    rows = (DailyPizzaSales.objects.filter(day__range=(start, end)).values('pizza_id', 'pizza__name')
+            .annotate(sold=Sum('quantity'), total=Sum('revenue')).order_by('-total'))
+    return [{'name': row['pizza__name'] or 'Удаленная пицца', 'quantity': row['sold'], 'revenue': row['total']}
+            for row in rows]
+
+
+def daily_totals(start, end):
+    """
+    Итоги по дням периода из дневных сводок.
+
+    :return: Список словарей с днем (day), количеством (quantity) и выручкой (revenue).
+    """
+    rows = (DailyTypeSales.objects.filter(day__range=(start, end)).values('day')
+            .annotate(sold=Sum('quantity'), total=Sum('revenue')).order_by('day'))
+    return [{'day': row['day'], 'quantity': row['sold'], 'revenue': row['total']} for row in rows]
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        # регистрирует сигналы сброса кэша каталога, переноса корзины из cookie при входе
+        # и проверки постоянных соединений с базой данных, а также проверки настроек кэша
+        from main import catalog, checks, db, utils  # noqa: F401
@@ -0,0 +1,181 @@
+import datetime
+import functools
+import gzip
+import io
+import json
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main.analytics import apply_sales, get_rollup_position, reset_rollups, rollup_sales
+from main.bestsellers import current_hour
+from main.models import Order, OrderArchive, OrderData, OrderItem, Payment, Pizza
+
+ARCHIVE_BATCH_SIZE = 500
+
+
+@functools.lru_cache(maxsize=None)
+def get_archive_storage():
+    """
+    Хранилище файлов архива заказов (каталог settings.ORDER_ARCHIVE_ROOT).
+    """
+    return FileSystemStorage(location=settings.ORDER_ARCHIVE_ROOT)
+
+
+def archive_cutoff(days, now=None):
+    """
+    Граница архивации: заказы, оформленные раньше нее, можно переносить в архив. Кроме возраста в днях граница
+    не позже отметки дневных сводок (неучтенные в отчетах заказы остаются в таблицах) и начала самого длинного окна
+    хитов продаж (его пересчитывает bestsellers.rebuild_bestsellers по таблицам).
+
+    :param days: Возраст заказов в днях
+    :return: Граница или None, если сводки еще не строились.
+    """
+    now = now or timezone.now()
+    position = get_rollup_position()
+    if position is None:
+        return None
+    longest = max(settings.BESTSELLER_WINDOWS.values())
+    return min(now - datetime.timedelta(days=days), current_hour(now) - datetime.timedelta(hours=longest), position)
+
+
+def _records(orders):
+    """
+    Записи архива для пачки заказов: заказ с данными доставки, позициями (с названием, типом и ценой пиццы
+    на момент архивации) и платежами.
+    """
+    ids = [order['id'] for order in orders]
+    items, data, payments = {}, {}, {}
+    for item in (OrderItem.objects.filter(order_id__in=ids)
+                 .values('order_id', 'pizza_id', 'quantity', 'pizza__name', 'pizza__type', 'pizza__price')):
+        items.setdefault(item['order_id'], []).append({
+            'pizza_id': item['pizza_id'], 'name': item['pizza__name'], 'type': item['pizza__type'],
+            'price': item['pizza__price'], 'quantity': item['quantity'],
+        })
+    for row in OrderData.objects.filter(order_id__in=ids).values('order_id', 'address', 'phone'):
+        data[row['order_id']] = {'address': row['address'], 'phone': row['phone']}
+    for row in (Payment.objects.filter(order_id__in=ids)
+                .values('order_id', 'provider', 'intent_id', 'amount', 'currency', 'status', 'created_at', 'captured_at')):
+        payments.setdefault(row.pop('order_id'), []).append(row)
+    for order in orders:
+        yield dict(order, data=data.get(order['id']), items=items.get(order['id'], []),
+                   payments=payments.get(order['id'], []))
+
+
+def _dump(records):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as stream:
+        for record in records:
+            stream.write(json.dumps(record, ensure_ascii=False, default=str).encode() + b'\n')
+    return buffer.getvalue()
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Перенос одной пачки самых старых оформленных заказов (раньше cutoff) в архив: пачка записывается в файл
+    хранилища, затем в одной транзакции создается запись OrderArchive и заказы удаляются из таблиц вместе
+    с позициями, данными доставки и платежами. Если транзакция не прошла, файл удаляется.
+
+    :param cutoff: Граница архивации (см. archive_cutoff)
+    :param batch_size: Размер пачки
+    :return: Запись о пачке или None, если архивировать нечего.
+    """
+    orders = list(Order.objects.filter(complete=True, date_ordered__lt=cutoff).order_by('date_ordered', 'id')
+                  .values('id', 'customer_id', 'date_ordered', 'transaction_id', 'checkout_key')[:batch_size])
+    if not orders:
+        return None
+    ids = [order['id'] for order in orders]
+    first, last = orders[0]['date_ordered'], orders[-1]['date_ordered']
+    storage = get_archive_storage()
+    name = storage.save(f'orders/{first:%Y/%m}/{min(ids)}-{max(ids)}.jsonl.gz', ContentFile(_dump(_records(orders))))
+    try:
+        with transaction.atomic():
+            archive = OrderArchive.objects.create(name=name, first_order=min(ids), last_order=max(ids),
+                                                  first_ordered=first, last_ordered=last, orders=len(ids))
+            Payment.objects.filter(order_id__in=ids).delete()
+            OrderData.objects.filter(order_id__in=ids).delete()
+            OrderItem.objects.filter(order_id__in=ids).delete()
+            Order.objects.filter(pk__in=ids).delete()
+    except Exception:
+        storage.delete(name)
+        raise
+    return archive
+
+
+def archive_orders(days, now=None, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None):
+    """
+    Перенос в архив оформленных заказов старше days дней (см. archive_cutoff) пачками по batch_size: каждая пачка -
+    отдельный файл и отдельная транзакция, поэтому прерванный перенос продолжается следующим запуском.
+
+    :param max_batches: Сколько пачек перенести за запуск (None - все)
+    :return: Количество перенесенных заказов.
+    """
+    cutoff = archive_cutoff(days, now)
+    archived = batches = 0
+    while cutoff is not None and (max_batches is None or batches < max_batches):
+        archive = archive_batch(cutoff, batch_size)
+        if archive is None:
+            break
+        archived += archive.orders
+        batches += 1
+    return archived
+
+
+def iter_archived_orders(start=None, end=None):
+    """
+    Заказы из архива, оформленные в промежутке [start, end). Читаются только файлы пачек, которые пересекаются
+    с промежутком, построчно, без загрузки файла в память целиком.
+
+    :return: Генератор словарей заказов (id, customer_id, date_ordered, transaction_id, checkout_key, data,
+        items, payments); date_ordered - datetime.
+    """
+    archives = OrderArchive.objects.order_by('first_ordered', 'first_order')
+    if start is not None:
+        archives = archives.filter(last_ordered__gte=start)
+    if end is not None:
+        archives = archives.filter(first_ordered__lt=end)
+    storage = get_archive_storage()
+    for archive in archives:
+        with storage.open(archive.name, 'rb') as raw, gzip.GzipFile(fileobj=raw) as stream:
+            for line in stream:
+                record = json.loads(line)
+                record['date_ordered'] = parse_datetime(record['date_ordered'])
+                if (start is None or record['date_ordered'] >= start) and (end is None or record['date_ordered'] < end):
+                    yield record
+
+
+def archived_sales(start=None, end=None):
+    """
+    Продажи заказов из архива по дням в виде строк для analytics.apply_sales. Как и в rollup_sales, позиции
+    удаленных пицц не учитываются; выручка считается по цене на момент архивации.
+    """
+    existing = set(Pizza.objects.values_list('id', flat=True))
+    rows = {}
+    for order in iter_archived_orders(start, end):
+        day = timezone.localtime(order['date_ordered']).date()
+        for item in order['items']:
+            if item['pizza_id'] not in existing or not item['quantity'] or item['quantity'] <= 0:
+                continue
+            row = rows.setdefault((day, item['pizza_id']), {
+                'day': day, 'pizza_id': item['pizza_id'], 'pizza__type': item['type'], 'sold': 0, 'revenue': 0,
+            })
+            row['sold'] += item['quantity']
+            row['revenue'] += item['quantity'] * item['price']
+    return rows.values()
+
+
+def rebuild_rollups():
+    """
+    Пересчет дневных сводок с нуля: заказы из архива берутся из его файлов, остальные учитывает rollup_sales.
+    Пока отметки сводок нет, archive_cutoff не дает архивировать, поэтому заказы не попадут в сводки дважды.
+
+    :return: Количество учтенных пицц.
+    """
+    with transaction.atomic():
+        reset_rollups()
+        processed = apply_sales(archived_sales())
+    return processed + rollup_sales()
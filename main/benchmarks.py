@@ -0,0 +1,274 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.middleware.csrf import _get_new_csrf_string
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from main.bestsellers import rebuild_bestsellers
+from main.models import Customer, Order, OrderItem, Pizza
+
+# Верхняя граница количества SQL-запросов на один запрос страницы (после прогрева кэшей).
+QUERY_BUDGETS = {
+    ('guest', 'assortment'): 0,
+    ('guest', 'assortment_filter'): 0,
+    ('guest', 'topsellers'): 0,
+    ('guest', 'update_item'): 2,
+    ('guest', 'checkout_page'): 1,
+    ('guest', 'checkout_submit'): 8,
+    ('guest', 'payment'): 0,
+    ('user', 'assortment'): 2,
+    ('user', 'assortment_filter'): 2,
+    ('user', 'topsellers'): 2,
+    ('user', 'update_item'): 12,
+    ('user', 'checkout_page'): 6,
+    ('user', 'checkout_submit'): 11,
+    ('user', 'payment'): 2,
+}
+
+
+def seed(rng, pizzas=500, customers=50, orders=2000, items_per_order=3):
+    """
+    Данные для прогона: пицца всех типов, покупатели и оформленные заказы (для рейтинга хитов продаж).
+
+    :param rng: Генератор случайных чисел (для воспроизводимости)
+    :return: Список ID пицц.
+    """
+    author = User.objects.create_user('bench-staff', is_staff=True)
+    Pizza.objects.bulk_create(
+        Pizza(author=author, name=f'Пицца {i}', description='Описание', image='pizza.png',
+              price=rng.randint(300, 1500), rating=rng.randint(0, 1000), type=rng.randrange(len(Pizza.TYPE_VARIANTS)))
+        for i in range(pizzas)
+    )
+    pizza_ids = list(Pizza.objects.values_list('id', flat=True))
+    Customer.objects.bulk_create(Customer(name=f'Покупатель {i}') for i in range(customers))
+    customer_ids = list(Customer.objects.values_list('id', flat=True))
+    Order.objects.bulk_create(Order(customer_id=rng.choice(customer_ids), complete=True) for _ in range(orders))
+    OrderItem.objects.bulk_create(
+        OrderItem(order_id=order_id, pizza_id=pizza_id, quantity=rng.randint(1, 3))
+        for order_id in Order.objects.values_list('id', flat=True)
+        for pizza_id in rng.sample(pizza_ids, items_per_order)
+    )
+    rebuild_bestsellers()
+    return pizza_ids
+
+
+def make_clients():
+    """
+    Клиенты для прогона: гость и вошедший покупатель.
+
+    :return: Словарь {имя: Client}.
+    """
+    user = User.objects.create_user('bench-user')
+    Customer.objects.get_or_create(user=user, defaults={'name': user.username})
+    logged_in = Client()
+    logged_in.force_login(user)
+    return {'guest': Client(), 'user': logged_in}
+
+
+def _add(client, pizza_id):
+    return client.post('/update_item/', {'pizzaId': pizza_id, 'action': 'add'}, content_type='application/json')
+
+
+def _checkout(client, rng, pizza_ids):
+    _add(client, rng.choice(pizza_ids))
+    data = {'phone': '+70000000000', 'address': 'Адрес', 'checkout_key': uuid.uuid4().hex}
+    return lambda: client.post('/checkout/', data)
+
+
+# Сценарий получает клиента, генератор и ID пицц и возвращает функцию одного измеряемого запроса;
+# подготовка (например, наполнение корзины перед оформлением) в замер не входит.
+SCENARIOS = {
+    'assortment': lambda client, rng, ids: lambda: client.get('/assortment/'),
+    'assortment_filter': lambda client, rng, ids: lambda: client.post('/assortment/', {'list_of_types': ['beef', 'chicken']}),
+    'topsellers': lambda client, rng, ids: lambda: client.get('/topsellers/'),
+    'update_item': lambda client, rng, ids: lambda: _add(client, rng.choice(ids)),
+    'checkout_page': lambda client, rng, ids: lambda: client.get('/checkout/'),
+    'checkout_submit': _checkout,
+    'payment': lambda client, rng, ids: lambda: client.get('/payment/'),
+}
+
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def count_writes(captured):
+    """
+    Количество изменяющих запросов (INSERT, UPDATE, DELETE) среди перехваченных CaptureQueriesContext.
+    """
+    return sum(1 for query in captured.captured_queries if query['sql'].lstrip().upper().startswith(WRITE_STATEMENTS))
+
+
+def percentile(sorted_values, q):
+    """
+    Процентиль q (от 0 до 1) уже отсортированного списка (ближайший ранг).
+    """
+    index = max(0, min(len(sorted_values) - 1, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(client, scenario, rng, pizza_ids, repeat, warmup=2):
+    """
+    Прогон одного сценария: warmup запросов для прогрева кэшей, затем repeat измеряемых.
+
+    :return: Словарь с p50/p95/p99 (мс), запросами в секунду (rps), средним и максимальным количеством
+        SQL-запросов (queries, max_queries) и кодами ответов (statuses).
+    :raises AssertionError: Если сервер ответил ошибкой.
+    """
+    timings, queries, statuses = [], [], set()
+    for attempt in range(warmup + repeat):
+        request = SCENARIOS[scenario](client, rng, pizza_ids)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request()
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise AssertionError(f'{scenario}: HTTP {response.status_code}')
+        if attempt >= warmup:
+            timings.append(elapsed * 1000)
+            queries.append(len(captured))
+            statuses.add(response.status_code)
+    timings.sort()
+    return {
+        'p50_ms': percentile(timings, 0.5),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99),
+        'rps': len(timings) / (sum(timings) / 1000) if sum(timings) else float('inf'),
+        'queries': statistics.mean(queries),
+        'max_queries': max(queries),
+        'statuses': sorted(statuses),
+    }
+
+
+def run_suite(repeat, seed_value=1, scenarios=None):
+    """
+    Прогон всех сценариев для гостя и покупателя на уже заполненной базе. Задачи оформления заказа только ставятся
+    в очередь, как в рабочем режиме (в DEBUG они по умолчанию выполняются сразу, см. TASK_QUEUE_EAGER).
+
+    :return: Словарь {(клиент, сценарий): результат run_scenario}.
+    """
+    rng = random.Random(seed_value)
+    pizza_ids = list(Pizza.objects.values_list('id', flat=True))
+    results = {}
+    with override_settings(TASK_QUEUE_EAGER=False):
+        for client_name, client in make_clients().items():
+            for scenario in scenarios or SCENARIOS:
+                results[client_name, scenario] = run_scenario(client, scenario, rng, pizza_ids, repeat)
+    return results
+
+
+def check_results(results, baseline=None, max_regression=0.25):
+    """
+    Проверка результатов: количество SQL-запросов в пределах QUERY_BUDGETS и p95 не хуже базового прогона
+    больше чем на max_regression.
+
+    :param baseline: Результаты базового прогона {"клиент:сценарий": {"p95_ms": ...}}
+    :return: Список описаний нарушений (пустой, если все в порядке).
+    """
+    failures = []
+    for key, result in results.items():
+        budget = QUERY_BUDGETS.get(key)
+        if budget is not None and result['max_queries'] > budget:
+            failures.append(f'{key[0]}:{key[1]}: {result["max_queries"]} SQL-запросов при бюджете {budget}')
+        base = (baseline or {}).get(':'.join(key))
+        if base and result['p95_ms'] > base['p95_ms'] * (1 + max_regression):
+            failures.append(f'{key[0]}:{key[1]}: p95 {result["p95_ms"]:.1f} мс, в базовом прогоне {base["p95_ms"]:.1f} мс')
+    return failures
+
+
+# Сценарии ASGI-прогона: (метод, путь, функция тела запроса по генератору и ID пицц). Синхронные двойники
+# тех же представлений доступны по пути с префиксом ASGI_SYNC_PREFIX (см. команду bench_asgi).
+ASGI_SCENARIOS = {
+    'catalog': ('GET', '/api/pizzas/?type=beef&type=chicken&limit=24', None),
+    'update_item': ('POST', '/update_item/',
+                    lambda rng, ids: json.dumps({'pizzaId': rng.choice(ids), 'action': 'add'}).encode()),
+    'cart_summary': ('GET', '/api/cart/', None),
+}
+ASGI_SYNC_PREFIX = '/sync'
+ASGI_WRITE_SCENARIOS = {'update_item'}
+
+
+def asgi_headers(client=None):
+    """
+    Заголовки ASGI-запроса с cookie клиента (сессия вошедшего покупателя) и CSRF-токеном.
+
+    :param client: Client, cookie которого нужно передать (None - гость без cookie)
+    :return: Список пар байтовых строк для scope["headers"].
+    """
+    token = _get_new_csrf_string()
+    cookies = {name: morsel.value for name, morsel in (client.cookies.items() if client else ())}
+    cookies[settings.CSRF_COOKIE_NAME] = token
+    return [
+        (b'host', b'testserver'),
+        (b'cookie', '; '.join(f'{name}={value}' for name, value in cookies.items()).encode()),
+        (b'x-csrftoken', token.encode()),
+        (b'content-type', b'application/json'),
+    ]
+
+
+async def asgi_request(application, method, url, headers, body=b''):
+    """
+    Один запрос к ASGI-приложению в текущем процессе, без сервера и сети.
+
+    :return: Код ответа.
+    """
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': method, 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': headers + [(b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = None
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+async def run_asgi_scenario(application, scenario, headers, rng, pizza_ids, requests, concurrency, prefix=''):
+    """
+    Прогон сценария из ASGI_SCENARIOS: requests запросов, из которых одновременно выполняется не больше concurrency.
+
+    :param prefix: Префикс пути (ASGI_SYNC_PREFIX - синхронный двойник представления)
+    :return: Словарь с p50/p95/p99 (мс), запросами в секунду (rps) и количеством ответов с ошибкой (errors).
+    """
+    method, url, body = ASGI_SCENARIOS[scenario]
+    semaphore = asyncio.Semaphore(concurrency)
+    timings, statuses = [], Counter()
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            status = await asgi_request(application, method, prefix + url, headers,
+                                        body(rng, pizza_ids) if body else b'')
+            timings.append((time.perf_counter() - started) * 1000)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - started
+    timings.sort()
+    return {
+        'p50_ms': percentile(timings, 0.5),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99),
+        'rps': requests / wall,
+        'errors': sum(count for status, count in statuses.items() if status is None or status >= 400),
+    }
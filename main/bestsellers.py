@@ -0,0 +1,199 @@
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from main.db import pin_primary
+from main.models import BestsellerStat, BestsellerWindow, OrderItem, PizzaSales
+
+BESTSELLER_VERSION_KEY = 'bestsellers:version'
+BESTSELLER_EXPIRED_KEY = 'bestsellers:expired:{hour}'
+BESTSELLER_LIMIT = 24
+
+
+def current_hour(now=None):
+    """
+    Начало часа (по UTC), в который попадает момент now (по умолчанию - текущий). Часы считаются по UTC
+    так же, как в rebuild_bestsellers, иначе в поясах со смещением не на целое число часов границы не совпадут.
+    """
+    return (now or timezone.now()).astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def window_start(name, hour):
+    """
+    Первый час окна name, которое заканчивается часом hour.
+    """
+    return hour - datetime.timedelta(hours=settings.BESTSELLER_WINDOWS[name] - 1)
+
+
+def get_bestseller_version():
+    """
+    Версия рейтинга для ключей кэша. Перед чтением из окон вычитаются устаревшие часы (см. expire_windows).
+
+    :return: Номер версии рейтинга.
+    """
+    expire_windows()
+    version = cache.get(BESTSELLER_VERSION_KEY)
+    if version is None:
+        cache.add(BESTSELLER_VERSION_KEY, 1, None)
+        version = cache.get(BESTSELLER_VERSION_KEY, 1)
+    return version
+
+
+def bump_bestseller_version():
+    """
+    Сброс кэша страницы хитов продаж после изменения рейтинга. Как и для каталога (catalog.bump_catalog_version),
+    пока реплика догоняет изменение, страница заполняется с основной базы.
+    """
+    pin_primary()
+    try:
+        cache.incr(BESTSELLER_VERSION_KEY)
+    except ValueError:
+        cache.set(BESTSELLER_VERSION_KEY, 2, None)
+
+
+def _increment(queryset, counts, build=None):
+    """
+    Увеличение quantity у строк queryset с pizza_id из counts одним UPDATE (Case) и вставка недостающих строк.
+
+    :param queryset: Строки одного часа PizzaSales или одного окна BestsellerStat
+    :param counts: Словарь {id пиццы: изменение количества}
+    :param build: Функция (id пиццы, количество) -> новая строка; без нее недостающие строки пропускаются
+    """
+    existing = set(queryset.filter(pizza_id__in=counts).values_list('pizza_id', flat=True))
+    if existing:
+        queryset.filter(pizza_id__in=existing).update(quantity=F('quantity') + Case(
+            *[When(pizza_id=pizza_id, then=Value(counts[pizza_id])) for pizza_id in existing],
+            output_field=IntegerField(),
+        ))
+    missing = {pizza_id: quantity for pizza_id, quantity in counts.items() if pizza_id not in existing}
+    if missing and build is not None:
+        try:
+            with transaction.atomic():
+                queryset.model.objects.bulk_create([build(pizza_id, quantity) for pizza_id, quantity in missing.items()])
+        except IntegrityError:
+            # строки успел вставить параллельный запрос, теперь их можно просто увеличить
+            _increment(queryset, missing, build)
+
+
+def _ensure_windows(hour):
+    """
+    Создание недостающих окон из settings.BESTSELLER_WINDOWS.
+
+    :return: Словарь {имя окна: первый час окна}.
+    """
+    starts = dict(BestsellerWindow.objects.values_list('name', 'start'))
+    missing = {name: window_start(name, hour) for name in settings.BESTSELLER_WINDOWS if name not in starts}
+    BestsellerWindow.objects.bulk_create([
+        BestsellerWindow(name=name, start=start) for name, start in missing.items()
+    ], ignore_conflicts=True)
+    return {**starts, **missing}
+
+
+def record_sale(order):
+    """
+    Учет продаж оформленного заказа: количество каждой пиццы прибавляется к ее часу в PizzaSales
+    и к счетчикам окон BestsellerStat, в которые попадает час заказа. Вызывается фоновой задачей после оформления
+    заказа (см. checkout.record_order_sales), заказы целиком не пересчитываются.
+
+    :param order: Оформленный заказ
+    """
+    counts = dict(
+        order.orderitem_set.filter(pizza__isnull=False, quantity__gt=0).values_list('pizza_id', 'quantity')
+    )
+    if not counts:
+        return
+    hour = current_hour(order.date_ordered)
+    starts = _ensure_windows(hour)
+    _increment(PizzaSales.objects.filter(hour=hour), counts,
+               lambda pizza_id, quantity: PizzaSales(pizza_id=pizza_id, hour=hour, quantity=quantity))
+    for name in settings.BESTSELLER_WINDOWS:
+        if starts[name] > hour:
+            # задача выполнилась позже, чем окно сдвинулось за час заказа: вычитать эту продажу expire_windows не будет
+            continue
+        _increment(BestsellerStat.objects.filter(window=name), counts,
+                   lambda pizza_id, quantity: BestsellerStat(window=name, pizza_id=pizza_id, quantity=quantity))
+    transaction.on_commit(bump_bestseller_version)
+
+
+def expire_windows(now=None):
+    """
+    Сдвиг окон к текущему часу: продажи часов, вышедших из окна, вычитаются из BestsellerStat, а часы старше
+    самого длинного окна удаляются.
+
+    Окно сдвигает тот, чей условный UPDATE границы (WHERE start = прочитанное значение) изменил строку:
+    параллельные запросы и процессы, прочитавшие ту же границу, получают 0 строк и ничего не вычитают, а вычитание
+    выполняется в той же транзакции, что и сдвиг. Отметка в кэше только избавляет от лишних запросов в пределах часа.
+    """
+    hour = current_hour(now)
+    if not cache.add(BESTSELLER_EXPIRED_KEY.format(hour=hour.isoformat()), True, 2 * 60 * 60):
+        return
+    changed = False
+    for name in settings.BESTSELLER_WINDOWS:
+        start = window_start(name, hour)
+        with transaction.atomic():
+            previous = BestsellerWindow.objects.filter(name=name).values_list('start', flat=True).first()
+            if previous is None or previous >= start:
+                continue
+            if not BestsellerWindow.objects.filter(name=name, start=previous).update(start=start):
+                # окно уже сдвинул параллельный запрос
+                continue
+            expired = (PizzaSales.objects.filter(hour__gte=previous, hour__lt=start)
+                       .values('pizza_id').annotate(total=Sum('quantity')).values_list('pizza_id', 'total'))
+            expired = {pizza_id: -total for pizza_id, total in expired}
+            if expired:
+                stats = BestsellerStat.objects.filter(window=name)
+                _increment(stats, expired)
+                stats.filter(quantity__lte=0).delete()
+                changed = True
+    longest = max(settings.BESTSELLER_WINDOWS.values())
+    PizzaSales.objects.filter(hour__lt=hour - datetime.timedelta(hours=longest - 1)).delete()
+    if changed:
+        bump_bestseller_version()
+
+
+def get_bestsellers(window, limit=BESTSELLER_LIMIT):
+    """
+    Самые продаваемые пиццы за окно: первые limit строк индекса bestseller_ranking_idx.
+
+    :param window: Имя окна из settings.BESTSELLER_WINDOWS
+    :param limit: Количество пицц
+    :return: Список пицц по убыванию продаж.
+    """
+    stats = (BestsellerStat.objects.filter(window=window, quantity__gt=0)
+             .select_related('pizza').order_by('-quantity', 'pizza')[:limit])
+    return [stat.pizza for stat in stats]
+
+
+def rebuild_bestsellers(now=None):
+    """
+    Полный пересчет часов продаж и окон по оформленным заказам (для первого запуска и после изменения
+    settings.BESTSELLER_WINDOWS). Единственное место, где продажи считаются группировкой по OrderItem.
+    """
+    hour = current_hour(now)
+    oldest = min(window_start(name, hour) for name in settings.BESTSELLER_WINDOWS)
+    sales = (OrderItem.objects.filter(order__complete=True, order__date_ordered__gte=oldest,
+                                      pizza__isnull=False, quantity__gt=0)
+             .annotate(hour=TruncHour('order__date_ordered', tzinfo=datetime.timezone.utc))
+             .values('pizza_id', 'hour').annotate(total=Sum('quantity')).order_by())
+    with transaction.atomic():
+        PizzaSales.objects.all().delete()
+        BestsellerStat.objects.all().delete()
+        BestsellerWindow.objects.all().delete()
+        PizzaSales.objects.bulk_create(
+            PizzaSales(pizza_id=row['pizza_id'], hour=row['hour'], quantity=row['total']) for row in sales
+        )
+        for name in settings.BESTSELLER_WINDOWS:
+            start = window_start(name, hour)
+            BestsellerWindow.objects.create(name=name, start=start)
+            totals = (PizzaSales.objects.filter(hour__gte=start).values('pizza_id')
+                      .annotate(total=Sum('quantity')).values_list('pizza_id', 'total'))
+            BestsellerStat.objects.bulk_create(
+                BestsellerStat(window=name, pizza_id=pizza_id, quantity=total) for pizza_id, total in totals
+            )
+    cache.set(BESTSELLER_EXPIRED_KEY.format(hour=hour.isoformat()), True, 2 * 60 * 60)
+    transaction.on_commit(bump_bestseller_version)
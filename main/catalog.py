@@ -0,0 +1,200 @@
+import base64
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from main.db import pin_primary
+from main.models import Pizza
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_KEY = 'catalog:{version}:{name}'
+FRAGMENT_KEY = 'fragment:{version}:{name}'
+FRAGMENT_STATS_KEY = 'fragment:stats:{counter}'
+CATALOG_PAGE_SIZE = 24
+CATALOG_MAX_PAGE_SIZE = 100
+TYPE_FILTERS = {'chicken': 0, 'beef': 1, 'sausage': 2, 'vegetarian': 3}
+
+_memory = {'version': None, 'lists': {}}
+
+
+def get_catalog_version():
+    """
+    Текущая версия каталога. Меняется при каждом изменении пиццы, так что старые записи кэша просто перестают читаться.
+    Версия живет settings.CATALOG_CACHE_TIMEOUT секунд: если кэш не общий для процессов, изменение, сделанное
+    в другом процессе, становится видно не позже, чем через это время. Новая версия начинается со значения
+    от текущего времени, поэтому не совпадает ни с одной из прежних.
+
+    :return: Номер версии каталога.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(CATALOG_VERSION_KEY, version, settings.CATALOG_CACHE_TIMEOUT)
+        version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+@receiver(post_save, sender=Pizza)
+@receiver(post_delete, sender=Pizza)
+def bump_catalog_version(sender=None, **kwargs):
+    """
+    Сброс кэша каталога: вызывается после добавления, изменения или удаления пиццы (в том числе через админку).
+    Пока реплика догоняет изменение, кэш заполняется с основной базы.
+    """
+    pin_primary()
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), settings.CATALOG_CACHE_TIMEOUT)
+
+
+def _cached(name, loader):
+    """
+    Список пицц из памяти процесса, из кэша или (если его там нет) из базы данных. Память процесса сбрасывается
+    при смене версии каталога, так что живет не дольше версии (см. get_catalog_version).
+
+    :param name: Имя списка внутри версии каталога
+    :param loader: Функция, возвращающая QuerySet для списка
+    :return: Список пицц.
+    """
+    version = get_catalog_version()
+    if _memory['version'] != version:
+        _memory['version'] = version
+        _memory['lists'] = {}
+    lists = _memory['lists']
+    if name not in lists:
+        key = CATALOG_KEY.format(version=version, name=name)
+        pizzas = cache.get(key)
+        if pizzas is None:
+            pizzas = list(loader())
+            cache.set(key, pizzas, settings.CATALOG_CACHE_TIMEOUT)
+        lists[name] = pizzas
+    return lists[name]
+
+
+def get_top_pizzas():
+    """
+    Пицца, отсортированная по рейтингу (для страницы хитов продаж).
+    """
+    return _cached('top', lambda: Pizza.objects.order_by('-rating', '-id'))
+
+
+def encode_cursor(pizza):
+    """
+    Курсор страницы каталога: позиция последней показанной пиццы в порядке (-rating, -id).
+
+    :param pizza: Последняя пицца на странице
+    :return: Строка курсора.
+    """
+    return base64.urlsafe_b64encode(f'{pizza.rating}:{pizza.id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Разбор курсора, созданного encode_cursor.
+
+    :return: Кортеж (рейтинг, id) последней показанной пиццы.
+    :raises ValueError: Если курсор поврежден.
+    """
+    try:
+        rating, pizza_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return int(rating), int(pizza_id)
+    except (UnicodeError, TypeError, ValueError):
+        raise ValueError(f'Invalid catalog cursor: {cursor!r}')
+
+
+def get_pizza_page(types=None, price_min=None, price_max=None, cursor=None, limit=CATALOG_PAGE_SIZE):
+    """
+    Страница каталога с фильтрами и keyset-пагинацией по (rating, id): следующая страница выбирается условием
+    "после курсора" по индексу, а не через OFFSET, поэтому время ответа не растет с размером меню.
+
+    :param types: Список типов пиццы (см. Pizza.TYPE_VARIANTS), пустой список - все типы
+    :param price_min: Минимальная цена
+    :param price_max: Максимальная цена
+    :param cursor: Курсор предыдущей страницы (encode_cursor)
+    :param limit: Размер страницы
+    :return: Кортеж из списка пицц и курсора следующей страницы (None, если страница последняя).
+    :raises ValueError: Если курсор поврежден.
+    """
+    pizzas = Pizza.objects.order_by('-rating', '-id')
+    if types:
+        pizzas = pizzas.filter(type__in=types)
+    if price_min is not None:
+        pizzas = pizzas.filter(price__gte=price_min)
+    if price_max is not None:
+        pizzas = pizzas.filter(price__lte=price_max)
+    if cursor:
+        rating, pizza_id = decode_cursor(cursor)
+        pizzas = pizzas.filter(Q(rating__lt=rating) | Q(rating=rating, id__lt=pizza_id))
+
+    page = list(pizzas[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def pizza_to_dict(pizza):
+    """
+    Представление пиццы для JSON-ответа каталога.
+    """
+    return {
+        'id': pizza.id,
+        'name': pizza.name,
+        'description': pizza.description,
+        'price': pizza.price,
+        'rating': pizza.rating,
+        'type': pizza.type,
+        'imageURL': pizza.imageURL,
+        'imageSources': pizza.image_sources,
+    }
+
+
+def _count_fragment(counter):
+    key = FRAGMENT_STATS_KEY.format(counter=counter)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def render_pizza_grid(name, loader, empty_message):
+    """
+    Сетка карточек пиццы, отрендеренная один раз на версию каталога и фильтр.
+    Карточки одинаковы для всех посетителей, поэтому в кэше хранится готовый HTML, а список пицц
+    загружается только при промахе.
+
+    :param name: Имя фрагмента (например, страница и активный фильтр)
+    :param loader: Функция, возвращающая контекст сетки: список пицц (pizzas) и, если есть продолжение, адрес
+        следующей страницы API (next_url)
+    :param empty_message: Текст, который показывается, если пиццы нет
+    :return: HTML сетки.
+    """
+    key = FRAGMENT_KEY.format(version=get_catalog_version(), name=name)
+    html = cache.get(key)
+    if html is None:
+        _count_fragment('misses')
+        context = loader()
+        context['empty_message'] = empty_message
+        html = render_to_string('pages/includes/pizza_grid.html', context)
+        cache.set(key, html, settings.CATALOG_CACHE_TIMEOUT)
+    else:
+        _count_fragment('hits')
+    return mark_safe(html)
+
+
+def get_fragment_stats():
+    """
+    Счетчики попаданий и промахов кэша фрагментов.
+
+    :return: Словарь с количеством попаданий (hits), промахов (misses) и долей попаданий (hit_ratio).
+    """
+    hits = cache.get(FRAGMENT_STATS_KEY.format(counter='hits'), 0)
+    misses = cache.get(FRAGMENT_STATS_KEY.format(counter='misses'), 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
@@ -0,0 +1,148 @@
+from django.core.mail import send_mail
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from main.bestsellers import record_sale
+from main.models import Customer, Order, OrderItem
+from main.tasks import enqueue, task
+from main.utils import get_open_order, invalidate_cart_count
+
+
+class EmptyCartError(Exception):
+    """
+    Попытка оформить заказ с пустой корзиной.
+    """
+
+
+class CheckoutKeyConflict(Exception):
+    """
+    Ключ идемпотентности уже использован в заказе другого покупателя.
+    """
+
+
+@task()
+def credit_bonus_points(order_id):
+    """
+    Начисление покупателю бонусных очков за оформленный заказ.
+    """
+    order = Order.objects.get(pk=order_id)
+    if order.customer_id is not None:
+        Customer.objects.filter(pk=order.customer_id).update(
+            bonus_points=F('bonus_points') + order.summary.get_bonus_points)
+
+
+@task()
+def record_order_sales(order_id):
+    """
+    Учет продаж оформленного заказа в рейтинге хитов продаж (см. bestsellers.record_sale).
+    """
+    record_sale(Order.objects.get(pk=order_id))
+
+
+@task()
+def send_receipt(order_id):
+    """
+    Отправка чека за оформленный заказ на почту покупателя (если она указана).
+    """
+    order = Order.objects.select_related('customer__user').get(pk=order_id)
+    user = order.customer.user if order.customer else None
+    if user is None or not user.email:
+        return
+    items = order.orderitem_set.filter(pizza__isnull=False).select_related('pizza')
+    body = render_to_string('emails/receipt.txt', {'order': order, 'items': items, 'summary': order.summary})
+    send_mail(f'Заказ №{order.pk}', body, None, [user.email])
+
+
+def _finalize(order, form, checkout_key):
+    """
+    Запись данных доставки, завершение заказа и постановка в очередь его обработки: начисления бонусов, учета продаж
+    в рейтинге хитов и отправки чека (вызывается внутри транзакции, задачи фиксируются вместе с заказом).
+    """
+    data = form.save(commit=False)
+    data.order = order
+    data.save()
+    order.complete = True
+    order.checkout_key = checkout_key
+    order.date_ordered = timezone.now()
+    order.save(update_fields=['complete', 'checkout_key', 'date_ordered'])
+    calls = [(record_order_sales, {'order_id': order.pk})]
+    if order.customer_id is not None:
+        calls += [(credit_bonus_points, {'order_id': order.pk}), (send_receipt, {'order_id': order.pk})]
+    enqueue(*calls)
+
+
+def _placed_order(checkout_key, customer):
+    """
+    Заказ, уже оформленный с ключом checkout_key (повторная отправка формы).
+
+    :param customer: Покупатель, отправивший форму (None - гость)
+    :return: Заказ или None, если с этим ключом заказ еще не оформлялся.
+    :raises CheckoutKeyConflict: Если заказ с этим ключом принадлежит другому покупателю (или гостю).
+    """
+    placed = Order.objects.filter(checkout_key=checkout_key).first()
+    if placed is not None and placed.customer_id != (customer.pk if customer else None):
+        raise CheckoutKeyConflict()
+    return placed
+
+
+def place_order(customer, form):
+    """
+    Оформление заказа зарегистрированного покупателя в одной транзакции: открытый заказ блокируется,
+    данные доставки привязываются к нему, заказ завершается с ключом идемпотентности из формы, а бонусные очки,
+    рейтинг хитов и чек обрабатываются фоновыми задачами (см. _finalize). Повторная отправка формы с тем же ключом
+    тем же покупателем возвращает уже оформленный заказ и ничего не ставит в очередь.
+
+    :param customer: Покупатель
+    :param form: Проверенная форма CheckoutForm
+    :return: Оформленный заказ.
+    :raises EmptyCartError: Если в корзине нет товаров.
+    :raises CheckoutKeyConflict: Если ключ из формы уже использован другим покупателем.
+    """
+    checkout_key = form.cleaned_data['checkout_key']
+    with transaction.atomic():
+        placed = _placed_order(checkout_key, customer)
+        if placed is not None:
+            return placed
+        order = Order.objects.select_for_update().get(pk=get_open_order(customer).pk)
+        if order.complete:
+            # заказ успели оформить из другой вкладки
+            return order
+        if not order.summary.get_cart_items:
+            raise EmptyCartError()
+        _finalize(order, form, checkout_key)
+    invalidate_cart_count(customer.user_id)
+    return order
+
+
+def place_guest_order(lines, form):
+    """
+    Оформление заказа покупателя без регистрации: заказ и его товары создаются из корзины гостя
+    и сразу завершаются в одной транзакции.
+
+    :param lines: Позиции корзины (CartLine из корзины гостя, см. utils.get_guest_cart)
+    :param form: Проверенная форма CheckoutForm
+    :return: Оформленный заказ.
+    :raises EmptyCartError: Если в корзине нет товаров.
+    :raises CheckoutKeyConflict: Если ключ из формы уже использован зарегистрированным покупателем.
+    """
+    checkout_key = form.cleaned_data['checkout_key']
+    placed = _placed_order(checkout_key, None)
+    if placed is not None:
+        return placed
+    if not lines:
+        raise EmptyCartError()
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(customer=None)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, pizza=line.pizza, quantity=line.quantity) for line in lines
+            ])
+            _finalize(order, form, checkout_key)
+    except IntegrityError:
+        placed = _placed_order(checkout_key, None)
+        if placed is None:
+            raise
+        return placed
+    return order
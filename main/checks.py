@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.core.exceptions import ImproperlyConfigured
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Предупреждение manage.py check --deploy: версия каталога, количество товаров в корзине и отметка чтения
+    с основной базы хранятся в кэше по умолчанию и при нескольких процессах должны быть общими для них.
+    """
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        'The default cache is local to each process.',
+        hint='Catalog and cart badge changes reach other processes only after CATALOG_CACHE_TIMEOUT and '
+             'CART_COUNT_TIMEOUT; use a shared backend (Redis, Memcached, DatabaseCache) with several workers.',
+        id='main.W001',
+    )]
+
+
+@register(deploy=True)
+def check_payment_provider(app_configs, **kwargs):
+    """
+    Ошибка manage.py check --deploy, если платежный провайдер нельзя создать (например, не заданы ключи PayPal):
+    иначе это выяснилось бы только на первом запросе страницы оплаты.
+    """
+    from main.payments import get_provider
+
+    try:
+        get_provider()
+    except ImproperlyConfigured as error:
+        return [Error(str(error), hint='See PAYMENT_PROVIDER in settings.py.', id='main.E001')]
+    return []
@@ -0,0 +1,107 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+REPLICA_ALIAS = 'replica'
+# модели, которые читаются с реплики: каталог и данные отчетов (корзина, заказы и платежи - только с основной базы)
+REPLICA_MODELS = {'main.Pizza', 'main.BestsellerStat', 'main.DailyPizzaSales', 'main.DailyTypeSales', 'main.OrderArchive'}
+PRIMARY_PIN_KEY = 'db:primary-pin'
+
+_state = ContextVar('db_route_state', default=None)
+
+
+def replica_enabled():
+    return REPLICA_ALIAS in connections.databases
+
+
+def start_request(pinned):
+    """
+    Начало маршрутизации запроса (см. main.middleware.ReplicaPinMiddleware).
+
+    :param pinned: Читать с основной базы с начала запроса (клиент недавно что-то записал)
+    :return: Состояние запроса и токен для finish_request.
+    """
+    state = {'pinned': pinned, 'wrote': False}
+    return state, _state.set(state)
+
+
+def finish_request(token):
+    _state.reset(token)
+
+
+def pin_request():
+    """
+    Чтение с основной базы до конца текущего запроса и settings.DATABASE_REPLICA_PIN_SECONDS секунд после него.
+    Вызывается при записи моделей, которые читаются с реплики (см. PrimaryReplicaRouter.db_for_write), при изменении
+    корзины, даже если она хранится не в базе данных (корзина гостя), и при оформлении заказа.
+    """
+    state = _state.get()
+    if state is not None:
+        state['pinned'] = state['wrote'] = True
+
+
+def pin_primary():
+    """
+    Чтение с основной базы для всех клиентов на settings.DATABASE_REPLICA_PIN_SECONDS секунд: для изменений,
+    после которых общий кэш заполняется заново (например, каталога), чтобы в него не попали данные отстающей реплики.
+    Отметка хранится в кэше по умолчанию, поэтому другие процессы видят ее только при общем кэше (см. CACHES).
+    """
+    if replica_enabled():
+        cache.set(PRIMARY_PIN_KEY, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_primary_pinned():
+    return bool(cache.get(PRIMARY_PIN_KEY))
+
+
+class PrimaryReplicaRouter:
+    """
+    Маршрутизатор основной базы и реплики (алиас REPLICA_ALIAS в settings.DATABASES, если он задан).
+    Запись всегда идет в основную базу. Модели REPLICA_MODELS читаются с реплики, кроме чтений внутри транзакции
+    основной базы (по ним принимаются решения о записи) и чтений клиента, который недавно что-то записал
+    (read-your-writes: запрос с записью закрепляет клиента за основной базой, см. ReplicaPinMiddleware).
+    Закрепляет только запись моделей REPLICA_MODELS: сессии, очередь задач и другие таблицы с реплики не читаются,
+    поэтому их запись (например, сессии при входе) клиента не закрепляет.
+    """
+
+    def replica_alias(self):
+        return REPLICA_ALIAS if replica_enabled() else None
+
+    def db_for_read(self, model, **hints):
+        replica = self.replica_alias()
+        if replica is None or model._meta.label not in REPLICA_MODELS:
+            return DEFAULT_DB_ALIAS
+        state = _state.get()
+        if (state is not None and state['pinned']) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        if model._meta.label in REPLICA_MODELS:
+            pin_request()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика - копия основной базы, поэтому связи между объектами из разных алиасов допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """
+    Проверка постоянных соединений (CONN_MAX_AGE) перед запросом: соединение, которое сервер базы данных закрыл
+    (перезапуск, таймаут простоя), закрывается и открывается заново при первом обращении, вместо ошибки в запросе.
+    Замена CONN_HEALTH_CHECKS из Django 4.1, включается settings.DATABASE_HEALTH_CHECKS.
+    """
+    if not settings.DATABASE_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block and not connection.is_usable():
+            connection.close()
@@ -39,7 +39,8 @@ class RegistrationForm(UserCreationForm):
 
 class PizzaCreationForm(forms.ModelForm):
     """
-    Форма добавления пиццы в ассортимент.
+    Форма добавления пиццы в ассортимент. Уменьшенные копии картинки строит сама модель при сохранении
+    (см. Pizza.refresh_image_variants), поэтому они обновляются и при замене картинки через админку.
     """
     class Meta:
         model = Pizza
@@ -52,13 +53,23 @@ class PizzaCreationForm(forms.ModelForm):
     image = forms.ImageField(label='Изображение')
 
 
+class PizzaImportForm(PizzaCreationForm):
+    """
+    Форма проверки строки при импорте меню (manage.py import_menu): те же правила, что и при добавлении пиццы,
+    но картинка необязательна (при обновлении пиццы ее можно не менять).
+    """
+    image = forms.ImageField(label='Изображение', required=False)
+
+
 class CheckoutForm(forms.ModelForm):
     """
     Форма добавления информации о пользователе (телефон и адрес) в базу данных.
+    Скрытое поле checkout_key - ключ идемпотентности: с ним повторная отправка формы не оформляет заказ дважды.
     """
     class Meta:
         model = OrderData
         fields = ('phone', 'address')
+    checkout_key = forms.CharField(max_length=64, widget=forms.HiddenInput)
     phone = forms.CharField(
         label='Номер телефона',
         widget=forms.TextInput(
@@ -0,0 +1,40 @@
+import functools
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class TimeoutSession(requests.Session):
+    """
+    Сессия requests, у которой у каждого запроса есть таймаут (если он не передан явно).
+
+    :param timeout: Таймаут (соединение, чтение), с
+    """
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_session():
+    """
+    Общая для процесса сессия для запросов к внешним сервисам (платежному провайдеру и т.п.): соединения
+    переиспользуются из пула размером HTTP_CLIENT_POOL_SIZE, каждый запрос ограничен таймаутом HTTP_CLIENT_TIMEOUT,
+    а повторы при ошибках соединения делаются только для идемпотентных методов.
+
+    :return: Сессия :class:`~TimeoutSession`.
+    """
+    session = TimeoutSession(settings.HTTP_CLIENT_TIMEOUT)
+    retries = Retry(total=2, connect=2, read=0, backoff_factor=0.2, allowed_methods=frozenset({'GET', 'HEAD'}))
+    adapter = HTTPAdapter(pool_connections=settings.HTTP_CLIENT_POOL_SIZE, pool_maxsize=settings.HTTP_CLIENT_POOL_SIZE,
+                          max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
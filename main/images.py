@@ -0,0 +1,71 @@
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+from main.models import image_storage
+from main.storage import file_digest
+
+IMAGE_VARIANT_WIDTHS = (320, 640, 960)
+# (формат Pillow, расширение, MIME-тип, модуль Pillow, нужный для записи)
+IMAGE_VARIANT_FORMATS = (
+    ('WEBP', 'webp', 'image/webp', 'webp'),
+    ('JPEG', 'jpg', 'image/jpeg', 'jpg'),
+)
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_PATH = 'variants/{digest}/{width}.{extension}'
+
+
+def render_variants(source):
+    """
+    Уменьшенные копии картинки во всех поддерживаемых форматах. Функция не обращается к базе данных и хранилищу,
+    поэтому ее можно выполнять в отдельных процессах (см. команду build_image_variants).
+
+    :param source: Путь к картинке или открытый файл
+    :return: Список словарей с шириной (width), высотой (height), MIME-типом (type), расширением (extension)
+        и содержимым файла (content).
+    """
+    formats = [fmt for fmt in IMAGE_VARIANT_FORMATS if features.check(fmt[3])]
+    variants = []
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    widths = sorted({min(width, image.width) for width in IMAGE_VARIANT_WIDTHS})
+    for pil_format, extension, mime, module in formats:
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            buffer = BytesIO()
+            image.resize((width, height), Image.LANCZOS).save(buffer, pil_format, quality=IMAGE_VARIANT_QUALITY)
+            variants.append({'width': width, 'height': height, 'type': mime, 'extension': extension,
+                             'content': buffer.getvalue()})
+    return variants
+
+
+def store_variants(digest, variants):
+    """
+    Сохранение копий картинки в хранилище. Пути зависят только от содержимого исходной картинки,
+    поэтому копии одинаковых картинок записываются один раз.
+
+    :param digest: Хэш содержимого исходной картинки (file_digest)
+    :param variants: Результат render_variants
+    :return: Значение для Pizza.image_variants (адрес, ширина, высота и MIME-тип каждой копии).
+    """
+    stored = []
+    for variant in variants:
+        name = IMAGE_VARIANT_PATH.format(digest=digest, width=variant['width'], extension=variant['extension'])
+        name = image_storage.save(name, ContentFile(variant['content']))
+        stored.append({'url': image_storage.url(name), 'width': variant['width'], 'height': variant['height'],
+                       'type': variant['type']})
+    return stored
+
+
+def build_variants(image):
+    """
+    Построение и сохранение уменьшенных копий загруженной картинки (до сохранения самой пиццы).
+
+    :param image: Загруженный файл картинки
+    :return: Значение для Pizza.image_variants.
+    """
+    digest = file_digest(image)
+    variants = render_variants(image)
+    image.seek(0)
+    return store_variants(digest, variants)
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.archive import ARCHIVE_BATCH_SIZE, archive_cutoff, archive_orders
+
+
+class Command(BaseCommand):
+    help = ('Переносит оформленные заказы старше заданного возраста из таблиц Order и OrderItem в архив '
+            '(сжатые файлы JSON Lines, см. main.archive) пачками, каждая - отдельной транзакцией. Заказы, еще '
+            'не учтенные в дневных сводках и окнах хитов продаж, не переносятся. Рассчитан на запуск по расписанию.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_ARCHIVE_DAYS,
+                            help='Переносить заказы, оформленные больше стольких дней назад')
+        parser.add_argument('--batch', type=int, default=ARCHIVE_BATCH_SIZE, help='Заказов в одной пачке')
+        parser.add_argument('--max-batches', type=int, help='Перенести не больше стольких пачек за запуск')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+        if cutoff is None:
+            raise CommandError('Дневные сводки еще не строились: сначала запустите manage.py rollup_sales')
+        started = time.perf_counter()
+        archived = archive_orders(options['days'], batch_size=options['batch'], max_batches=options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено заказов: {archived} (оформленных до {cutoff:%Y-%m-%d %H:%M}) '
+            f'за {time.perf_counter() - started:.1f} с'
+        ))
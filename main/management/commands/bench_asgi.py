@@ -0,0 +1,96 @@
+import asyncio
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import JsonResponse
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import include, path
+
+from main.benchmarks import (ASGI_SCENARIOS, ASGI_SYNC_PREFIX, ASGI_WRITE_SCENARIOS, asgi_headers, make_clients,
+                             run_asgi_scenario, seed)
+from main.models import Pizza
+from main.views import cart_summary_payload, catalog_page, parse_cart_changes, update_cart_response
+
+
+def sync_catalog_api(request):
+    return JsonResponse(catalog_page(request.GET, request.path))
+
+
+def sync_update_item(request):
+    return update_cart_response(request, parse_cart_changes(request.body))
+
+
+def sync_cart_summary(request):
+    return JsonResponse(cart_summary_payload(request))
+
+
+# URL-схема прогона: сайт целиком и синхронные двойники асинхронных представлений с той же работой
+urlpatterns = [
+    path(ASGI_SYNC_PREFIX[1:] + '/api/pizzas/', sync_catalog_api),
+    path(ASGI_SYNC_PREFIX[1:] + '/update_item/', sync_update_item),
+    path(ASGI_SYNC_PREFIX[1:] + '/api/cart/', sync_cart_summary),
+    path('', include('pizzeria_project.urls')),
+]
+
+
+class Command(BaseCommand):
+    help = ('Заполняет отдельную тестовую базу данных и сравнивает асинхронные представления корзины и каталога '
+            'с их синхронными двойниками под ASGI: запросы отправляются ASGI-приложению Django в этом же процессе '
+            'с заданным количеством одновременных запросов. Печатает p50/p95/p99 и запросы в секунду.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pizzas', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=500, help='Сколько запросов выполнять в каждом прогоне')
+        parser.add_argument('--concurrency', type=int, default=20, help='Сколько запросов выполняется одновременно')
+        parser.add_argument('--scenario', action='append', choices=sorted(ASGI_SCENARIOS),
+                            help='Прогнать только эти сценарии (можно указать несколько раз)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            seed(random.Random(options['seed']), pizzas=options['pizzas'], orders=options['orders'])
+            self.stdout.write(f'Данные созданы за {time.perf_counter() - started:.1f} с')
+            with override_settings(ROOT_URLCONF=__name__):
+                results = asyncio.run(self.run(options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f'\n{"сценарий":<32} {"одновр.":>7} {"p50":>8} {"p95":>8} {"p99":>8} {"rps":>8} {"ошибки":>7}')
+        for (client, scenario, mode), result in results.items():
+            self.stdout.write(
+                f'{client + ":" + scenario + ":" + mode:<32} {result["concurrency"]:>7} {result["p50_ms"]:>8.2f} '
+                f'{result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} {result["rps"]:>8.0f} {result["errors"]:>7}'
+            )
+        if any(result['errors'] for result in results.values()):
+            raise CommandError('Часть запросов завершилась ошибкой')
+
+    async def run(self, options):
+        # пользователь, сессия и список пицц создаются синхронным кодом в потоке (sync_to_async, как в main.views)
+        clients, pizza_ids = await sync_to_async(
+            lambda: (make_clients(), list(Pizza.objects.values_list('id', flat=True)))
+        )()
+        application = get_asgi_application()
+        rng = random.Random(options['seed'])
+        results = {}
+        for client_name, client in clients.items():
+            headers = asgi_headers(client)
+            for scenario in options['scenario'] or ASGI_SCENARIOS:
+                concurrency = options['concurrency']
+                if connection.vendor == 'sqlite' and scenario in ASGI_WRITE_SCENARIOS:
+                    # SQLite не допускает одновременных записей из потоков разных запросов
+                    concurrency = 1
+                for mode, prefix in (('sync', ASGI_SYNC_PREFIX), ('async', '')):
+                    result = await run_asgi_scenario(application, scenario, headers, rng, pizza_ids,
+                                                     options['requests'], concurrency, prefix)
+                    results[client_name, scenario, mode] = dict(result, concurrency=concurrency)
+        return results
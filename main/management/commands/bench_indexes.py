@@ -0,0 +1,138 @@
+import random
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+from main.models import Pizza as CurrentPizza
+
+
+def historical_models(migration):
+    """
+    Модели в том виде, в каком они были на миграции migration: текущие модели могут ссылаться на колонки,
+    которых в старой схеме еще нет.
+
+    :return: Словарь {имя модели: модель}.
+    """
+    apps = MigrationExecutor(connection).loader.project_state(('main', migration)).apps
+    models = {name: apps.get_model('main', name) for name in ('Customer', 'Order', 'OrderItem', 'Pizza')}
+    models['User'] = apps.get_model('auth', 'User')
+    return models
+
+
+def hot_queries(models, rng, pizza_type_count, customer_ids, order_ids, pizza_ids):
+    """
+    Запросы с горячих путей сайта: каждый вызов строит QuerySet со случайными параметрами.
+    """
+    Order, OrderItem, Pizza = models['Order'], models['OrderItem'], models['Pizza']
+    return {
+        'open_order': lambda: Order.objects.filter(customer_id=rng.choice(customer_ids), complete=False)[:1],
+        'assortment_by_type': lambda: Pizza.objects.filter(type=rng.randrange(pizza_type_count)).order_by('-rating', '-id')[:24],
+        'topsellers': lambda: Pizza.objects.order_by('-rating', '-id')[:24],
+        'cart_line': lambda: OrderItem.objects.filter(order_id=rng.choice(order_ids), pizza_id=rng.choice(pizza_ids))[:1],
+    }
+
+
+class Command(BaseCommand):
+    help = ('Заполняет отдельную тестовую базу данных (по умолчанию 100k пицц, 1M заказов, 5M товаров в заказах) '
+            'и сравнивает планы и время горячих запросов на схеме до миграций с индексами (0004) и после них. '
+            'Данные и запросы строятся по историческим моделям схемы 0004, поэтому одни и те же запросы '
+            'выполняются на обеих схемах.')
+
+    SCHEMA_BEFORE = '0004_customer_bonus_points'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pizzas', type=int, default=100_000)
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--items', type=int, default=5_000_000)
+        parser.add_argument('--customers', type=int, default=50_000)
+        parser.add_argument('--repeat', type=int, default=200, help='Сколько раз выполнять каждый запрос')
+        parser.add_argument('--batch-size', type=int, default=20_000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            # 5M строк не стоит держать в памяти: тестовая база SQLite создается рядом с основной
+            connection.settings_dict['TEST']['NAME'] = f'{old_name}.bench'
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.migrate(self.SCHEMA_BEFORE)
+            models = historical_models(self.SCHEMA_BEFORE)
+            rng = random.Random(options['seed'])
+            ids = self.seed(models, rng, options)
+            queries = hot_queries(models, rng, len(CurrentPizza.TYPE_VARIANTS), *ids)
+
+            before = self.measure(queries, options['repeat'], 'без индексов')
+            started = time.perf_counter()
+            self.migrate(None)
+            self.stdout.write(f'\nМиграции с индексами применены за {time.perf_counter() - started:.1f} с')
+            after = self.measure(queries, options['repeat'], 'с индексами')
+
+            self.stdout.write('\nИтог (медиана, мс):')
+            for name in queries:
+                speedup = before[name] / after[name] if after[name] else float('inf')
+                self.stdout.write(f'  {name:<20} {before[name]:>10.3f} -> {after[name]:>8.3f}  x{speedup:.1f}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, models, rng, options):
+        User, Customer, Order, OrderItem, Pizza = (models[name] for name in ('User', 'Customer', 'Order', 'OrderItem', 'Pizza'))
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+        author = User.objects.create(username='bench')
+
+        Pizza.objects.bulk_create((
+            Pizza(author=author, name=f'Пицца {i}', description='', image='pizza.png',
+                  price=rng.randint(300, 1500), rating=rng.randint(0, 1000),
+                  type=rng.randrange(len(CurrentPizza.TYPE_VARIANTS)))
+            for i in range(options['pizzas'])
+        ), batch_size=batch_size)
+        Customer.objects.bulk_create((Customer(name=f'Покупатель {i}') for i in range(options['customers'])),
+                                     batch_size=batch_size)
+        pizza_ids = list(Pizza.objects.values_list('id', flat=True))
+        customer_ids = list(Customer.objects.values_list('id', flat=True))
+
+        # у каждого покупателя ровно один открытый заказ, остальные заказы завершены
+        Order.objects.bulk_create((
+            Order(customer_id=customer_ids[i] if i < len(customer_ids) else rng.choice(customer_ids),
+                  complete=i >= len(customer_ids))
+            for i in range(options['orders'])
+        ), batch_size=batch_size)
+        order_ids = list(Order.objects.values_list('id', flat=True))
+
+        per_order = max(1, options['items'] // max(1, len(order_ids)))
+        OrderItem.objects.bulk_create((
+            OrderItem(order_id=order_id, pizza_id=pizza_id, quantity=rng.randint(1, 3))
+            for order_id in order_ids
+            for pizza_id in rng.sample(pizza_ids, min(per_order, len(pizza_ids)))
+        ), batch_size=batch_size)
+
+        self.stdout.write(f'Данные созданы за {time.perf_counter() - started:.1f} с: '
+                          f'{len(pizza_ids)} пицц, {len(order_ids)} заказов, {OrderItem.objects.count()} товаров')
+        return customer_ids, order_ids, pizza_ids
+
+    def migrate(self, target):
+        args = ['main', target] if target else ['main']
+        call_command('migrate', *args, verbosity=0)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def measure(self, queries, repeat, title):
+        self.stdout.write(f'\n=== {title} ===')
+        medians = {}
+        for name, build in queries.items():
+            self.stdout.write(f'{name}:\n  {build().explain()}')
+            timings = []
+            for _ in range(repeat):
+                queryset = build()
+                started = time.perf_counter()
+                list(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            medians[name] = statistics.median(timings)
+            self.stdout.write(f'  медиана {medians[name]:.3f} мс, p95 {timings[int(len(timings) * 0.95) - 1]:.3f} мс')
+        return medians
@@ -0,0 +1,78 @@
+import statistics
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+
+from main.benchmarks import count_writes
+
+LEGACY_UID = 'bench_profile_writes.legacy_save_customer'
+
+
+def legacy_save_customer(sender, instance, **kwargs):
+    """
+    Прежний обработчик post_save для User: читал покупателя и перезаписывал его строку при каждом сохранении.
+    """
+    instance.customer.save()
+
+
+class Command(BaseCommand):
+    help = ('Считает SQL-запросы и записи (INSERT/UPDATE/DELETE) при регистрации и входе пользователя '
+            'с прежним обработчиком save_customer и без него, в отдельной тестовой базе данных.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # скорость хэширования паролей здесь не интересна
+            with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+                post_save.connect(legacy_save_customer, sender=User, dispatch_uid=LEGACY_UID)
+                try:
+                    before = self.measure('legacy', options['users'])
+                finally:
+                    post_save.disconnect(sender=User, dispatch_uid=LEGACY_UID)
+                after = self.measure('current', options['users'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f'\n{"":<14} {"запросы":>16} {"записи":>16}')
+        for flow in ('registration', 'login'):
+            (queries_before, writes_before), (queries_after, writes_after) = before[flow], after[flow]
+            self.stdout.write(f'{flow:<14} {queries_before:>7.1f} -> {queries_after:<6.1f} '
+                              f'{writes_before:>7.1f} -> {writes_after:<6.1f}')
+            self.stdout.write(f'{"":<14} сэкономлено записей на операцию: {writes_before - writes_after:.1f}')
+
+    def measure(self, prefix, users):
+        """
+        Регистрация и вход users пользователей через настоящие адреса сайта.
+
+        :return: Словарь {операция: (среднее количество запросов, среднее количество записей)}.
+        """
+        results = {'registration': [], 'login': []}
+        for number in range(users):
+            username, password = f'{prefix}-{number}', 'Bench-password-1'
+            client = Client()
+            with CaptureQueriesContext(connection) as captured:
+                response = client.post('/accounts/registration/', {
+                    'username': username, 'password1': password, 'password2': password,
+                })
+            assert response.status_code == 302, response.status_code
+            results['registration'].append((len(captured), count_writes(captured)))
+
+            with CaptureQueriesContext(connection) as captured:
+                response = client.post('/login/', {'username': username, 'password': password})
+            assert response.status_code == 302, response.status_code
+            results['login'].append((len(captured), count_writes(captured)))
+        return {
+            flow: (statistics.mean(q for q, w in rows), statistics.mean(w for q, w in rows))
+            for flow, rows in results.items()
+        }
@@ -0,0 +1,62 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from main.benchmarks import SCENARIOS, check_results, run_suite, seed
+
+
+class Command(BaseCommand):
+    help = ('Заполняет отдельную тестовую базу данных и прогоняет сценарии витрины (каталог, хиты продаж, корзина, '
+            'оформление, оплата) для гостя и покупателя через тестовый клиент Django. Печатает p50/p95/p99, '
+            'запросы в секунду и SQL-запросы на запрос; завершается ошибкой при превышении бюджета SQL-запросов '
+            'или замедлении относительно базового прогона.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pizzas', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=50, help='Сколько раз выполнять каждый сценарий')
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                            help='Прогнать только эти сценарии (можно указать несколько раз)')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--baseline', help='JSON с результатами базового прогона для сравнения p95')
+        parser.add_argument('--save', help='Сохранить результаты в JSON (например, как новый базовый прогон)')
+        parser.add_argument('--max-regression', type=float, default=0.25,
+                            help='Допустимое замедление p95 относительно базового прогона (доля)')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as stream:
+                baseline = json.load(stream)
+
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            seed(random.Random(options['seed']), pizzas=options['pizzas'], orders=options['orders'])
+            self.stdout.write(f'Данные созданы за {time.perf_counter() - started:.1f} с')
+            results = run_suite(options['repeat'], options['seed'], options['scenario'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f'\n{"сценарий":<28} {"p50":>8} {"p95":>8} {"p99":>8} {"rps":>8} {"SQL":>6} {"макс":>5}')
+        for (client, scenario), result in results.items():
+            self.stdout.write(
+                f'{client + ":" + scenario:<28} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} '
+                f'{result["p99_ms"]:>8.2f} {result["rps"]:>8.0f} {result["queries"]:>6.1f} {result["max_queries"]:>5}'
+            )
+
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as stream:
+                json.dump({':'.join(key): result for key, result in results.items()}, stream, indent=2)
+
+        failures = check_results(results, baseline, options['max_regression'])
+        if failures:
+            raise CommandError('Превышены пороги:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('\nВсе сценарии в пределах бюджетов'))
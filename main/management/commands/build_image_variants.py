@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.catalog import bump_catalog_version
+from main.images import render_variants, store_variants
+from main.models import Pizza
+from main.storage import file_digest
+
+
+def _render(path):
+    try:
+        with open(path, 'rb') as source:
+            digest = file_digest(File(source))
+            return (digest, render_variants(source)), None
+    except (OSError, ValueError) as error:
+        return None, str(error)
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии картинок пиццы, загруженных до появления image_variants (в нескольких процессах).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Количество процессов')
+        parser.add_argument('--all', action='store_true', help='Перестроить копии и для пицц, у которых они уже есть')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        pizzas = Pizza.objects.exclude(image='').only('id', 'image').order_by('id')
+        if not options['all']:
+            pizzas = pizzas.filter(image_variants=[])
+        pizzas = list(pizzas)
+        if not pizzas:
+            self.stdout.write('Все картинки уже обработаны.')
+            return
+
+        started = time.perf_counter()
+        done = failed = 0
+        # процессы-обработчики не работают с базой, но не должны унаследовать открытые соединения
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for start in range(0, len(pizzas), options['batch_size']):
+                batch = pizzas[start:start + options['batch_size']]
+                updated = []
+                for pizza, (result, error) in zip(batch, executor.map(_render, [p.image.path for p in batch])):
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'Пицца {pizza.id}: {error}')
+                        continue
+                    pizza.image_variants = store_variants(*result)
+                    updated.append(pizza)
+                Pizza.objects.bulk_update(updated, ['image_variants'])
+                done += len(updated)
+                self.stdout.write(f'{done + failed}/{len(pizzas)}')
+
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {done} за {time.perf_counter() - started:.1f} с, ошибок: {failed}'
+        ))
@@ -0,0 +1,71 @@
+import csv
+import json
+import os
+import shutil
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.models import Pizza
+
+MENU_FIELDS = ('id', 'name', 'description', 'type', 'price', 'rating', 'image')
+
+
+def detect_format(path, fmt):
+    """
+    Формат файла меню: явно заданный или по расширению (.csv/.jsonl).
+    """
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+
+
+class Command(BaseCommand):
+    help = 'Выгружает меню (все пиццы) в CSV или JSONL потоково, не загружая всю таблицу в память.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для записи ("-" - стандартный вывод)')
+        parser.add_argument('--format', choices=('csv', 'jsonl'))
+        parser.add_argument('--images-dir', help='Каталог, в который копируются картинки (для последующего import_menu)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        images_dir = options['images_dir']
+        if images_dir:
+            os.makedirs(images_dir, exist_ok=True)
+
+        started = time.perf_counter()
+        output = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            writer = None
+            if fmt == 'csv':
+                writer = csv.DictWriter(output, fieldnames=MENU_FIELDS)
+                writer.writeheader()
+            count = 0
+            rows = Pizza.objects.order_by('id').values_list(*MENU_FIELDS).iterator(chunk_size=options['batch_size'])
+            for values in rows:
+                row = dict(zip(MENU_FIELDS, values))
+                if row['image']:
+                    if images_dir:
+                        shutil.copyfile(Pizza.image.field.storage.path(row['image']),
+                                        os.path.join(images_dir, os.path.basename(row['image'])))
+                    row['image'] = os.path.basename(row['image'])
+                if writer:
+                    writer.writerow(row)
+                else:
+                    output.write(json.dumps(row, ensure_ascii=False) + '\n')
+                count += 1
+                if count % options['batch_size'] == 0:
+                    self.report(count, started)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.report(count, started, final=True)
+
+    def report(self, count, started, final=False):
+        elapsed = time.perf_counter() - started
+        message = f'Выгружено: {count} строк за {elapsed:.1f} с ({count / elapsed if elapsed else 0:.0f} строк/с)'
+        self.stderr.write(self.style.SUCCESS(message) if final else message)
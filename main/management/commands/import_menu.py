@@ -0,0 +1,169 @@
+import csv
+import json
+import os
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from main.catalog import bump_catalog_version
+from main.forms import PizzaImportForm
+from main.management.commands.export_menu import MENU_FIELDS, detect_format
+from main.models import Pizza
+
+UPDATE_FIELDS = ('name', 'description', 'type', 'price', 'rating', 'image', 'image_variants')
+
+
+def read_rows(stream, fmt):
+    """
+    Потоковое чтение строк меню из CSV или JSONL.
+
+    :return: Генератор пар (номер строки, словарь полей); для строки JSONL, которая не разбирается
+        в объект JSON, вместо словаря - None.
+    """
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=2):
+            yield number, row
+    else:
+        for number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield number, row if isinstance(row, dict) else None
+
+
+class Command(BaseCommand):
+    help = ('Загружает меню из CSV или JSONL пачками: строки проверяются по правилам формы добавления пиццы, '
+            'новые пиццы создаются через bulk_create, строки с существующим id обновляются через bulk_update. '
+            'Пиццы с id, которого нет в базе, создаются с этим id, поэтому файл export_menu загружается '
+            'в пустую базу и повторная загрузка того же файла ничего не дублирует.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл меню ("-" - стандартный ввод)')
+        parser.add_argument('--format', choices=('csv', 'jsonl'))
+        parser.add_argument('--author', required=True, help='Имя пользователя, от которого добавляются пиццы')
+        parser.add_argument('--images-dir', help='Каталог с картинками, имена которых указаны в колонке image')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-errors', type=int, default=100,
+                            help='После скольких ошибочных строк остановить импорт')
+
+    def handle(self, *args, **options):
+        try:
+            self.author = get_user_model().objects.get(username=options['author'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'Пользователь {options["author"]} не найден')
+        self.images_dir = options['images_dir']
+        self.max_errors = options['max_errors']
+        self.created = self.updated = self.errors = 0
+        self.started = time.perf_counter()
+
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            batch = []
+            for number, row in read_rows(stream, fmt):
+                if row is None:
+                    self.error(number, 'строка не является объектом JSON')
+                    continue
+                batch.append((number, row))
+                if len(batch) >= options['batch_size']:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if self.created or self.updated:
+                bump_catalog_version()
+        self.report(final=True)
+
+    def import_batch(self, batch):
+        if self.created or self.updated or self.errors:
+            # ход импорта до этой пачки; итог после последней пачки печатает handle
+            self.report()
+        ids = [int(row['id']) for number, row in batch if str(row.get('id') or '').isdigit()]
+        existing = Pizza.objects.in_bulk(ids)
+        new, changed = [], []
+        for number, row in batch:
+            pizza = self.validate(number, row, existing)
+            if pizza is not None:
+                (changed if pizza.pk in existing else new).append(pizza)
+
+        with transaction.atomic():
+            Pizza.objects.bulk_create(new)
+            Pizza.objects.bulk_update(changed, UPDATE_FIELDS)
+            if any(pizza.pk for pizza in new):
+                # пиццы с явными id не сдвигают последовательность id (PostgreSQL), как и в loaddata
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), [Pizza]):
+                        cursor.execute(sql)
+        self.created += len(new)
+        self.updated += len(changed)
+
+    def validate(self, number, row, existing):
+        """
+        Проверка строки формой PizzaImportForm. Для новой картинки строятся уменьшенные копии, а сама она сразу
+        записывается в хранилище, и ее файл закрывается: bulk_create и bulk_update сохраняют только строки.
+
+        :return: Несохраненная пицца или None, если строка с ошибкой.
+        """
+        row_id = str(row.get('id') or '')
+        if row_id and not row_id.isdigit():
+            return self.error(number, f'некорректный id {row_id}')
+        if row_id and int(row_id) in existing:
+            instance = existing[int(row_id)]
+        else:
+            instance = Pizza(pk=int(row_id) if row_id else None, author=self.author)
+        data = {field: row.get(field) for field in MENU_FIELDS if field not in ('id', 'image')}
+
+        if not row.get('image'):
+            if instance.pk not in existing:
+                return self.error(number, 'у новой пиццы должна быть картинка')
+            return self.check(number, PizzaImportForm(data, {}, instance=instance))
+        if not self.images_dir:
+            return self.error(number, 'указана картинка, но не задан --images-dir')
+        image_path = os.path.join(self.images_dir, os.path.basename(row['image']))
+        try:
+            image = open(image_path, 'rb')
+        except OSError as error:
+            return self.error(number, f'картинка не открывается: {error}')
+        with image:
+            uploads = {'image': File(image, name=os.path.basename(image_path))}
+            pizza = self.check(number, PizzaImportForm(data, uploads, instance=instance))
+            if pizza is not None:
+                pizza.refresh_image_variants()
+                Pizza._meta.get_field('image').pre_save(pizza, add=instance.pk not in existing)
+        return pizza
+
+    def check(self, number, form):
+        if not form.is_valid():
+            return self.error(number, '; '.join(f'{field}: {" ".join(errors)}' for field, errors in form.errors.items()))
+        return form.save(commit=False)
+
+    def error(self, number, message):
+        """
+        Учет строки с ошибкой.
+
+        :return: None (вместо пиццы).
+        :raises CommandError: Если ошибок набралось --max-errors.
+        """
+        self.errors += 1
+        self.stderr.write(f'Строка {number}: {message}')
+        if self.errors >= self.max_errors:
+            raise CommandError(f'Слишком много ошибок ({self.errors}), импорт остановлен')
+        return None
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        done = self.created + self.updated
+        message = (f'Создано: {self.created}, обновлено: {self.updated}, ошибок: {self.errors} '
+                   f'за {elapsed:.1f} с ({done / elapsed if elapsed else 0:.0f} строк/с)')
+        self.stdout.write(self.style.SUCCESS(message) if final else message)
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.bestsellers import rebuild_bestsellers
+from main.models import BestsellerStat
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинг хитов продаж по оформленным заказам. Нужен один раз после установки '
+            'и после изменения BESTSELLER_WINDOWS; дальше рейтинг обновляется при оформлении заказов.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuild_bestsellers()
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинг пересчитан за {time.perf_counter() - started:.1f} с: {BestsellerStat.objects.count()} строк'
+        ))
@@ -0,0 +1,29 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.analytics import ROLLUP_STEP, get_rollup_position, rollup_sales
+from main.archive import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ('Дописывает в дневные сводки продаж (по пиццам и по типам) заказы, оформленные после прошлого запуска. '
+            'Рассчитан на запуск по расписанию, например раз в несколько минут из cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Удалить сводки и пересчитать все заказы заново (включая архив заказов)')
+        parser.add_argument('--step-hours', type=int, default=int(ROLLUP_STEP.total_seconds() // 3600),
+                            help='Размер шага (одна транзакция) в часах')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            processed = rebuild_rollups()
+        else:
+            processed = rollup_sales(step=datetime.timedelta(hours=options['step_hours']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Учтено пицц: {processed} за {time.perf_counter() - started:.1f} с, '
+            f'сводки актуальны на {get_rollup_position():%Y-%m-%d %H:%M}'
+        ))
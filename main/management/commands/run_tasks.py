@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.tasks import purge_tasks, requeue_stale, run_pending
+
+PURGE_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = ('Исполнитель фоновых задач (main.tasks): выполняет задачи из очереди в базе данных, повторяет упавшие '
+            'с растущей задержкой и возвращает в очередь задачи упавших исполнителей. Можно запускать несколько '
+            'исполнителей одновременно; с --once - выполнить накопившиеся задачи и выйти (для cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить задачи, срок которых наступил, и выйти')
+        parser.add_argument('--batch', type=int, default=100, help='Сколько задач брать за раз')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза между проверками пустой очереди, секунды')
+
+    def handle(self, *args, **options):
+        purged_at = 0
+        try:
+            while True:
+                if time.monotonic() - purged_at > PURGE_INTERVAL:
+                    purge_tasks()
+                    purged_at = time.monotonic()
+                requeue_stale()
+                done, failed = run_pending(options['batch'])
+                if done or failed:
+                    self.stdout.write(f'Выполнено задач: {done}, с ошибкой: {failed}')
+                if options['once']:
+                    return
+                if not (done or failed):
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Исполнитель остановлен')
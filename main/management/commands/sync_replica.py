@@ -0,0 +1,28 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from main.db import REPLICA_ALIAS, replica_enabled
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в файл реплики (settings.DATABASE_REPLICA) - замена репликации '
+            'для проверки маршрутизации чтений на одной машине. Можно запускать по расписанию, чтобы '
+            'имитировать отставание реплики.')
+
+    def handle(self, *args, **options):
+        if not replica_enabled():
+            raise CommandError('Реплика не настроена: задайте settings.DATABASE_REPLICA')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[REPLICA_ALIAS]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Команда только для SQLite, реплику PostgreSQL обновляет репликация сервера')
+        replica.close()
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        target = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        self.stdout.write(self.style.SUCCESS(f'{primary.settings_dict["NAME"]} скопирована в {replica.settings_dict["NAME"]}'))
@@ -0,0 +1,164 @@
+import asyncio
+import random
+import time
+from abc import ABC, abstractmethod
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from main import db
+from main.perf import finish_request, record, server_timing, start_request
+
+
+class DualModeMiddleware(ABC):
+    """
+    Основа middleware, которое работает и в синхронной, и в асинхронной цепочке без лишних переходов между
+    потоками: под ASGI асинхронные представления (update_item, catalog_api, cart_summary) вызываются напрямую,
+    а синхронные Django сам оборачивает в sync_to_async. Подклассы реализуют process (синхронная цепочка)
+    и __acall__ (асинхронная).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # как в django.utils.deprecation.MiddlewareMixin: обработчик Django проверяет этот признак
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request)
+
+    @abstractmethod
+    def process(self, request):
+        pass
+
+    @abstractmethod
+    async def __acall__(self, request):
+        pass
+
+
+class CartCookieMiddleware(DualModeMiddleware):
+    """
+    Удаляет cookie корзины гостя, если во время запроса ее содержимое перенесено в базу данных
+    (см. utils.merge_guest_cart).
+    """
+
+    def process(self, request):
+        return self.clear_cookies(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.clear_cookies(request, await self.get_response(request))
+
+    @staticmethod
+    def clear_cookies(request, response):
+        if getattr(request, 'clear_cart_cookie', False):
+            for name in ('cart', settings.GUEST_CART_COOKIE):
+                if name in request.COOKIES:
+                    response.delete_cookie(name)
+        return response
+
+
+def _wrap_connections(stats):
+    """
+    Подключение замеров stats ко всем соединениям с базой данных текущего потока.
+
+    :return: ExitStack, закрытие которого отключает замеры.
+    """
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(stats))
+    return stack
+
+
+class PerfMiddleware(DualModeMiddleware):
+    """
+    Замеры по представлениям (см. main.perf и страницу /staff/perf/): время ответа считается для всех запросов,
+    а количество и время SQL-запросов, время шаблонов и повторы SQL - для доли settings.PERF_SAMPLE_RATE,
+    поэтому в рабочем режиме middleware можно не выключать. При settings.PERF_SERVER_TIMING (по умолчанию - только
+    в DEBUG) замеры отдаются и в заголовке Server-Timing.
+    Должен стоять первым в MIDDLEWARE, чтобы учитывать время остальных middleware.
+    """
+
+    def process(self, request):
+        started = time.perf_counter()
+        stats = None
+        if random.random() < settings.PERF_SAMPLE_RATE:
+            stats, token = start_request()
+            try:
+                with _wrap_connections(stats):
+                    response = self.get_response(request)
+            finally:
+                finish_request(token)
+        else:
+            response = self.get_response(request)
+        return self.finish(request, response, started, stats)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats = None
+        if random.random() < settings.PERF_SAMPLE_RATE:
+            stats, token = start_request()
+            # соединения у каждого потока свои, поэтому замеры подключаются в том потоке, где sync_to_async
+            # выполняет работу с базой этого запроса
+            stack = await sync_to_async(_wrap_connections)(stats)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+                finish_request(token)
+        else:
+            response = await self.get_response(request)
+        return self.finish(request, response, started, stats)
+
+    @staticmethod
+    def finish(request, response, started, stats):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        record(match.view_name if match else 'unresolved', elapsed, stats)
+        if settings.PERF_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(elapsed, stats)
+        return response
+
+
+class ReplicaPinMiddleware(DualModeMiddleware):
+    """
+    Read-your-writes для реплики (см. main.db): если запрос изменил то, что читается с реплики (каталог, рейтинг
+    хитов), или корзину и заказы, клиент получает cookie settings.DATABASE_REPLICA_PIN_COOKIE и settings.DATABASE_REPLICA_PIN_SECONDS
+    секунд читает только с основной базы. Без реплики в settings.DATABASES ничего не делает.
+    """
+
+    def process(self, request):
+        if not db.replica_enabled():
+            return self.get_response(request)
+        state, token = db.start_request(self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            db.finish_request(token)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        if not db.replica_enabled():
+            return await self.get_response(request)
+        state, token = db.start_request(self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            db.finish_request(token)
+        return self.pin(state, response)
+
+    @staticmethod
+    def pinned(request):
+        return settings.DATABASE_REPLICA_PIN_COOKIE in request.COOKIES or db.is_primary_pinned()
+
+    @staticmethod
+    def pin(state, response):
+        if state['wrote']:
+            response.set_cookie(settings.DATABASE_REPLICA_PIN_COOKIE, '1', max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
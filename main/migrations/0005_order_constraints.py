@@ -0,0 +1,50 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:19
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Перед добавлением ограничений сливает дубликаты, которые могли появиться из-за гонок:
+    несколько открытых заказов одного покупателя и несколько строк одной пиццы в заказе.
+    """
+    Order = apps.get_model('main', 'Order')
+    OrderItem = apps.get_model('main', 'OrderItem')
+
+    duplicated_customers = (Order.objects.filter(complete=False, customer__isnull=False)
+                            .values('customer').annotate(n=Count('id')).filter(n__gt=1)
+                            .values_list('customer', flat=True))
+    for customer_id in duplicated_customers:
+        orders = list(Order.objects.filter(customer_id=customer_id, complete=False).order_by('id'))
+        kept, extra = orders[0], orders[1:]
+        OrderItem.objects.filter(order__in=extra).update(order=kept)
+        Order.objects.filter(id__in=[order.id for order in extra]).delete()
+
+    duplicated_lines = (OrderItem.objects.filter(order__isnull=False, pizza__isnull=False)
+                        .values('order', 'pizza').annotate(n=Count('id')).filter(n__gt=1))
+    for line in duplicated_lines:
+        items = list(OrderItem.objects.filter(order_id=line['order'], pizza_id=line['pizza']).order_by('id'))
+        kept = items[0]
+        kept.quantity = sum(item.quantity or 0 for item in items)
+        kept.save(update_fields=['quantity'])
+        OrderItem.objects.filter(id__in=[item.id for item in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_customer_bonus_points'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('complete', False)), fields=('customer',), name='unique_open_order_per_customer'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'pizza'), name='unique_pizza_per_order'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_order_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'complete'], name='order_customer_complete_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('complete', True)), fields=['date_ordered'], name='order_completed_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pizza',
+            index=models.Index(fields=['-rating', '-id'], name='pizza_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pizza',
+            index=models.Index(fields=['type', '-rating', '-id'], name='pizza_type_rating_idx'),
+        ),
+    ]
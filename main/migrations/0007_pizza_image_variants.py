@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pizza',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
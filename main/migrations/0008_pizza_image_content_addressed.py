@@ -0,0 +1,20 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:27
+
+from django.db import migrations, models
+import main.models
+import main.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_pizza_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pizza',
+            name='image',
+            field=models.ImageField(storage=main.storage.ContentAddressedStorage(), upload_to=main.models.pizza_image_directory_pass),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_checkout_finalization'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestsellerWindow',
+            fields=[
+                ('name', models.CharField(max_length=16, primary_key=True, serialize=False)),
+                ('start', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PizzaSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('pizza', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.pizza')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BestsellerStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=16)),
+                ('quantity', models.IntegerField(default=0)),
+                ('pizza', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.pizza')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pizzasales',
+            index=models.Index(fields=['hour'], name='pizza_sales_hour_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pizzasales',
+            constraint=models.UniqueConstraint(fields=('pizza', 'hour'), name='unique_pizza_sales_hour'),
+        ),
+        migrations.AddIndex(
+            model_name='bestsellerstat',
+            index=models.Index(fields=['window', '-quantity', 'pizza'], name='bestseller_ranking_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bestsellerstat',
+            constraint=models.UniqueConstraint(fields=('window', 'pizza'), name='unique_bestseller_window_pizza'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_bestseller_ranking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPizzaSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyTypeSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('type', models.IntegerField(choices=[(0, 'С курицей'), (1, 'С говядиной'), (2, 'С колбасой'), (3, 'Вегетарианская')])),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('position', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailytypesales',
+            constraint=models.UniqueConstraint(fields=('day', 'type'), name='unique_daily_type_sales'),
+        ),
+        migrations.AddField(
+            model_name='dailypizzasales',
+            name='pizza',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.pizza'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailypizzasales',
+            constraint=models.UniqueConstraint(fields=('day', 'pizza'), name='unique_daily_pizza_sales'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=32)),
+                ('intent_id', models.CharField(max_length=128, unique=True)),
+                ('amount', models.IntegerField()),
+                ('currency', models.CharField(max_length=3)),
+                ('status', models.CharField(choices=[('created', 'Ожидает оплаты'), ('captured', 'Оплачен'), ('failed', 'Ошибка')], default='created', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('captured_at', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='main.order')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='payment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'captured')), fields=('order',), name='unique_captured_payment_per_order'),
+        ),
+    ]
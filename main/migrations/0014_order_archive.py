@@ -0,0 +1,26 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_task_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('first_order', models.BigIntegerField()),
+                ('last_order', models.BigIntegerField()),
+                ('first_ordered', models.DateTimeField()),
+                ('last_ordered', models.DateTimeField()),
+                ('orders', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,13 +1,27 @@
+from dataclasses import dataclass
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
+from django.utils.functional import cached_property
+
+from main.storage import ContentAddressedStorage, content_addressed_name, file_digest
+
+BONUS_RATE = 0.05
+
+image_storage = ContentAddressedStorage()
 
 
 def pizza_image_directory_pass(instance, filename):
-    return f'media/{instance.id}_{filename}'
+    """
+    Путь загружаемой картинки пиццы по хэшу ее содержимого (не зависит от того, сохранена ли пицца).
+    """
+    return content_addressed_name(file_digest(instance.image), filename, 'pizzas')
 
 
 class Pizza(models.Model):
@@ -22,6 +36,7 @@ class Pizza(models.Model):
     :param price: Цена
     :param rating: Рейтинг пиццы (добавляется вручную)
     :param type: Один из четырех типов (TYPE_VARIANTS) - с курицей/с говядиной/с колбасой/вегетарианская
+    :param image_variants: Уменьшенные копии картинки (адрес, ширина, высота и MIME-тип каждой), см. main.images
     """
     TYPE_VARIANTS = (
         (0, 'С курицей'),
@@ -32,11 +47,48 @@ class Pizza(models.Model):
     author = models.ForeignKey(to=get_user_model(), on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     description = models.TextField()
-    image = models.ImageField()
+    image = models.ImageField(upload_to=pizza_image_directory_pass, storage=image_storage)
     created_at = models.DateTimeField(default=timezone.now)
     price = models.IntegerField()
     rating = models.IntegerField()
     type = models.IntegerField(default=0, choices=TYPE_VARIANTS)
+    image_variants = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-rating', '-id'], name='pizza_rating_idx'),
+            models.Index(fields=['type', '-rating', '-id'], name='pizza_type_rating_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        pizza = super().from_db(db, field_names, values)
+        if 'image' in field_names:
+            pizza._loaded_image = pizza.image.name
+        return pizza
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'image' in update_fields:
+            self.refresh_image_variants()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'image_variants'}
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name
+
+    def refresh_image_variants(self):
+        """
+        Уменьшенные копии для новой картинки (вызывается перед записью пиццы, в том числе из админки и из import_menu,
+        который пишет пиццы через bulk_create): для только что загруженного файла копии строятся, а если картинку
+        заменили уже сохраненным файлом, старые копии сбрасываются (их строит manage.py build_image_variants).
+        """
+        # main.images импортирует хранилище картинок из этого модуля
+        from main.images import build_variants
+
+        if self.image and not self.image._committed:
+            self.image_variants = build_variants(self.image)
+        elif getattr(self, '_loaded_image', None) is not None and self.image.name != self._loaded_image:
+            self.image_variants = []
 
     @staticmethod
     def get_all():
@@ -50,6 +102,18 @@ class Pizza(models.Model):
             url = ''
         return url
 
+    @property
+    def image_sources(self):
+        """
+        Наборы уменьшенных копий картинки для тегов <source> в порядке форматов из main.images.IMAGE_VARIANT_FORMATS.
+
+        :return: Список словарей с MIME-типом (type) и значением атрибута srcset.
+        """
+        sources = {}
+        for variant in self.image_variants:
+            sources.setdefault(variant['type'], []).append(f"{variant['url']} {variant['width']}w")
+        return [{'type': mime, 'srcset': ', '.join(srcset)} for mime, srcset in sources.items()]
+
 
 class Customer(models.Model):
     """
@@ -69,16 +133,31 @@ class Customer(models.Model):
     def create_customer_from_user(sender, instance, created, **kwargs):
         """
         Метод создания покупателя сразу после того, как пользователь (User) регистрируется на сайте.
+        Покупатель создается только вместе с пользователем: при следующих сохранениях User (например, при каждом
+        входе, когда обновляется last_login) строка покупателя не читается и не перезаписывается - свои поля
+        покупатель сохраняет сам, а бонусные очки меняются выражением F() при оформлении заказа.
         """
-        if created:
+        if created and not kwargs.get('raw'):
             Customer.objects.create(user=instance)
 
-    @receiver(post_save, sender=User)
-    def save_customer(sender, instance, **kwargs):
+
+@dataclass(frozen=True)
+class CartSummary:
+    """
+    Итоги корзины: общие для заказа из базы данных и для корзины из cookie.
+
+    :param get_cart_items: Количество товаров в корзине
+    :param get_cart_total: Сумма корзины
+    """
+    get_cart_items: int = 0
+    get_cart_total: int = 0
+
+    @property
+    def get_bonus_points(self):
         """
-        Метод работает в паре с методом создания покупателя. Сохраняет в базе данных "покупателя".
+        Бонусные очки за оформление заказа (BONUS_RATE от суммы).
         """
-        instance.customer.save()
+        return int(self.get_cart_total * BONUS_RATE)
 
 
 class Order(models.Model):
@@ -91,38 +170,67 @@ class Order(models.Model):
     :param complete: Показывает, завершен заказ или нет (добавлен ли он в базу данных после успешной оплаты и получения адреса получателя)
     :type complete: bool
     :param transaction_id: ID перевода (работает в связке с PayPal)
+    :param checkout_key: Ключ идемпотентности оформления: повторная отправка той же формы не оформляет заказ второй раз
     """
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     date_ordered = models.DateTimeField(auto_now_add=True)
     complete = models.BooleanField(default=False, null=True, blank=False)
     transaction_id = models.CharField(max_length=200, null=True)
+    checkout_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['customer'],
+                condition=Q(complete=False),
+                name='unique_open_order_per_customer',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['customer', 'complete'], name='order_customer_complete_idx'),
+            models.Index(fields=['date_ordered'], condition=Q(complete=True), name='order_completed_date_idx'),
+        ]
+
+    @cached_property
+    def summary(self):
+        """
+        Итоги заказа (количество товаров и сумма), посчитанные одним агрегирующим запросом.
+        Значение запоминается на объекте, поэтому все свойства ниже в рамках одного запроса обращаются к базе один раз.
+
+        :rtype: :class:`~CartSummary`
+        """
+        totals = self.orderitem_set.aggregate(
+            items=Coalesce(Sum('quantity'), 0),
+            total=Coalesce(Sum(F('quantity') * F('pizza__price')), 0),
+        )
+        return CartSummary(get_cart_items=totals['items'], get_cart_total=totals['total'])
+
+    def get_items(self):
+        """
+        Товары заказа вместе с пиццей (без отдельного запроса на каждую позицию).
+        """
+        return self.orderitem_set.select_related('pizza')
 
     @property
     def get_cart_total(self):
         """
         Метод подсчета суммы всего заказа.
         """
-        orderitems = self.orderitem_set.all()
-        total = sum([item.get_total for item in orderitems])
-        return total
+        return self.summary.get_cart_total
 
     @property
     def get_cart_items(self):
         """
         Метод подсчета количество товаров заказе. В частности используется для показания количества товаров над корзиной покупок.
         """
-        orderitems = self.orderitem_set.all()
-        total = sum([item.quantity for item in orderitems])
-        return total
+        return self.summary.get_cart_items
 
     @property
     def get_bonus_points(self):
         """
         Метод подсчета бонусных очков за оформление заказа.
         """
-        orderitems = self.orderitem_set.all()
-        total = int(sum([item.get_total for item in orderitems]) * 0.05)
-        return total
+        return self.summary.get_bonus_points
 
 
 class OrderItem(models.Model):
@@ -142,6 +250,11 @@ class OrderItem(models.Model):
     quantity = models.IntegerField(default=0, null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'pizza'], name='unique_pizza_per_order'),
+        ]
+
     @property
     def get_total(self):
         """
@@ -155,8 +268,225 @@ class OrderData(models.Model):
     """
     Модель данных об оформленном заказе.
 
+    :param order: Заказ, к которому относятся данные.
+    :type order: :class:`~Order`
     :param address: Адрес заказчика.
     :param phone: Телефон заказчика.
     """
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='data')
     address = models.TextField()
     phone = models.TextField()
+
+
+class PizzaSales(models.Model):
+    """
+    Продажи пиццы за один час (из оформленных заказов). Из этих строк складываются скользящие окна
+    :class:`~BestsellerStat`; строки старше самого длинного окна удаляются.
+
+    :param pizza: Пицца
+    :type pizza: :class:`~Pizza`
+    :param hour: Начало часа
+    :param quantity: Количество проданных пицц за час
+    :type quantity: int
+    """
+    pizza = models.ForeignKey(Pizza, on_delete=models.CASCADE)
+    hour = models.DateTimeField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pizza', 'hour'], name='unique_pizza_sales_hour'),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='pizza_sales_hour_idx'),
+        ]
+
+
+class BestsellerStat(models.Model):
+    """
+    Количество продаж пиццы за скользящее окно (см. settings.BESTSELLER_WINDOWS). Увеличивается при оформлении
+    заказа и уменьшается, когда часы продаж выходят из окна, поэтому рейтинг читается по индексу без подсчета заказов.
+
+    :param window: Имя окна (например, "7d")
+    :param pizza: Пицца
+    :type pizza: :class:`~Pizza`
+    :param quantity: Количество продаж за окно
+    :type quantity: int
+    """
+    window = models.CharField(max_length=16)
+    pizza = models.ForeignKey(Pizza, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'pizza'], name='unique_bestseller_window_pizza'),
+        ]
+        indexes = [
+            models.Index(fields=['window', '-quantity', 'pizza'], name='bestseller_ranking_idx'),
+        ]
+
+
+class BestsellerWindow(models.Model):
+    """
+    Граница скользящего окна: продажи с часов раньше start уже вычтены из :class:`~BestsellerStat`.
+
+    :param name: Имя окна (например, "7d")
+    :param start: Первый час, продажи которого входят в окно
+    """
+    name = models.CharField(max_length=16, primary_key=True)
+    start = models.DateTimeField()
+
+
+class DailyPizzaSales(models.Model):
+    """
+    Продажи пиццы за день (сводка для отчетов, см. main.analytics).
+
+    :param day: День оформления заказов
+    :param pizza: Пицца (если ее удалили - None)
+    :type pizza: :class:`~Pizza`
+    :param quantity: Количество проданных пицц
+    :param revenue: Выручка
+    """
+    day = models.DateField()
+    pizza = models.ForeignKey(Pizza, on_delete=models.SET_NULL, null=True)
+    quantity = models.IntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'pizza'], name='unique_daily_pizza_sales'),
+        ]
+
+
+class DailyTypeSales(models.Model):
+    """
+    Продажи пиццы одного типа за день (сводка для отчетов, см. main.analytics).
+
+    :param day: День оформления заказов
+    :param type: Тип пиццы (Pizza.TYPE_VARIANTS)
+    :param quantity: Количество проданных пицц
+    :param revenue: Выручка
+    """
+    day = models.DateField()
+    type = models.IntegerField(choices=Pizza.TYPE_VARIANTS)
+    quantity = models.IntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'type'], name='unique_daily_type_sales'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """
+    Отметка, до которой оформленные заказы уже учтены в сводке.
+
+    :param name: Имя сводки
+    :param position: Заказы, оформленные раньше этого момента, уже учтены
+    """
+    name = models.CharField(max_length=32, primary_key=True)
+    position = models.DateTimeField()
+
+
+class Payment(models.Model):
+    """
+    Платеж за заказ у платежного провайдера (см. main.payments).
+
+    :param order: Оплачиваемый заказ
+    :type order: :class:`~Order`
+    :param provider: Имя провайдера
+    :param intent_id: ID платежа у провайдера
+    :param amount: Сумма, посчитанная сервером по заказу
+    :param currency: Валюта
+    :param status: Состояние платежа (STATUS_VARIANTS)
+    :param created_at: Когда платеж создан
+    :param captured_at: Когда провайдер подтвердил списание
+    """
+    STATUS_CREATED = 'created'
+    STATUS_CAPTURED = 'captured'
+    STATUS_FAILED = 'failed'
+    STATUS_VARIANTS = (
+        (STATUS_CREATED, 'Ожидает оплаты'),
+        (STATUS_CAPTURED, 'Оплачен'),
+        (STATUS_FAILED, 'Ошибка'),
+    )
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payments')
+    provider = models.CharField(max_length=32)
+    intent_id = models.CharField(max_length=128, unique=True)
+    amount = models.IntegerField()
+    currency = models.CharField(max_length=3)
+    status = models.CharField(max_length=16, choices=STATUS_VARIANTS, default=STATUS_CREATED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    captured_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order'], condition=Q(status='captured'),
+                                    name='unique_captured_payment_per_order'),
+        ]
+
+
+class Task(models.Model):
+    """
+    Фоновая задача в очереди в базе данных (см. main.tasks и manage.py run_tasks).
+
+    :param name: Путь к функции задачи (например, main.checkout.credit_bonus_points)
+    :param kwargs: Именованные аргументы функции (JSON)
+    :param status: Состояние задачи (STATUS_VARIANTS)
+    :param attempts: Сколько раз задача запускалась
+    :param max_attempts: После стольких неудачных запусков задача больше не повторяется
+    :param run_at: Задача выполняется не раньше этого момента (откладывается при повторе)
+    :param locked_at: Когда исполнитель взял задачу (для возврата задач упавшего исполнителя)
+    :param last_error: Трассировка последней ошибки
+    :param created_at: Когда задача поставлена в очередь
+    :param finished_at: Когда задача выполнена или окончательно провалена
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_VARIANTS = (
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнена'),
+        (STATUS_FAILED, 'Ошибка'),
+    )
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_VARIANTS, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # выборка исполнителя: задачи в очереди, срок которых наступил, по порядку срока
+            models.Index(fields=['status', 'run_at'], name='task_queue_idx'),
+        ]
+
+
+class OrderArchive(models.Model):
+    """
+    Пачка оформленных заказов, перенесенных из Order и OrderItem в архив (см. main.archive): сжатый файл JSON Lines
+    в хранилище архива. Файлы без записи в этой таблице (например, после сбоя переноса) не читаются.
+
+    :param name: Путь файла в хранилище архива
+    :param first_order: Наименьший ID заказа в пачке
+    :param last_order: Наибольший ID заказа в пачке
+    :param first_ordered: Когда оформлен самый ранний заказ пачки
+    :param last_ordered: Когда оформлен самый поздний заказ пачки
+    :param orders: Количество заказов в пачке
+    :param created_at: Когда пачка перенесена в архив
+    """
+    name = models.CharField(max_length=255, unique=True)
+    first_order = models.BigIntegerField()
+    last_order = models.BigIntegerField()
+    first_ordered = models.DateTimeField()
+    last_ordered = models.DateTimeField()
+    orders = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
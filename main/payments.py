@@ -0,0 +1,308 @@
+import functools
+import hashlib
+import hmac
+import json
+import uuid
+from abc import ABC, abstractmethod
+from decimal import Decimal, InvalidOperation
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from main.http import get_http_session
+from main.models import Order, Payment
+
+
+class PaymentError(Exception):
+    """
+    Ошибка платежа: провайдер отказал, подпись уведомления неверна, сумма не совпадает и т.п.
+    """
+
+
+class PaymentProvider(ABC):
+    """
+    Интерфейс платежного провайдера. Провайдер выбирается настройкой PAYMENT_PROVIDER (путь к классу),
+    параметры конструктора берутся из PAYMENT_PROVIDER_OPTIONS.
+    """
+    name = None
+
+    @abstractmethod
+    def create_intent(self, amount, currency, reference):
+        """
+        Создание платежа у провайдера.
+
+        :param amount: Сумма
+        :param currency: Валюта
+        :param reference: Ссылка на заказ для провайдера
+        :return: ID платежа у провайдера.
+        """
+
+    def client_data(self, intent_id):
+        """
+        Данные, которые нужны странице оплаты для этого платежа (кроме его ID).
+        """
+        return {}
+
+    @abstractmethod
+    def capture(self, intent_id):
+        """
+        Списание одобренного покупателем платежа.
+
+        :return: Списанная сумма (None, если провайдер ее не сообщает).
+        :raises PaymentError: Если провайдер отказал.
+        """
+
+    @abstractmethod
+    def parse_webhook(self, request):
+        """
+        Проверка и разбор уведомления провайдера.
+
+        :return: Кортеж (ID платежа, сумма) для уведомления об успешном списании, иначе None.
+        :raises PaymentError: Если уведомление не прошло проверку.
+        """
+
+
+class StubProvider(PaymentProvider):
+    """
+    Локальный провайдер для разработки и тестов: платежи не покидают сервер, а уведомление о списании
+    присылает сама страница оплаты с подписью, выданной при создании платежа. Подпись получает покупатель,
+    то есть заказ может отметить оплаченным кто угодно, поэтому без DEBUG провайдер не создается.
+
+    :param secret: Ключ подписи (по умолчанию SECRET_KEY)
+    :raises ImproperlyConfigured: Если settings.DEBUG выключен.
+    """
+    name = 'stub'
+
+    def __init__(self, secret=None):
+        if not settings.DEBUG:
+            raise ImproperlyConfigured('StubProvider is for development only: set PAYMENT_PROVIDER to a real provider')
+        self.secret = (secret or settings.SECRET_KEY).encode()
+
+    def sign(self, intent_id):
+        return hmac.new(self.secret, intent_id.encode(), hashlib.sha256).hexdigest()
+
+    def create_intent(self, amount, currency, reference):
+        return f'stub_{uuid.uuid4().hex}'
+
+    def client_data(self, intent_id):
+        return {'signature': self.sign(intent_id)}
+
+    def capture(self, intent_id):
+        raise PaymentError('Stub payments are confirmed by the webhook only')
+
+    def parse_webhook(self, request):
+        try:
+            data = json.loads(request.body)
+            intent_id, signature = str(data['intent']), str(data['signature'])
+        except (KeyError, TypeError, ValueError):
+            raise PaymentError('Malformed stub webhook')
+        if not hmac.compare_digest(signature, self.sign(intent_id)):
+            raise PaymentError('Invalid stub webhook signature')
+        amount = _amount(data.get('amount'))
+        if amount is None:
+            raise PaymentError('Malformed stub webhook amount')
+        return intent_id, amount
+
+
+class PayPalProvider(PaymentProvider):
+    """
+    PayPal (Orders API v2). Все запросы идут через общую сессию main.http.get_http_session с пулом соединений
+    и таймаутами.
+
+    :param client_id: Client ID приложения PayPal
+    :param secret: Secret приложения PayPal
+    :param webhook_id: ID вебхука для проверки подписи уведомлений
+    :param base_url: Адрес API (по умолчанию - песочница)
+    :raises ImproperlyConfigured: Если не задан какой-то из ключей.
+    """
+    name = 'paypal'
+    TOKEN_CACHE_KEY = 'payments:paypal:token'
+
+    def __init__(self, client_id=None, secret=None, webhook_id=None, base_url='https://api-m.sandbox.paypal.com'):
+        missing = [name for name, value in (('client_id', client_id), ('secret', secret), ('webhook_id', webhook_id))
+                   if not value]
+        if missing:
+            raise ImproperlyConfigured(f'PayPalProvider needs {", ".join(missing)} in PAYMENT_PROVIDER_OPTIONS '
+                                       f'(PAYPAL_CLIENT_ID, PAYPAL_SECRET, PAYPAL_WEBHOOK_ID)')
+        self.client_id = client_id
+        self.secret = secret
+        self.webhook_id = webhook_id
+        self.base_url = base_url.rstrip('/')
+
+    def _call(self, method, path, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if 'auth' not in kwargs:
+            headers['Authorization'] = f'Bearer {self._token()}'
+        try:
+            response = get_http_session().request(method, self.base_url + path, headers=headers, **kwargs)
+            response.raise_for_status()
+        except requests.RequestException as error:
+            raise PaymentError(f'PayPal {method} {path} failed: {error}')
+        return response.json()
+
+    def _token(self):
+        token = cache.get(self.TOKEN_CACHE_KEY)
+        if token is None:
+            data = self._call('POST', '/v1/oauth2/token', auth=(self.client_id, self.secret),
+                              data={'grant_type': 'client_credentials'})
+            token = data['access_token']
+            cache.set(self.TOKEN_CACHE_KEY, token, max(data.get('expires_in', 300) - 60, 60))
+        return token
+
+    def create_intent(self, amount, currency, reference):
+        data = self._call('POST', '/v2/checkout/orders', json={
+            'intent': 'CAPTURE',
+            'purchase_units': [{'reference_id': reference, 'amount': {'currency_code': currency, 'value': f'{amount}.00'}}],
+        }, headers={'PayPal-Request-Id': reference})
+        return data['id']
+
+    def client_data(self, intent_id):
+        return {'clientId': self.client_id}
+
+    def capture(self, intent_id):
+        data = self._call('POST', f'/v2/checkout/orders/{intent_id}/capture', json={},
+                          headers={'PayPal-Request-Id': f'capture-{intent_id}'})
+        if data.get('status') != 'COMPLETED':
+            raise PaymentError(f'PayPal capture status: {data.get("status")}')
+        try:
+            return _amount(data['purchase_units'][0]['payments']['captures'][0]['amount']['value'])
+        except (KeyError, IndexError):
+            return None
+
+    def parse_webhook(self, request):
+        try:
+            event = json.loads(request.body)
+        except ValueError:
+            raise PaymentError('Malformed PayPal webhook')
+        verification = self._call('POST', '/v1/notifications/verify-webhook-signature', json={
+            'auth_algo': request.headers.get('PayPal-Auth-Algo'),
+            'cert_url': request.headers.get('PayPal-Cert-Url'),
+            'transmission_id': request.headers.get('PayPal-Transmission-Id'),
+            'transmission_sig': request.headers.get('PayPal-Transmission-Sig'),
+            'transmission_time': request.headers.get('PayPal-Transmission-Time'),
+            'webhook_id': self.webhook_id,
+            'webhook_event': event,
+        })
+        if verification.get('verification_status') != 'SUCCESS':
+            raise PaymentError('Invalid PayPal webhook signature')
+        if event.get('event_type') != 'PAYMENT.CAPTURE.COMPLETED':
+            return None
+        resource = event.get('resource', {})
+        intent_id = resource.get('supplementary_data', {}).get('related_ids', {}).get('order_id')
+        if not intent_id:
+            return None
+        return intent_id, _amount(resource.get('amount', {}).get('value'))
+
+
+def _amount(value):
+    try:
+        return int(Decimal(value))
+    except (InvalidOperation, OverflowError, TypeError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_provider():
+    """
+    Платежный провайдер из настроек PAYMENT_PROVIDER и PAYMENT_PROVIDER_OPTIONS (один на процесс).
+
+    :raises ImproperlyConfigured: Если провайдер не найден или его параметры заданы неверно.
+    """
+    try:
+        provider_class = import_string(settings.PAYMENT_PROVIDER)
+    except ImportError as error:
+        raise ImproperlyConfigured(f'PAYMENT_PROVIDER {settings.PAYMENT_PROVIDER!r} cannot be imported: {error}')
+    try:
+        return provider_class(**settings.PAYMENT_PROVIDER_OPTIONS)
+    except TypeError as error:
+        raise ImproperlyConfigured(f'PAYMENT_PROVIDER_OPTIONS do not match {settings.PAYMENT_PROVIDER}: {error}')
+
+
+@receiver(setting_changed)
+def reset_provider(setting, **kwargs):
+    if setting in ('DEBUG', 'PAYMENT_PROVIDER', 'PAYMENT_PROVIDER_OPTIONS'):
+        get_provider.cache_clear()
+
+
+def start_payment(order):
+    """
+    Платеж за оформленный заказ на сумму, посчитанную сервером по заказу. Повторный вызов возвращает уже созданный
+    платеж, если сумма не изменилась, поэтому обновление страницы оплаты не плодит платежи у провайдера.
+
+    :param order: Оформленный заказ
+    :return: Платеж (:class:`~Payment`).
+    :raises PaymentError: Если заказ не оформлен или пуст.
+    """
+    if not order.complete:
+        raise PaymentError('Order is not placed yet')
+    amount = order.summary.get_cart_total
+    if amount <= 0:
+        raise PaymentError('Order is empty')
+    provider = get_provider()
+    payment = order.payments.exclude(status=Payment.STATUS_FAILED).order_by('-id').first()
+    if payment is not None and (payment.status == Payment.STATUS_CAPTURED
+                                or (payment.provider, payment.amount) == (provider.name, amount)):
+        return payment
+    # запрос к провайдеру выполняется вне транзакции, чтобы не держать блокировки на время сетевого вызова
+    intent_id = provider.create_intent(amount, settings.PAYMENT_CURRENCY, order.checkout_key or str(order.pk))
+    return Payment.objects.create(order=order, provider=provider.name, intent_id=intent_id, amount=amount,
+                                  currency=settings.PAYMENT_CURRENCY)
+
+
+def confirm_capture(intent_id, amount):
+    """
+    Отметка платежа оплаченным по подтверждению провайдера (уведомлению или ответу на списание). Идемпотентна:
+    повторное подтверждение того же платежа ничего не меняет. ID платежа записывается в Order.transaction_id.
+
+    :param intent_id: ID платежа у провайдера
+    :param amount: Списанная сумма, которую сообщил провайдер (должна совпадать с суммой платежа)
+    :return: Платеж (:class:`~Payment`).
+    :raises PaymentError: Если платежа нет, сумма не указана или не совпадает.
+    """
+    amount = _amount(amount)
+    if amount is None:
+        raise PaymentError(f'No captured amount for {intent_id}')
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().filter(intent_id=intent_id).first()
+        if payment is None:
+            raise PaymentError(f'Unknown payment {intent_id}')
+        if payment.status == Payment.STATUS_CAPTURED:
+            return payment
+        if amount != payment.amount:
+            payment.status = Payment.STATUS_FAILED
+            payment.save(update_fields=['status'])
+        else:
+            payment.status = Payment.STATUS_CAPTURED
+            payment.captured_at = timezone.now()
+            payment.save(update_fields=['status', 'captured_at'])
+            Order.objects.filter(pk=payment.order_id).update(transaction_id=intent_id)
+    if payment.status == Payment.STATUS_FAILED:
+        raise PaymentError(f'Captured {amount}, expected {payment.amount} for {intent_id}')
+    return payment
+
+
+def capture_payment(intent_id):
+    """
+    Списание одобренного покупателем платежа через провайдера и отметка его оплаченным. Если провайдер
+    не сообщил списанную сумму, платеж остается неоплаченным до уведомления провайдера (см. confirm_capture).
+
+    :param intent_id: ID платежа у провайдера
+    :return: Платеж (:class:`~Payment`).
+    :raises PaymentError: Если платежа нет или провайдер отказал.
+    """
+    payment = Payment.objects.filter(intent_id=intent_id).first()
+    if payment is None:
+        raise PaymentError(f'Unknown payment {intent_id}')
+    if payment.status == Payment.STATUS_CAPTURED:
+        return payment
+    amount = get_provider().capture(intent_id)
+    if amount is None:
+        return payment
+    return confirm_capture(intent_id, amount)
@@ -0,0 +1,209 @@
+import bisect
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates
+
+# верхние границы корзин гистограммы времени ответа, мс
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+DUPLICATE_LIMIT = 20
+
+_current = ContextVar('perf_request', default=None)
+_lock = threading.Lock()
+_views = {}
+
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+
+def normalize_sql(sql):
+    """
+    SQL без различий в длине списков IN (...), чтобы одинаковые по смыслу запросы считались одним.
+    """
+    return _IN_LIST.sub('(%s, ...)', sql)
+
+
+class RequestStats:
+    """
+    Замеры одного запроса: количество и время SQL-запросов, время рендеринга шаблонов и повторы одинакового SQL.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Обертка выполнения SQL (connection.execute_wrapper).
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[normalize_sql(sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.statements.items() if count > 1}
+
+
+class ViewStats:
+    """
+    Накопленная статистика одного представления в текущем процессе.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.sampled = 0
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total_time = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.duplicates = Counter()
+
+    def percentile(self, q):
+        """
+        Оценка процентиля времени ответа по гистограмме: верхняя граница корзины, в которую он попадает.
+
+        :param q: Процентиль от 0 до 1
+        :return: Время, мс (None для корзины выше последней границы или если запросов не было).
+        """
+        if not self.requests:
+            return None
+        rank = q * self.requests
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (None,), self.latency):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self, name):
+        sampled = self.sampled or 1
+        return {
+            'view': name,
+            'requests': self.requests,
+            'sampled': self.sampled,
+            'avg_ms': self.total_time / self.requests * 1000 if self.requests else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'avg_queries': self.queries / sampled,
+            'max_queries': self.max_queries,
+            'avg_db_ms': self.db_time / sampled * 1000,
+            'avg_template_ms': self.template_time / sampled * 1000,
+            'duplicates': [{'sql': sql, 'count': count} for sql, count in self.duplicates.most_common(5)],
+        }
+
+
+def start_request():
+    """
+    Начало замеров запроса, выбранного в выборку.
+
+    :return: Объект замеров и токен для finish_request.
+    """
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def record(view_name, elapsed, stats=None):
+    """
+    Учет завершенного запроса в статистике представления.
+
+    :param view_name: Имя представления
+    :param elapsed: Время ответа, с
+    :param stats: Замеры запроса (None, если запрос не попал в выборку)
+    """
+    with _lock:
+        view = _views.setdefault(view_name, ViewStats())
+        view.requests += 1
+        view.total_time += elapsed
+        view.latency[bisect.bisect_left(LATENCY_BUCKETS, elapsed * 1000)] += 1
+        if stats is None:
+            return
+        view.sampled += 1
+        view.queries += stats.queries
+        view.max_queries = max(view.max_queries, stats.queries)
+        view.db_time += stats.db_time
+        view.template_time += stats.template_time
+        view.duplicates.update(stats.duplicates())
+        if len(view.duplicates) > DUPLICATE_LIMIT * 5:
+            view.duplicates = Counter(dict(view.duplicates.most_common(DUPLICATE_LIMIT)))
+
+
+def server_timing(elapsed, stats=None):
+    """
+    Значение заголовка Server-Timing: общее время ответа и, для запросов из выборки, время SQL и шаблонов.
+    """
+    metrics = [f'total;dur={elapsed * 1000:.1f}']
+    if stats is not None:
+        metrics.append(f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"')
+        metrics.append(f'tpl;dur={stats.template_time * 1000:.1f}')
+    return ', '.join(metrics)
+
+
+def get_perf_stats():
+    """
+    Статистика всех представлений текущего процесса.
+
+    :return: Словарь с PID процесса (pid) и списком статистики представлений (views) по убыванию суммарного времени.
+    """
+    with _lock:
+        views = [stats.as_dict(name) for name, stats in _views.items()]
+    views.sort(key=lambda view: view['avg_ms'] * view['requests'], reverse=True)
+    return {'pid': os.getpid(), 'views': views}
+
+
+def reset_perf_stats():
+    with _lock:
+        _views.clear()
+
+
+class TimedTemplate:
+    """
+    Шаблон, который прибавляет время своего рендеринга к замерам текущего запроса. Вложенный рендеринг
+    (например, форм crispy внутри страницы) уже входит во время внешнего шаблона и отдельно не считается.
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None or stats.template_depth:
+            return self.template.render(context, request)
+        stats.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+            stats.template_depth -= 1
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Шаблонизатор Django, шаблоны которого измеряют время рендеринга (для main.middleware.PerfMiddleware).
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
@@ -0,0 +1,57 @@
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+
+def file_digest(file):
+    """
+    SHA-256 содержимого файла. Файл читается частями, поэтому большие загрузки не попадают в память целиком.
+
+    :param file: Файл Django (UploadedFile, FieldFile или File)
+    :return: Хэш в шестнадцатеричном виде.
+    """
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def content_addressed_name(digest, filename, prefix):
+    """
+    Путь файла по хэшу его содержимого: одинаковые файлы всегда получают один и тот же путь.
+
+    :param digest: Хэш содержимого (file_digest)
+    :param filename: Исходное имя файла (из него берется только расширение)
+    :param prefix: Каталог внутри хранилища
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{prefix}/{digest[:2]}/{digest}{extension}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище для файлов с путями по хэшу содержимого: если файл с таким путем уже есть, он не записывается
+    повторно, а переиспользуется (одинаковые картинки хранятся один раз).
+
+    Файл сначала пишется под временным именем и затем получает свое имя жесткой ссылкой: если параллельная
+    загрузка того же файла успела раньше, ссылка не создается (FileExistsError), и используется уже записанный
+    файл. Частично записанный файл под итоговым именем никогда не виден.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        try:
+            os.link(self.path(temporary), self.path(name))
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(self.path(temporary))
+        return name
@@ -0,0 +1,143 @@
+import datetime
+import logging
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from main.models import Task
+
+logger = logging.getLogger(__name__)
+
+
+def task(max_attempts=None):
+    """
+    Декоратор функции фоновой задачи. Задача выполняется исполнителем (manage.py run_tasks) в транзакции вместе
+    с отметкой о выполнении, поэтому ее изменения в базе данных применяются ровно один раз; при ошибке задача
+    повторяется с растущей задержкой, но не больше max_attempts раз.
+
+    :param max_attempts: Количество попыток (по умолчанию settings.TASK_MAX_ATTEMPTS)
+    """
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts or settings.TASK_MAX_ATTEMPTS
+        return func
+    return decorator
+
+
+def enqueue(*calls):
+    """
+    Постановка задач в очередь одним INSERT. Внутри транзакции задачи появляются в очереди вместе с ее фиксацией:
+    исполнитель не увидит задачу, пока не зафиксированы данные, которые она обрабатывает, а при откате задачи
+    пропадают вместе с ними. При settings.TASK_QUEUE_EAGER задачи выполняются в этом же процессе сразу после
+    фиксации (transaction.on_commit) - для разработки без исполнителя.
+
+    :param calls: Пары (функция с декоратором task, словарь аргументов)
+    """
+    Task.objects.bulk_create([
+        Task(name=func.task_name, kwargs=kwargs, max_attempts=func.max_attempts) for func, kwargs in calls
+    ])
+    if settings.TASK_QUEUE_EAGER:
+        transaction.on_commit(run_pending)
+
+
+def retry_delay(attempts):
+    """
+    Задержка перед повтором задачи после attempts неудачных попыток: settings.TASK_RETRY_DELAY, удваивается
+    с каждой попыткой, но не больше часа.
+    """
+    return datetime.timedelta(seconds=min(settings.TASK_RETRY_DELAY * 2 ** (attempts - 1), 60 * 60))
+
+
+def claim(limit):
+    """
+    Захват задач, срок которых наступил. Задача переводится в STATUS_RUNNING условным UPDATE, поэтому
+    несколько исполнителей не возьмут одну задачу даже без SELECT ... FOR UPDATE (SQLite).
+
+    :param limit: Сколько задач взять
+    :return: Список захваченных задач.
+    """
+    now = timezone.now()
+    due = (Task.objects.filter(status=Task.STATUS_PENDING, run_at__lte=now)
+           .order_by('run_at').values_list('id', flat=True)[:limit])
+    claimed = [
+        pk for pk in list(due)
+        if Task.objects.filter(pk=pk, status=Task.STATUS_PENDING).update(
+            status=Task.STATUS_RUNNING, locked_at=now, attempts=F('attempts') + 1)
+    ]
+    return list(Task.objects.filter(pk__in=claimed).order_by('run_at'))
+
+
+def run_task(task):
+    """
+    Выполнение захваченной задачи.
+
+    :param task: Задача в состоянии STATUS_RUNNING (см. claim)
+    :return: True, если задача выполнена.
+    """
+    try:
+        func = import_string(task.name)
+        if not hasattr(func, 'task_name'):
+            raise ImportError(f'{task.name} is not a task')
+        with transaction.atomic():
+            func(**task.kwargs)
+            Task.objects.filter(pk=task.pk).update(status=Task.STATUS_DONE, finished_at=timezone.now())
+        return True
+    except Exception:
+        logger.exception('Task %s (%s) failed, attempt %s of %s', task.pk, task.name, task.attempts, task.max_attempts)
+        now = timezone.now()
+        if task.attempts >= task.max_attempts:
+            changes = {'status': Task.STATUS_FAILED, 'finished_at': now}
+        else:
+            changes = {'status': Task.STATUS_PENDING, 'run_at': now + retry_delay(task.attempts)}
+        Task.objects.filter(pk=task.pk).update(locked_at=None, last_error=traceback.format_exc(), **changes)
+        return False
+
+
+def run_pending(batch=100):
+    """
+    Выполнение всех задач, срок которых наступил, пачками по batch.
+
+    :return: Кортеж (выполнено, с ошибкой).
+    """
+    done = failed = 0
+    while True:
+        tasks = claim(batch)
+        if not tasks:
+            return done, failed
+        for task in tasks:
+            if run_task(task):
+                done += 1
+            else:
+                failed += 1
+
+
+def requeue_stale(now=None):
+    """
+    Возврат в очередь задач, которые исполнитель взял больше settings.TASK_LOCK_TIMEOUT секунд назад и не завершил
+    (исполнитель упал или был остановлен). Задачи без оставшихся попыток отмечаются проваленными.
+
+    :return: Количество возвращенных задач.
+    """
+    now = now or timezone.now()
+    stale = Task.objects.filter(status=Task.STATUS_RUNNING,
+                                locked_at__lt=now - datetime.timedelta(seconds=settings.TASK_LOCK_TIMEOUT))
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.STATUS_FAILED, finished_at=now, locked_at=None, last_error='Worker lock timed out')
+    return stale.update(status=Task.STATUS_PENDING, run_at=now, locked_at=None)
+
+
+def purge_tasks(now=None):
+    """
+    Удаление выполненных задач старше settings.TASK_RETENTION секунд (проваленные остаются для разбора).
+
+    :return: Количество удаленных задач.
+    """
+    now = now or timezone.now()
+    deleted, _ = Task.objects.filter(
+        status=Task.STATUS_DONE, finished_at__lt=now - datetime.timedelta(seconds=settings.TASK_RETENTION)
+    ).delete()
+    return deleted
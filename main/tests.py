@@ -1,3 +1,1033 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.sessions.models import Session
+from django.db import connection, connections, OperationalError, transaction
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import AsyncClient, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from PIL import Image, features
+
+from main.analytics import daily_totals, get_rollup_position, rollup_sales, sales_report
+from main.archive import archive_orders, get_archive_storage, iter_archived_orders, rebuild_rollups
+from main.bestsellers import expire_windows, rebuild_bestsellers, record_sale
+from main.benchmarks import check_results, run_suite, seed
+from main.catalog import (CATALOG_VERSION_KEY, bump_catalog_version, decode_cursor, encode_cursor,
+                          get_catalog_version, get_fragment_stats, get_top_pizzas, render_pizza_grid)
+from main.checks import check_payment_provider
+from main.checkout import CheckoutKeyConflict, EmptyCartError, place_guest_order, place_order
+from main.db import PrimaryReplicaRouter, finish_request, start_request
+from main.forms import CheckoutForm, PizzaCreationForm
+from main.images import IMAGE_VARIANT_FORMATS, build_variants
+from main.models import image_storage, BestsellerStat, BestsellerWindow, PizzaSales, Customer, Pizza, Order, OrderData, OrderItem, Payment, Task
+from main.payments import get_provider
+from main.tasks import enqueue, run_pending, task
+from main.utils import cookieCart, CartLine, CookieGuestCart, DatabaseCart, GuestCart, ServerGuestCart, update_cart
+
+
+def make_pizza(author, **kwargs):
+    fields = {'name': 'Пицца', 'description': 'Описание', 'image': 'pizza.png', 'price': 100, 'rating': 0}
+    fields.update(kwargs)
+    return Pizza.objects.create(author=author, **fields)
+
+
+def png_upload(name='pizza.png', color='red', size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class MediaRootMixin:
+    """
+    Картинки теста пишутся во временный MEDIA_ROOT.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def stored_files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.media_root)
+                      for root, dirs, names in os.walk(self.media_root) for name in names)
+
+
+class CookieCartTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.staff = User.objects.create_user('staff', password='pizzaproga')
+
+    def request_with_cart(self, cart):
+        request = self.factory.get('/')
+        request.COOKIES['cart'] = cart if isinstance(cart, str) else json.dumps(cart)
+        return request
+
+    def test_resolves_all_pizzas_in_one_query(self):
+        pizzas = [make_pizza(self.staff, name=f'Пицца {i}', price=100 + i) for i in range(15)]
+        request = self.request_with_cart({str(p.id): {'quantity': 2} for p in pizzas})
+
+        with self.assertNumQueries(1):
+            data = cookieCart(request)
+            for item in data['items']:
+                item.pizza.imageURL
+
+        self.assertEqual(len(data['items']), 15)
+        self.assertTrue(all(isinstance(item, CartLine) for item in data['items']))
+        self.assertEqual(data['notifications'], 30)
+        self.assertEqual(data['order'].get_cart_total, sum(2 * p.price for p in pizzas))
+
+    def test_reports_unknown_and_invalid_ids(self):
+        pizza = make_pizza(self.staff)
+        request = self.request_with_cart({
+            str(pizza.id): {'quantity': 1},
+            '999999': {'quantity': 1},
+            'abc': {'quantity': 1},
+            '5': {'amount': 1},
+        })
+
+        data = cookieCart(request)
+
+        self.assertEqual([item.pizza.id for item in data['items']], [pizza.id])
+        self.assertCountEqual(data['invalid_ids'], ['999999', 'abc', '5'])
+
+    def test_broken_cookie_gives_empty_cart_without_queries(self):
+        with self.assertNumQueries(0), self.assertLogs('main.utils', 'WARNING'):
+            data = cookieCart(self.request_with_cart('{not json'))
+        self.assertEqual(data['items'], [])
+        self.assertEqual(data['notifications'], 0)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user('staff')
+
+    def test_pizza_changes_bump_version(self):
+        versions = [get_catalog_version()]
+        self.assertEqual(get_top_pizzas(), [])
+
+        pizza = make_pizza(self.staff, rating=5)
+        versions.append(get_catalog_version())
+        self.assertEqual([p.name for p in get_top_pizzas()], ['Пицца'])
+
+        pizza.name = 'Маргарита'
+        pizza.save()
+        versions.append(get_catalog_version())
+        self.assertEqual([p.name for p in get_top_pizzas()], ['Маргарита'])
+
+        pizza.delete()
+        versions.append(get_catalog_version())
+        self.assertEqual(get_top_pizzas(), [])
+        self.assertEqual(len(set(versions)), 4)
+
+    def render_grid(self, loads):
+        return render_pizza_grid('test', lambda: loads.append(1) or {'pizzas': get_top_pizzas()}, 'Пиццы нет')
+
+    def test_fragment_hit_after_miss(self):
+        make_pizza(self.staff, name='Маргарита')
+        loads = []
+        first = self.render_grid(loads)
+        self.assertEqual(get_fragment_stats(), {'hits': 0, 'misses': 1, 'hit_ratio': 0.0})
+        self.assertEqual(self.render_grid(loads), first)
+        self.assertEqual(get_fragment_stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+        self.assertEqual(len(loads), 1)
+        self.assertIn('Маргарита', first)
+
+        staff = User.objects.create_user('manager', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/staff/cache/').json(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_version_bump_makes_next_render_a_miss(self):
+        loads = []
+        self.render_grid(loads)
+        self.render_grid(loads)
+        bump_catalog_version()
+        self.render_grid(loads)
+        self.assertEqual((get_fragment_stats()['hits'], get_fragment_stats()['misses']), (1, 2))
+        self.assertEqual(len(loads), 2)
+
+    def test_expired_version_drops_cached_lists(self):
+        pizza = make_pizza(self.staff)
+        get_top_pizzas()
+        # изменение из другого процесса: сигнал сбросил версию только в его кэше
+        Pizza.objects.filter(pk=pizza.pk).update(name='Маргарита')
+        self.assertEqual([p.name for p in get_top_pizzas()], ['Пицца'])
+
+        cache.delete(CATALOG_VERSION_KEY)
+        self.assertEqual([p.name for p in get_top_pizzas()], ['Маргарита'])
+
+
+class CatalogPagingTests(TestCase):
+    def setUp(self):
+        staff = User.objects.create_user('staff')
+        self.pizzas = [make_pizza(staff, name=f'Пицца {i}', rating=rating, type=i % 2)
+                       for i, rating in enumerate((5, 5, 5, 3, 3, 1, 0))]
+
+    def test_cursor_round_trip(self):
+        pizza = self.pizzas[3]
+        self.assertEqual(decode_cursor(encode_cursor(pizza)), (pizza.rating, pizza.id))
+        for cursor in ('!!!', 'bm90LWEtY3Vyc29y', encode_cursor(Pizza(rating='a', id=1))):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def pages(self, **params):
+        ids, url, data = [], '/api/pizzas/', {**params, 'limit': 3}
+        while url:
+            response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            ids += [pizza['id'] for pizza in page['results']]
+            url, data = page['next'], None
+        return ids
+
+    def test_next_links_walk_the_whole_catalog(self):
+        ordered = sorted(self.pizzas, key=lambda p: (-p.rating, -p.id))
+        self.assertEqual(self.pages(), [p.id for p in ordered])
+        self.assertEqual(self.pages(type='beef'), [p.id for p in ordered if p.type == 1])
+
+    def test_invalid_parameters(self):
+        for params in ({'cursor': '!!!'}, {'limit': 0}, {'limit': 'abc'}, {'price_min': 'cheap'}):
+            self.assertEqual(self.client.get('/api/pizzas/', params).status_code, 400)
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        staff = User.objects.create_user('staff')
+        self.first, self.second = make_pizza(staff, price=100), make_pizza(staff, price=300)
+
+    def next_request(self, response):
+        request = self.factory.get('/')
+        request.COOKIES = {name: morsel.value for name, morsel in response.cookies.items() if morsel.value}
+        return request
+
+    def test_cookie_cart(self):
+        cart = CookieGuestCart.from_request(self.factory.get('/'))
+        cart.update({self.first.id: 2, self.second.id: 1})
+        response = HttpResponse()
+        cart.set_cookie(response)
+        self.assertEqual(json.loads(response.cookies['cart'].value),
+                         {str(self.first.id): {'quantity': 2}, str(self.second.id): {'quantity': 1}})
+
+        cart = CookieGuestCart.from_request(self.next_request(response))
+        self.assertEqual((cart.count(), cart.summary().get_cart_total), (3, 500))
+        cart.clear()
+        cart.set_cookie(response)
+        self.assertEqual(response.cookies['cart']['max-age'], 0)
+
+    @override_settings(GUEST_CART_STORAGE='server')
+    def test_server_cart(self):
+        cart = ServerGuestCart.from_request(self.factory.get('/'))
+        cart.update({self.first.id: 1})
+        cart.update({self.first.id: 1, self.second.id: 1})
+        with self.assertRaises(Pizza.DoesNotExist):
+            cart.update({999999: 1})
+        response = HttpResponse()
+        cart.set_cookie(response)
+        self.assertTrue(response.cookies['cart_id'].value.startswith(f'{cart.cart_id}:'))
+        self.assertNotIn('cart', response.cookies)
+
+        cart = ServerGuestCart.from_request(self.next_request(response))
+        self.assertEqual(cart.quantities, {self.first.id: 2, self.second.id: 1})
+        cart.clear()
+        cart.set_cookie(response)
+        self.assertEqual(response.cookies['cart_id']['max-age'], 0)
+        self.assertEqual(ServerGuestCart.from_request(self.next_request(HttpResponse())).quantities, {})
+        self.assertIsNone(cache.get(f'guest_cart:{cart.cart_id}'))
+
+    def test_forged_server_cart_id_is_ignored(self):
+        request = self.factory.get('/')
+        request.COOKIES['cart_id'] = 'forged'
+        self.assertIsNone(ServerGuestCart.from_request(request).cart_id)
+
+    def test_storage_must_be_defined(self):
+        with self.assertRaises(TypeError):
+            GuestCart({})
+
+
+class UpdateCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pizzaproga')
+        self.customer = self.user.customer
+        self.pizzas = [make_pizza(self.user, name=f'Пицца {i}') for i in range(3)]
+
+    def quantities(self):
+        return dict(OrderItem.objects.filter(order__customer=self.customer).values_list('pizza_id', 'quantity'))
+
+    def test_bulk_deltas_in_one_call(self):
+        first, second, third = self.pizzas
+        update_cart(self.customer, {first.id: 2, second.id: 1})
+        update_cart(self.customer, {first.id: 3, second.id: -1, third.id: 4})
+
+        self.assertEqual(self.quantities(), {first.id: 5, third.id: 4})
+        self.assertEqual(Order.objects.filter(customer=self.customer, complete=False).count(), 1)
+
+    def test_unknown_pizza_rolls_back(self):
+        with self.assertRaises(Pizza.DoesNotExist):
+            update_cart(self.customer, {self.pizzas[0].id: 1, 999999: 1})
+        self.assertEqual(self.quantities(), {})
+
+    def test_badge_count_is_invalidated(self):
+        cache.clear()
+        count = lambda: DatabaseCart(self.user).count()
+        self.assertEqual(count(), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(count(), 0)
+
+        update_cart(self.customer, {self.pizzas[0].id: 2, self.pizzas[1].id: 1})
+        self.assertEqual(count(), 3)
+        update_cart(self.customer, {self.pizzas[0].id: -1})
+        self.assertEqual(count(), 2)
+
+        form = CheckoutForm({'phone': '+7', 'address': 'Адрес', 'checkout_key': 'key-1'})
+        self.assertTrue(form.is_valid())
+        with override_settings(TASK_QUEUE_EAGER=False):
+            place_order(self.customer, form)
+        self.assertEqual(count(), 0)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/cart/').json()['count'], 0)
+
+    def test_update_item_view(self):
+        self.client.force_login(self.user)
+        pizza = self.pizzas[0]
+        for action in ('add', 'add', 'remove'):
+            response = self.client.post('/update_item/', json.dumps({'pizzaId': pizza.id, 'action': action}),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {pizza.id: 1})
+
+
+class AsyncCartViewTests(TestCase):
+    def setUp(self):
+        self.pizza = make_pizza(User.objects.create_user('staff'), price=250)
+        self.client = AsyncClient()
+
+    async def test_guest_cart_through_async_views(self):
+        response = await self.client.post('/update_item/', {'items': [{'pizzaId': self.pizza.id, 'delta': 2}]},
+                                          content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+        summary = (await self.client.get('/api/cart/')).json()
+        self.assertEqual((summary['count'], summary['total']), (2, 500))
+
+        response = await self.client.get('/api/pizzas/', {'type': 'beef'})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_bad_requests(self):
+        response = await self.client.post('/update_item/', '{not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = await self.client.post('/update_item/', {'pizzaId': 999999, 'action': 'add'},
+                                          content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        response = await self.client.get('/update_item/')
+        self.assertEqual(response.status_code, 405)
+        response = await self.client.get('/api/pizzas/', {'type': 'pineapple'})
+        self.assertEqual(response.status_code, 400)
+
+
+class UpdateCartConcurrencyTests(TransactionTestCase):
+    THREADS = 6
+    CLICKS = 10
+
+    def test_parallel_clicks_lose_no_increments(self):
+        user = User.objects.create_user('buyer', password='pizzaproga')
+        pizza = make_pizza(user)
+        errors = []
+
+        def click(count):
+            try:
+                for _ in range(count):
+                    # SQLite blocks the whole database while writing and may refuse a concurrent writer;
+                    # a refused transaction has not changed anything, so the client just repeats the click.
+                    while True:
+                        try:
+                            update_cart(user.customer, {pizza.id: 1})
+                            break
+                        except OperationalError:
+                            time.sleep(0.001)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=click, args=(self.CLICKS,)) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.filter(customer=user.customer, complete=False).count(), 1)
+        self.assertEqual(OrderItem.objects.get(pizza=pizza).quantity, self.THREADS * self.CLICKS)
+
+
+@override_settings(DEBUG=True)
+class StorefrontQueryBudgetTests(TransactionTestCase):
+    """
+    Количество SQL-запросов на страницах витрины не превышает бюджетов из main.benchmarks.QUERY_BUDGETS
+    (те же сценарии прогоняет manage.py bench_storefront).
+    """
+
+    def setUp(self):
+        cache.clear()
+        seed(random.Random(1), pizzas=30, customers=5, orders=20)
+
+    def test_query_budgets(self):
+        results = run_suite(repeat=3)
+        self.assertEqual(check_results(results), [])
+
+
+class ServerTimingTests(TestCase):
+    @override_settings(PERF_SERVER_TIMING=True, PERF_SAMPLE_RATE=1.0)
+    def test_header_when_enabled(self):
+        self.assertIn('db;', self.client.get('/api/cart/')['Server-Timing'])
+
+    @override_settings(PERF_SERVER_TIMING=False)
+    def test_no_header_when_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/cart/'))
+
+
+class LoginCartMergeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.first, self.second = make_pizza(self.user), make_pizza(self.user)
+        update_cart(self.user.customer, {self.first.id: 1})
+
+    def quantities(self):
+        return dict(OrderItem.objects.filter(order__customer__user=self.user, order__complete=False)
+                    .values_list('pizza_id', 'quantity'))
+
+    def test_cookie_cart_is_merged_on_login(self):
+        self.client.cookies['cart'] = json.dumps({str(self.first.id): {'quantity': 2},
+                                                  str(self.second.id): {'quantity': 3}, '999999': {'quantity': 1}})
+        response = self.client.post('/login/', {'username': 'buyer', 'password': 'secret'})
+
+        self.assertEqual(self.quantities(), {self.first.id: 3, self.second.id: 3})
+        self.assertEqual(response.cookies['cart']['max-age'], 0)
+        self.assertEqual(self.client.get('/api/cart/').json()['count'], 6)
+
+    @override_settings(GUEST_CART_STORAGE='server')
+    def test_server_cart_is_merged_on_login(self):
+        self.client.post('/update_item/', {'items': [{'pizzaId': self.second.id, 'delta': 2}]},
+                         content_type='application/json')
+        response = self.client.post('/login/', {'username': 'buyer', 'password': 'secret'})
+
+        self.assertEqual(self.quantities(), {self.first.id: 1, self.second.id: 2})
+        self.assertEqual(response.cookies['cart_id']['max-age'], 0)
+
+
+class CustomerLifecycleTests(TestCase):
+    def test_customer_created_once_and_not_rewritten_on_login(self):
+        user = User.objects.create_user('buyer', password='secret')
+        self.assertTrue(Customer.objects.filter(user=user).exists())
+
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post('/login/', {'username': 'buyer', 'password': 'secret'})
+        customer_writes = [query['sql'] for query in captured.captured_queries
+                           if 'main_customer' in query['sql'] and not query['sql'].startswith('SELECT')]
+        self.assertEqual(customer_writes, [])
+
+
+@override_settings(DEBUG=True)
+class StubPaymentTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user('author')
+        self.pizza = make_pizza(author, price=300)
+        self.client.post('/update_item/', {'items': [{'pizzaId': self.pizza.id, 'delta': 2}]},
+                         content_type='application/json')
+        response = self.client.post('/checkout/', {'phone': '+7', 'address': 'Адрес', 'checkout_key': 'key-1'})
+        self.assertRedirects(response, '/payment/?order=key-1')
+
+    def intent(self):
+        return self.client.post('/payment/intent/', {'order': 'key-1'}, content_type='application/json').json()
+
+    def notify(self, intent, **overrides):
+        body = {'intent': intent['intentId'], 'signature': intent['clientData']['signature'], 'amount': intent['amount']}
+        body.update(overrides)
+        return self.client.post('/payment/webhook/', body, content_type='application/json')
+
+    def test_amount_comes_from_the_order(self):
+        intent = self.intent()
+        self.assertEqual(intent['amount'], 600)
+        self.assertEqual(self.intent()['intentId'], intent['intentId'])
+
+    def test_webhook_captures_once(self):
+        intent = self.intent()
+        self.assertEqual(self.notify(intent).json(), {'status': 'captured'})
+        self.assertEqual(self.notify(intent).json(), {'status': 'captured'})
+        payment = Payment.objects.get()
+        self.assertEqual(payment.status, Payment.STATUS_CAPTURED)
+        self.assertEqual(payment.order.transaction_id, intent['intentId'])
+
+    def test_rejects_bad_signature_and_wrong_amount(self):
+        intent = self.intent()
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.notify(intent, signature='forged').status_code, 400)
+        self.assertEqual(Payment.objects.get().status, Payment.STATUS_CREATED)
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.notify(intent, amount=1).status_code, 400)
+        self.assertEqual(Payment.objects.get().status, Payment.STATUS_FAILED)
+
+    def test_rejects_malformed_amount_and_stub_capture(self):
+        intent = self.intent()
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.notify(intent, amount='lots').status_code, 400)
+            self.assertEqual(self.notify(intent, amount=None).status_code, 400)
+            response = self.client.post('/payment/capture/', {'intentId': intent['intentId']},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Payment.objects.get().status, Payment.STATUS_CREATED)
+
+    def test_stub_refused_without_debug(self):
+        with override_settings(DEBUG=False), self.assertRaises(ImproperlyConfigured):
+            get_provider()
+
+
+class PaymentProviderConfigTests(TestCase):
+    @override_settings(PAYMENT_PROVIDER='main.payments.PayPalProvider', PAYMENT_PROVIDER_OPTIONS={'secret': 's'})
+    def test_missing_paypal_keys(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'client_id, webhook_id'):
+            get_provider()
+        self.assertEqual([error.id for error in check_payment_provider(None)], ['main.E001'])
+
+    @override_settings(PAYMENT_PROVIDER='main.payments.PayPalProvider',
+                       PAYMENT_PROVIDER_OPTIONS={'client_id': 'id', 'secret': 's', 'webhook_id': 'hook', 'region': 'eu'})
+    def test_unknown_option(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'region'):
+            get_provider()
+
+    @override_settings(PAYMENT_PROVIDER='main.payments.PayPalProvider',
+                       PAYMENT_PROVIDER_OPTIONS={'client_id': 'id', 'secret': 's', 'webhook_id': 'hook'})
+    def test_configured_paypal(self):
+        self.assertEqual(get_provider().name, 'paypal')
+        self.assertEqual(check_payment_provider(None), [])
+
+
+@task(max_attempts=2)
+def failing_task(message):
+    raise ValueError(message)
+
+
+@override_settings(TASK_QUEUE_EAGER=False)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', email='buyer@example.com')
+        self.pizza = make_pizza(self.user, price=500)
+        self.client.force_login(self.user)
+
+    def test_checkout_side_effects_run_in_worker(self):
+        self.client.post('/update_item/', {'items': [{'pizzaId': self.pizza.id, 'delta': 2}]},
+                         content_type='application/json')
+        self.client.post('/checkout/', {'phone': '+7', 'address': 'Адрес', 'checkout_key': 'key-1'})
+        self.assertEqual(Task.objects.filter(status=Task.STATUS_PENDING).count(), 3)
+        self.assertEqual(Customer.objects.get(user=self.user).bonus_points, 0)
+
+        self.assertEqual(run_pending(), (3, 0))
+        self.assertEqual(run_pending(), (0, 0))
+        self.assertEqual(Customer.objects.get(user=self.user).bonus_points, Order.objects.get().get_bonus_points)
+        self.assertEqual(BestsellerStat.objects.get(window='7d').quantity, 2)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_eager_mode_runs_tasks_after_commit(self):
+        self.client.post('/update_item/', {'items': [{'pizzaId': self.pizza.id, 'delta': 1}]},
+                         content_type='application/json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/checkout/', {'phone': '+7', 'address': 'Адрес', 'checkout_key': 'key-1'})
+        self.assertFalse(Task.objects.filter(status=Task.STATUS_PENDING).exists())
+        self.assertEqual(Customer.objects.get(user=self.user).bonus_points, Order.objects.get().get_bonus_points)
+
+    def test_failed_task_is_retried_then_given_up(self):
+        enqueue((failing_task, {'message': 'boom'}))
+        with self.assertLogs('main.tasks', 'ERROR'):
+            self.assertEqual(run_pending(), (0, 1))
+        queued = Task.objects.get()
+        self.assertEqual((queued.status, queued.attempts), (Task.STATUS_PENDING, 1))
+        self.assertIn('boom', queued.last_error)
+
+        Task.objects.update(run_at=queued.created_at)
+        with self.assertLogs('main.tasks', 'ERROR'):
+            run_pending()
+        self.assertEqual(Task.objects.get().status, Task.STATUS_FAILED)
+
+
+@override_settings(TASK_QUEUE_EAGER=False)
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', email='buyer@example.com')
+        self.pizza = make_pizza(self.user, price=500)
+
+    def checkout_form(self, key='key-1'):
+        form = CheckoutForm({'phone': '+7', 'address': 'Адрес', 'checkout_key': key})
+        self.assertTrue(form.is_valid(), form.errors)
+        return form
+
+    def test_resubmitted_checkout_returns_same_order(self):
+        update_cart(self.user.customer, {self.pizza.id: 2})
+        order = place_order(self.user.customer, self.checkout_form())
+        self.assertEqual(Task.objects.count(), 3)
+        run_pending()
+
+        self.assertEqual(place_order(self.user.customer, self.checkout_form()), order)
+        self.assertEqual(Task.objects.count(), 3)
+        self.assertEqual(run_pending(), (0, 0))
+        self.assertEqual(Order.objects.filter(complete=True).count(), 1)
+        self.assertEqual(Customer.objects.get(user=self.user).bonus_points, order.get_bonus_points)
+
+    def test_empty_cart_is_not_placed(self):
+        with self.assertRaises(EmptyCartError):
+            place_order(self.user.customer, self.checkout_form())
+        self.assertFalse(Order.objects.filter(complete=True).exists())
+        self.assertFalse(Task.objects.exists())
+
+        self.client.force_login(self.user)
+        response = self.client.post('/checkout/', {'phone': '+7', 'address': 'Адрес', 'checkout_key': 'key-2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Корзина пуста', response.context['form'].non_field_errors())
+
+    def test_key_of_another_customer_is_a_conflict(self):
+        other = User.objects.create_user('other')
+        update_cart(self.user.customer, {self.pizza.id: 1})
+        update_cart(other.customer, {self.pizza.id: 4})
+        order = place_order(self.user.customer, self.checkout_form())
+
+        with self.assertRaises(CheckoutKeyConflict):
+            place_order(other.customer, self.checkout_form())
+        with self.assertRaises(CheckoutKeyConflict):
+            place_guest_order([CartLine(self.pizza, 1)], self.checkout_form())
+        self.assertEqual(list(Order.objects.filter(complete=True)), [order])
+
+        self.client.force_login(other)
+        response = self.client.post('/checkout/', {'phone': '+7', 'address': 'Адрес', 'checkout_key': 'key-1'})
+        self.assertEqual(response.status_code, 200)
+        form = response.context['form']
+        self.assertIn('Форма устарела, подтвердите заказ еще раз', form.non_field_errors())
+        self.assertNotEqual(form['checkout_key'].value(), 'key-1')
+
+        response = self.client.post('/checkout/', {'phone': '+7', 'address': 'Адрес',
+                                                   'checkout_key': form['checkout_key'].value()})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get(customer=other.customer, complete=True).orderitem_set.get().quantity, 4)
+
+    def test_guest_checkout_is_idempotent(self):
+        self.client.cookies['cart'] = json.dumps({str(self.pizza.id): {'quantity': 3}})
+        data = {'phone': '+7', 'address': 'Адрес', 'checkout_key': 'guest-key'}
+        first = self.client.post('/checkout/', data)
+        # cookie корзины уже очищен: повторная отправка находит заказ по ключу
+        second = self.client.post('/checkout/', data)
+
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(second['Location'], first['Location'])
+        order = Order.objects.get()
+        self.assertEqual((order.complete, order.customer), (True, None))
+        self.assertEqual(list(order.orderitem_set.values_list('pizza_id', 'quantity')), [(self.pizza.id, 3)])
+        self.assertEqual(Task.objects.count(), 1)
+
+
+@override_settings(BESTSELLER_WINDOWS={'short': 2, 'long': 6})
+class BestsellerWindowTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = datetime.datetime(2026, 3, 10, 12, 30, tzinfo=datetime.timezone.utc)
+        self.pizza = make_pizza(User.objects.create_user('buyer'))
+
+    def order(self, quantity, hours_ago):
+        order = Order.objects.create(complete=True)
+        Order.objects.filter(pk=order.pk).update(date_ordered=self.now - datetime.timedelta(hours=hours_ago))
+        OrderItem.objects.create(order=order, pizza=self.pizza, quantity=quantity)
+        return Order.objects.get(pk=order.pk)
+
+    def stats(self):
+        return dict(BestsellerStat.objects.values_list('window', 'quantity'))
+
+    def sales(self):
+        return sorted(PizzaSales.objects.values_list('hour', 'quantity'))
+
+    def test_sales_leave_windows_as_hours_pass(self):
+        record_sale(self.order(1, hours_ago=3))
+        record_sale(self.order(2, hours_ago=0))
+        self.assertEqual(self.stats(), {'short': 3, 'long': 3})
+
+        expire_windows(self.now)
+        self.assertEqual(self.stats(), {'short': 2, 'long': 3})
+        self.assertEqual(BestsellerWindow.objects.get(name='short').start, self.now.replace(minute=0) - datetime.timedelta(hours=1))
+
+        # отметка в кэше другого процесса не видна: повторный сдвиг не должен вычитать еще раз
+        cache.clear()
+        expire_windows(self.now)
+        self.assertEqual(self.stats(), {'short': 2, 'long': 3})
+
+        expire_windows(self.now + datetime.timedelta(hours=6))
+        self.assertEqual(self.stats(), {})
+        self.assertEqual(self.sales(), [])
+
+    def test_late_sale_is_not_added_to_moved_window(self):
+        expire_windows(self.now)
+        record_sale(self.order(1, hours_ago=0))
+        expire_windows(self.now + datetime.timedelta(hours=3))
+        record_sale(self.order(4, hours_ago=0))
+        self.assertEqual(self.stats(), {'long': 5})
+
+    @override_settings(TIME_ZONE='Asia/Kolkata')
+    def test_rebuild_matches_incremental_hours(self):
+        for quantity, hours_ago in ((1, 5), (2, 1), (3, 0)):
+            record_sale(self.order(quantity, hours_ago))
+        expire_windows(self.now)
+        incremental = (self.sales(), self.stats())
+
+        rebuild_bestsellers(self.now)
+        self.assertEqual((self.sales(), self.stats()), incremental)
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2026, 5, 10, 12, 0, tzinfo=datetime.timezone.utc)
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.margherita = make_pizza(self.staff, name='Маргарита', price=100, type=3)
+        self.pepperoni = make_pizza(self.staff, name='Пепперони', price=250, type=2)
+
+    def order(self, when, complete=True, **quantities):
+        order = Order.objects.create(complete=complete)
+        Order.objects.filter(pk=order.pk).update(date_ordered=when)
+        for name, quantity in quantities.items():
+            OrderItem.objects.create(order=order, pizza=getattr(self, name), quantity=quantity)
+
+    def report(self, group='pizza'):
+        day = self.now.date()
+        return {row['name']: (row['quantity'], row['revenue'])
+                for row in sales_report(day - datetime.timedelta(days=5), day + datetime.timedelta(days=1), group)}
+
+    def test_watermark_moves_forward_and_reruns_do_not_double_count(self):
+        self.order(self.now - datetime.timedelta(days=2), margherita=2)
+        self.order(self.now - datetime.timedelta(days=1), margherita=1, pepperoni=1)
+        self.order(self.now - datetime.timedelta(days=1), complete=False, pepperoni=7)
+        # заказ последней минуты ждет следующего запуска
+        self.order(self.now - datetime.timedelta(seconds=30), pepperoni=5)
+
+        self.assertEqual(rollup_sales(self.now), 4)
+        self.assertEqual(get_rollup_position(), self.now - datetime.timedelta(minutes=1))
+        self.assertEqual(rollup_sales(self.now), 0)
+        self.assertEqual(self.report(), {'Маргарита': (3, 300), 'Пепперони': (1, 250)})
+
+        self.order(self.now + datetime.timedelta(minutes=2), margherita=1)
+        self.assertEqual(rollup_sales(self.now + datetime.timedelta(minutes=10)), 6)
+        self.assertEqual(self.report(), {'Маргарита': (4, 400), 'Пепперони': (6, 1500)})
+        self.assertEqual(self.report('type'), {'С колбасой': (6, 1500), 'Вегетарианская': (4, 400)})
+        self.assertEqual([row['quantity'] for row in daily_totals(self.now.date() - datetime.timedelta(days=5),
+                                                                   self.now.date())], [2, 2, 6])
+
+    def test_csv_export(self):
+        self.order(self.now - datetime.timedelta(days=1), margherita=3, pepperoni=1)
+        rollup_sales(self.now)
+        self.client.force_login(self.staff)
+        day = self.now.date()
+
+        response = self.client.get('/staff/analytics/', {'format': 'csv', 'group': 'pizza',
+                                                         'start': day - datetime.timedelta(days=7), 'end': day})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('sales_pizza_', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(response.content.decode())))
+        self.assertEqual(rows, [['name', 'quantity', 'revenue'], ['Маргарита', '3', '300'], ['Пепперони', '1', '250']])
+
+        self.assertEqual(self.client.get('/staff/analytics/', {'start': 'yesterday'}).status_code, 400)
+
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        archive_root = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_root.cleanup)
+        settings_override = override_settings(ORDER_ARCHIVE_ROOT=archive_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_archive_storage.cache_clear()
+        self.addCleanup(get_archive_storage.cache_clear)
+
+        self.now = timezone.now()
+        user = User.objects.create_user('buyer')
+        self.pizza = make_pizza(user, price=400)
+        for days in (400, 300, 200, 10):
+            order = Order.objects.create(customer=user.customer, complete=True)
+            Order.objects.filter(pk=order.pk).update(date_ordered=self.now - datetime.timedelta(days=days))
+            OrderItem.objects.create(order=order, pizza=self.pizza, quantity=2)
+            OrderData.objects.create(order=order, address=f'Адрес {days}', phone='+7')
+
+    def report(self):
+        return sales_report(self.now.date() - datetime.timedelta(days=500), self.now.date())
+
+    def test_old_orders_move_to_archive_and_stay_in_reports(self):
+        rollup_sales(self.now)
+        before = self.report()
+
+        self.assertEqual(archive_orders(180, self.now, batch_size=2), 3)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.assertEqual(OrderData.objects.count(), 1)
+
+        archived = list(iter_archived_orders(end=self.now - datetime.timedelta(days=250)))
+        self.assertEqual([order['data']['address'] for order in archived], ['Адрес 400', 'Адрес 300'])
+        self.assertEqual(archived[0]['items'], [{'pizza_id': self.pizza.id, 'name': 'Пицца', 'type': 0,
+                                                 'price': 400, 'quantity': 2}])
+
+        self.assertEqual(rebuild_rollups(), 8)
+        self.assertEqual(self.report(), before)
+
+    def test_nothing_archived_before_rollups(self):
+        self.assertEqual(archive_orders(180, self.now), 0)
+        self.assertEqual(Order.objects.count(), 4)
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    class Router(PrimaryReplicaRouter):
+        def replica_alias(self):
+            return 'replica'
+
+    def setUp(self):
+        self.router = self.Router()
+
+    def test_catalog_reads_go_to_replica_and_cart_to_primary(self):
+        self.assertEqual(self.router.db_for_read(Pizza), 'replica')
+        self.assertEqual(self.router.db_for_read(Order), 'default')
+        self.assertEqual(self.router.db_for_write(Pizza), 'default')
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Pizza), 'default')
+
+    def test_write_pins_rest_of_request_to_primary(self):
+        state, token = start_request(pinned=False)
+        try:
+            self.router.db_for_write(Session)
+            self.assertEqual(self.router.db_for_read(Pizza), 'replica')
+            self.router.db_for_write(Pizza)
+            self.assertEqual(self.router.db_for_read(Pizza), 'default')
+        finally:
+            finish_request(token)
+        self.assertTrue(state['wrote'])
+
+
+class ReplicaPinMiddlewareTests(TransactionTestCase):
+    """
+    Реплика - второе соединение с той же тестовой базой: маршрут запроса виден по тому, через какое соединение
+    прошли запросы. Алиас добавляется после настройки класса, поэтому тестовый раннер его не создает и не очищает.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connections.databases['replica'] = {**connections['default'].settings_dict, 'TEST': {'MIRROR': 'default'}}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.pizza = make_pizza(User.objects.create_user('staff'))
+        cache.clear()
+
+    def catalog_queries(self):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.client.get('/api/pizzas/').status_code, 200)
+        return len(primary), len(replica)
+
+    def test_cart_change_pins_client_to_primary(self):
+        self.assertEqual(self.catalog_queries(), (0, 1))
+        self.assertNotIn('db_primary', self.client.cookies)
+
+        response = self.client.post('/update_item/', {'pizzaId': self.pizza.id, 'action': 'add'},
+                                    content_type='application/json')
+        self.assertEqual(response.cookies['db_primary']['max-age'], 5)
+        self.assertEqual(self.catalog_queries(), (1, 0))
+
+        del self.client.cookies['db_primary']
+        self.assertEqual(self.catalog_queries(), (0, 1))
+
+    def test_login_does_not_pin(self):
+        User.objects.create_user('buyer', password='secret')
+        response = self.client.post('/login/', {'username': 'buyer', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('db_primary', response.cookies)
+
+
+class PizzaImageStorageTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user('staff', password='pizzaproga', is_staff=True)
+
+    def test_same_image_is_stored_once(self):
+        names = set()
+        for _ in range(2):
+            form = PizzaCreationForm({'name': 'Пицца', 'description': 'Описание', 'type': 0, 'price': 100, 'rating': 0},
+                                     {'image': png_upload()}, instance=Pizza(author=self.staff))
+            self.assertTrue(form.is_valid(), form.errors)
+            names.add(form.save().image.name)
+        self.assertEqual(len(names), 1)
+        self.assertEqual(self.stored_files().count(names.pop()), 1)
+
+    def test_concurrent_save_keeps_existing_file(self):
+        name = image_storage.save('pizzas/ab/abc.png', ContentFile(b'first'))
+        # Параллельная загрузка проверила exists() до того, как файл был записан.
+        with mock.patch.object(image_storage, 'exists', return_value=False):
+            self.assertEqual(image_storage.save(name, ContentFile(b'second')), name)
+        with image_storage.open(name) as file:
+            self.assertEqual(file.read(), b'first')
+        self.assertEqual(self.stored_files(), [os.path.normpath(name)])
+
+    def test_invalid_form_stores_nothing(self):
+        self.client.force_login(self.staff)
+        response = self.client.post('/creating_position/', {'name': 'Пицца', 'description': 'Описание', 'type': 0,
+                                                            'price': -1, 'rating': 0, 'image': png_upload()})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('price', response.context['form'].errors)
+        self.assertFalse(Pizza.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class PizzaImageVariantTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user('staff', password='pizzaproga', is_staff=True, is_superuser=True)
+
+    def create_pizza(self, color='red'):
+        return Pizza.objects.create(author=self.staff, name='Пицца', description='Описание', price=100, rating=0,
+                                    image=png_upload(color=color, size=(1000, 500)))
+
+    def test_variants_in_every_format_and_width(self):
+        variants = build_variants(png_upload(size=(1000, 500)))
+        formats = [mime for pil_format, extension, mime, module in IMAGE_VARIANT_FORMATS if features.check(module)]
+        self.assertIn('image/jpeg', formats)
+        self.assertEqual([(v['type'], v['width'], v['height']) for v in variants],
+                         [(mime, width, width // 2) for mime in formats for width in (320, 640, 960)])
+        self.assertTrue(all(v['url'].startswith('/media/variants/') for v in variants))
+        self.assertEqual(len(self.stored_files()), len(variants))
+
+        small = build_variants(png_upload(size=(200, 100)))
+        self.assertEqual({v['width'] for v in small}, {200})
+
+    def test_srcset_rendering(self):
+        pizza = self.create_pizza()
+        jpeg = next(source for source in pizza.image_sources if source['type'] == 'image/jpeg')
+        self.assertEqual([entry.split()[1] for entry in jpeg['srcset'].split(', ')], ['320w', '640w', '960w'])
+
+        html = render_to_string('pages/includes/pizza_grid.html', {'pizzas': [pizza], 'empty_message': ''})
+        self.assertIn(f'<source type="image/jpeg" srcset="{jpeg["srcset"]}"', html)
+
+    def test_image_change_rebuilds_variants(self):
+        pizza = self.create_pizza()
+        old_variants = pizza.image_variants
+        self.client.force_login(self.staff)
+        response = self.client.post(f'/admin/main/pizza/{pizza.pk}/change/', {
+            'author': self.staff.pk, 'name': 'Пицца', 'description': 'Описание', 'price': 100, 'rating': 0,
+            'type': 0, 'created_at_0': '2026-01-01', 'created_at_1': '12:00:00', 'image_variants': '[]',
+            'image': png_upload(color='blue', size=(1000, 500)),
+        })
+        self.assertEqual(response.status_code, 302)
+        pizza.refresh_from_db()
+        self.assertEqual(len(pizza.image_variants), len(old_variants))
+        self.assertNotEqual(pizza.image_variants, old_variants)
+
+        # замена уже сохраненным файлом: копии строит build_image_variants
+        pizza = Pizza.objects.get(pk=pizza.pk)
+        pizza.image = self.create_pizza(color='green').image.name
+        pizza.save(update_fields=['image'])
+        self.assertEqual(Pizza.objects.get(pk=pizza.pk).image_variants, [])
+
+    def test_backfill_command(self):
+        pizza = self.create_pizza()
+        variants = pizza.image_variants
+        Pizza.objects.update(image_variants=[])
+
+        out = io.StringIO()
+        call_command('build_image_variants', workers=1, stdout=out)
+        self.assertEqual(Pizza.objects.get(pk=pizza.pk).image_variants, variants)
+        self.assertIn('Обработано картинок: 1', out.getvalue())
+
+        call_command('build_image_variants', workers=1, stdout=out)
+        self.assertIn('Все картинки уже обработаны.', out.getvalue())
+
+
+class MenuImportExportTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user('staff')
+        self.workdir = tempfile.mkdtemp(dir=self.media_root)
+        for i, color in enumerate(('red', 'green')):
+            form = PizzaCreationForm({'name': f'Пицца {i}', 'description': 'Описание', 'type': i, 'price': 300 + i,
+                                      'rating': i}, {'image': png_upload(f'{color}.png', color)},
+                                     instance=Pizza(author=self.author))
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+
+    def run_command(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command(*args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def menu(self):
+        return list(Pizza.objects.order_by('id').values_list('id', 'name', 'type', 'price', 'rating'))
+
+    def test_export_import_round_trip(self):
+        before = self.menu()
+        for fmt in ('jsonl', 'csv'):
+            path = os.path.join(self.workdir, f'menu.{fmt}')
+            images = os.path.join(self.workdir, f'images-{fmt}')
+            self.run_command('export_menu', path, '--images-dir', images)
+            Pizza.objects.all().delete()
+
+            out, err = self.run_command('import_menu', path, '--author', 'staff', '--images-dir', images)
+            self.assertEqual(err, '')
+            self.assertEqual(out.count('Создано: 2, обновлено: 0, ошибок: 0'), 1)
+            self.assertEqual(self.menu(), before)
+            self.assertTrue(all(pizza.image and pizza.image_variants for pizza in Pizza.objects.all()))
+
+            out, err = self.run_command('import_menu', path, '--author', 'staff', '--images-dir', images)
+            self.assertIn('Создано: 0, обновлено: 2, ошибок: 0', out)
+            self.assertEqual(self.menu(), before)
+
+    def test_bad_rows_are_reported(self):
+        path = os.path.join(self.workdir, 'menu.jsonl')
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write('{not json\n')
+            stream.write('[1, 2]\n')
+            stream.write(json.dumps({'id': Pizza.objects.first().pk, 'name': 'Новое имя', 'description': 'Описание',
+                                     'type': 0, 'price': 10, 'rating': 1}) + '\n')
+            stream.write(json.dumps({'name': 'Без картинки', 'description': 'Описание', 'type': 0, 'price': 10,
+                                     'rating': 1}) + '\n')
+
+        out, err = self.run_command('import_menu', path, '--author', 'staff')
+        self.assertIn('Строка 1:', err)
+        self.assertIn('Строка 2:', err)
+        self.assertIn('Строка 4: у новой пиццы должна быть картинка', err)
+        self.assertIn('Создано: 0, обновлено: 1, ошибок: 3', out)
+        self.assertTrue(Pizza.objects.filter(name='Новое имя').exists())
+
+        with self.assertRaises(CommandError):
+            self.run_command('import_menu', path, '--author', 'staff', '--max-errors', '2')
@@ -1,50 +1,453 @@
 import json
-from . models import *
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
 
-def cookieCart(request):
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+
+from main.models import Pizza, Order, OrderItem, CartSummary
+
+logger = logging.getLogger(__name__)
+
+CART_PIZZA_FIELDS = ('id', 'name', 'price', 'image', 'image_variants')
+CART_COUNT_CACHE_KEY = 'cart_count:{user_id}'
+# без общего кэша сброс в другом процессе не виден, и значок может отставать на это время
+CART_COUNT_TIMEOUT = 60
+CART_ACTIONS = {'add': 1, 'remove': -1}
+GUEST_CART_KEY = 'guest_cart:{cart_id}'
+GUEST_CART_SALT = 'main.guest_cart'
+
+
+@dataclass
+class CartLine:
+    """
+    Одна позиция корзины покупателя без регистрации.
+
+    :param pizza: Пицца (из базы загружены только поля CART_PIZZA_FIELDS)
+    :type pizza: :class:`~Pizza`
+    :param quantity: Количество пиццы этого вида в корзине
+    :type quantity: int
+    """
+    pizza: Pizza
+    quantity: int
+
+    @property
+    def get_total(self):
+        """
+        Сумма по позиции (совпадает по имени с OrderItem.get_total, чтобы шаблоны работали с обоими видами корзины).
+        """
+        return self.pizza.price * self.quantity
+
+
+def parse_cart_cookie(raw):
+    """
+    Разбор и проверка cookie "cart" вида {"<id пиццы>": {"quantity": <количество>}}.
+
+    :param raw: Строка из cookie (или None)
+    :return: Кортеж из словаря {id пиццы: количество} и списка некорректных ключей.
+    """
+    if not raw:
+        return {}, []
     try:
-        cart = json.loads(request.COOKIES['cart'])
-    except:
-        cart = {}
-    items = []
-    order = {'get_cart_total': 0, 'get_cart_items': 0, 'get_bonus_points': 0}
-    notifications = order['get_cart_items']
+        cart = json.loads(raw)
+    except ValueError:
+        logger.warning('Cart cookie is not valid JSON: %r', raw[:100])
+        return {}, []
+    if not isinstance(cart, dict):
+        logger.warning('Cart cookie is not a JSON object: %r', raw[:100])
+        return {}, []
 
-    for i in cart:
+    quantities = {}
+    invalid = []
+    for key, entry in cart.items():
         try:
-            notifications += cart[i]["quantity"]
-
-            pizza = Pizza.objects.get(id=i)
-            total = (pizza.price * cart[i]["quantity"])
-
-            order['get_cart_total'] += total
-            order['get_cart_items'] += cart[i]["quantity"]
-
-            item = {
-                'pizza': {
-                    'id': pizza.id,
-                    'name': pizza.name,
-                    'price': pizza.price,
-                    'imageURL': pizza.imageURL,
-                },
-                'quantity': cart[i]["quantity"],
-                'get_total': total
-            }
-            items.append(item)
-        except:
-            pass
-    return {'notifications': notifications, 'order': order, 'items': items}
+            pizza_id = int(key)
+            quantity = int(entry['quantity'])
+        except (TypeError, ValueError, KeyError):
+            invalid.append(key)
+            continue
+        if pizza_id <= 0 or quantity <= 0:
+            invalid.append(key)
+            continue
+        quantities[pizza_id] = quantities.get(pizza_id, 0) + quantity
+    return quantities, invalid
 
 
-def cart_data(request):
+def resolve_lines(quantities, invalid_ids=None):
+    """
+    Позиции корзины покупателя без регистрации. Все пиццы загружаются одним запросом (in_bulk),
+    неизвестные ID попадают в invalid_ids и пишутся в лог.
+
+    :param quantities: Словарь {id пиццы: количество}
+    :param invalid_ids: Список уже отброшенных ключей, который дополняется неизвестными ID
+    :return: Кортеж из списка позиций (CartLine), итогов (:class:`~CartSummary`) и списка отброшенных ключей.
+    """
+    invalid_ids = list(invalid_ids or [])
+    pizzas = Pizza.objects.only(*CART_PIZZA_FIELDS).in_bulk(quantities) if quantities else {}
+
+    items = []
+    for pizza_id, quantity in quantities.items():
+        pizza = pizzas.get(pizza_id)
+        if pizza is None:
+            invalid_ids.append(str(pizza_id))
+            continue
+        items.append(CartLine(pizza=pizza, quantity=quantity))
+
+    if invalid_ids:
+        logger.info('Dropped unknown or invalid pizza ids from guest cart: %s', ', '.join(invalid_ids))
+    summary = CartSummary(
+        get_cart_items=sum(item.quantity for item in items),
+        get_cart_total=sum(item.get_total for item in items),
+    )
+    return items, summary, invalid_ids
+
+
+def cookieCart(request):
+    """
+    Корзина покупателя без регистрации, хранящаяся в cookie.
+
+    :return: Словарь с количеством товаров (notifications), итогами заказа (order, :class:`~CartSummary`),
+        позициями (items) и списком отброшенных ключей (invalid_ids).
+    """
+    quantities, invalid_ids = parse_cart_cookie(request.COOKIES.get('cart'))
+    items, order, invalid_ids = resolve_lines(quantities, invalid_ids)
+    return {'notifications': order.get_cart_items, 'order': order, 'items': items, 'invalid_ids': invalid_ids}
+
+
+class DatabaseCart:
+    """
+    Корзина зарегистрированного покупателя - его открытый заказ в базе данных.
+
+    У всех корзин (DatabaseCart, CookieGuestCart, ServerGuestCart) одинаковый интерфейс: lines(), line_totals(ids),
+    summary(), count(), update(deltas), clear() и set_cookie(response).
+
+    :param user: Пользователь
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def order(self):
+        return get_open_order(self.user.customer)
+
+    def lines(self):
+        return self.order.get_items()
+
+    def line_totals(self, pizza_ids):
+        """
+        Количество и сумма по выбранным позициям одним запросом.
+
+        :param pizza_ids: ID пицц
+        :return: Словарь {id пиццы: (количество, сумма)}; позиций, которых нет в корзине, в нем нет.
+        """
+        rows = self.order.orderitem_set.filter(pizza_id__in=pizza_ids).values_list('pizza_id', 'quantity', 'pizza__price')
+        return {pizza_id: (quantity, quantity * price) for pizza_id, quantity, price in rows}
+
+    def summary(self):
+        return self.order.summary
+
+    def count(self):
+        """
+        Количество товаров из кэша; после сброса (invalidate_cart_count) пересчитывается одним запросом.
+        """
+        key = CART_COUNT_CACHE_KEY.format(user_id=self.user.pk)
+        count = cache.get(key)
+        if count is None:
+            count = Order.objects.filter(customer__user_id=self.user.pk, complete=False).aggregate(
+                count=Coalesce(Sum('orderitem__quantity'), 0),
+            )['count']
+            cache.set(key, count, CART_COUNT_TIMEOUT)
+        return count
+
+    def update(self, deltas):
+        self.order = update_cart(self.user.customer, deltas)
+
+    def clear(self):
+        self.order.orderitem_set.all().delete()
+        invalidate_cart_count(self.user.pk)
+
+    def set_cookie(self, response):
+        pass
+
+
+class GuestCart(ABC):
+    """
+    Общая часть корзин покупателя без регистрации: содержимое - словарь {id пиццы: количество}.
+    Подклассы определяют, где оно хранится: from_request, save и set_cookie.
+
+    :param quantities: Содержимое корзины
+    """
+
+    def __init__(self, quantities):
+        self.quantities = quantities
+
+    @classmethod
+    @abstractmethod
+    def from_request(cls, request):
+        """
+        Корзина текущего покупателя из cookie запроса.
+        """
+
+    @cached_property
+    def _resolved(self):
+        return resolve_lines(self.quantities)
+
+    def lines(self):
+        return self._resolved[0]
+
+    def line_totals(self, pizza_ids):
+        return {line.pizza.id: (line.quantity, line.get_total) for line in self.lines() if line.pizza.id in pizza_ids}
+
+    def summary(self):
+        return self._resolved[1]
+
+    def count(self):
+        return sum(self.quantities.values())
+
+    def update(self, deltas):
+        """
+        Изменение количества товаров.
+
+        :param deltas: Словарь {id пиццы: изменение количества}
+        :raises Pizza.DoesNotExist: Если какой-то из пицц нет в базе данных.
+        """
+        deltas = {pizza_id: delta for pizza_id, delta in deltas.items() if delta}
+        found = set(Pizza.objects.filter(id__in=deltas).values_list('id', flat=True))
+        if len(found) != len(deltas):
+            raise Pizza.DoesNotExist(f'Unknown pizza ids: {sorted(set(deltas) - found)}')
+        for pizza_id, delta in deltas.items():
+            quantity = self.quantities.get(pizza_id, 0) + delta
+            if quantity > 0:
+                self.quantities[pizza_id] = quantity
+            else:
+                self.quantities.pop(pizza_id, None)
+        self.__dict__.pop('_resolved', None)
+        self.save()
+
+    def clear(self):
+        self.quantities = {}
+        self.__dict__.pop('_resolved', None)
+        self.save()
+
+    def save(self):
+        """
+        Сохранение содержимого на сервере (корзине в cookie сохранять нечего).
+        """
+
+    @abstractmethod
+    def set_cookie(self, response):
+        """
+        Запись в ответ cookie, по которой корзина найдется в следующем запросе.
+
+        :param response: Ответ, в который записывается cookie
+        """
+
+
+class CookieGuestCart(GuestCart):
+    """
+    Корзина в JSON-cookie "cart" на стороне клиента (GUEST_CART_STORAGE = 'cookie').
+    """
+
+    @classmethod
+    def from_request(cls, request):
+        quantities, invalid_ids = parse_cart_cookie(request.COOKIES.get('cart'))
+        return cls(quantities)
+
+    def set_cookie(self, response):
+        if self.quantities:
+            cart = {str(pizza_id): {'quantity': quantity} for pizza_id, quantity in self.quantities.items()}
+            response.set_cookie('cart', json.dumps(cart, separators=(',', ':')), samesite='Lax')
+        else:
+            response.delete_cookie('cart')
+
+
+class ServerGuestCart(GuestCart):
+    """
+    Корзина, хранящаяся на сервере в кэше settings.GUEST_CART_CACHE (GUEST_CART_STORAGE = 'server'):
+    в зависимости от настроек кэша это база данных, память процесса или файлы. Клиенту отдается только
+    подписанный ID корзины в cookie settings.GUEST_CART_COOKIE.
+
+    :param cart_id: ID корзины (None, пока корзина не сохранена)
+    :param quantities: Содержимое корзины
+    """
+
+    def __init__(self, cart_id, quantities):
+        super().__init__(quantities)
+        self.cart_id = cart_id
+
+    @staticmethod
+    def _storage():
+        return caches[settings.GUEST_CART_CACHE]
+
+    @classmethod
+    def from_request(cls, request):
+        cart_id = request.get_signed_cookie(settings.GUEST_CART_COOKIE, default=None, salt=GUEST_CART_SALT)
+        quantities = cls._storage().get(GUEST_CART_KEY.format(cart_id=cart_id)) if cart_id else None
+        return cls(cart_id, quantities or {})
+
+    def save(self):
+        if not self.quantities:
+            if self.cart_id:
+                self._storage().delete(GUEST_CART_KEY.format(cart_id=self.cart_id))
+            return
+        if self.cart_id is None:
+            self.cart_id = uuid.uuid4().hex
+        self._storage().set(GUEST_CART_KEY.format(cart_id=self.cart_id), self.quantities, settings.GUEST_CART_TIMEOUT)
+
+    def set_cookie(self, response):
+        if self.quantities:
+            response.set_signed_cookie(settings.GUEST_CART_COOKIE, self.cart_id, salt=GUEST_CART_SALT,
+                                       max_age=settings.GUEST_CART_TIMEOUT, httponly=True, samesite='Lax')
+        else:
+            response.delete_cookie(settings.GUEST_CART_COOKIE)
+
+
+def get_guest_cart(request):
+    """
+    Корзина покупателя без регистрации в хранилище, выбранном настройкой GUEST_CART_STORAGE.
+    """
+    if not hasattr(request, '_guest_cart'):
+        cart_class = ServerGuestCart if settings.GUEST_CART_STORAGE == 'server' else CookieGuestCart
+        request._guest_cart = cart_class.from_request(request)
+    return request._guest_cart
+
+
+def get_cart(request):
+    """
+    Корзина текущего пользователя: открытый заказ для зарегистрированного пользователя, иначе корзина гостя.
+    """
     if request.user.is_authenticated:
-        customer = request.user.customer
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        items = order.orderitem_set.all()
-        notifications = order.get_cart_items
-    else:
-        cookieData = cookieCart(request)
-        notifications = cookieData['notifications']
-        order = cookieData['order']
-        items = cookieData['items']
-    return {'notifications': notifications, 'order': order, 'items': items}
+        return DatabaseCart(request.user)
+    return get_guest_cart(request)
+
+
+def cart_data(request):
+    """
+    Данные корзины текущего пользователя для шаблонов.
+
+    :return: Словарь с количеством товаров (notifications), итогами (order, :class:`~CartSummary`) и позициями (items).
+    """
+    cart = get_cart(request)
+    summary = cart.summary()
+    return {'notifications': summary.get_cart_items, 'order': summary, 'items': cart.lines()}
+
+
+def get_cart_count(request):
+    """
+    Количество товаров в корзине для значка в меню. Для гостя считается без обращения к базе данных,
+    для зарегистрированного пользователя берется из кэша.
+
+    :return: Количество товаров в корзине.
+    """
+    return get_cart(request).count()
+
+
+def cart_state(cart, pizza_ids):
+    """
+    Состояние корзины после изменения: то, что нужно странице, чтобы обновиться без перезагрузки.
+
+    :param cart: Корзина (см. get_cart)
+    :param pizza_ids: ID измененных пицц
+    :return: Словарь с измененными позициями (items: [{pizzaId, quantity, total}], у удаленных позиций quantity = 0),
+        количеством товаров (count), суммой (total) и бонусными очками за заказ (bonus).
+    """
+    totals = cart.line_totals(pizza_ids)
+    summary = cart.summary()
+    items = []
+    for pizza_id in pizza_ids:
+        quantity, total = totals.get(pizza_id, (0, 0))
+        items.append({'pizzaId': pizza_id, 'quantity': quantity, 'total': total})
+    return {
+        'items': items,
+        'count': summary.get_cart_items,
+        'total': summary.get_cart_total,
+        'bonus': summary.get_bonus_points,
+    }
+
+
+def invalidate_cart_count(user_id):
+    """
+    Сброс закэшированного количества товаров в корзине. Вызывается после каждого изменения корзины пользователя.
+
+    :param user_id: ID пользователя (User), чья корзина изменилась
+    """
+    cache.delete(CART_COUNT_CACHE_KEY.format(user_id=user_id))
+
+
+def get_open_order(customer):
+    """
+    Открытый (незавершенный) заказ покупателя. Ограничение unique_open_order_per_customer гарантирует,
+    что при параллельных запросах get_or_create не создаст второй открытый заказ.
+
+    :param customer: Покупатель
+    :return: Открытый заказ покупателя.
+    """
+    order, created = Order.objects.get_or_create(customer=customer, complete=False)
+    return order
+
+
+def update_cart(customer, deltas, skip_unknown=False):
+    """
+    Изменение количества товаров в корзине зарегистрированного покупателя в одной транзакции.
+
+    Строка заказа блокируется (select_for_update), количество меняется выражением F('quantity') + delta,
+    поэтому одновременные клики не теряют изменения. Позиции с количеством <= 0 удаляются.
+
+    :param customer: Покупатель
+    :param deltas: Словарь {id пиццы: изменение количества}
+    :param skip_unknown: Пропускать пиццы, которых нет в базе данных, вместо ошибки
+    :return: Открытый заказ покупателя.
+    :raises Pizza.DoesNotExist: Если какой-то из пицц нет в базе данных (и skip_unknown не задан).
+    """
+    deltas = {pizza_id: delta for pizza_id, delta in deltas.items() if delta}
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=get_open_order(customer).pk)
+        if not deltas:
+            return order
+
+        found = set(Pizza.objects.filter(id__in=deltas).values_list('id', flat=True))
+        if len(found) != len(deltas):
+            if not skip_unknown:
+                raise Pizza.DoesNotExist(f'Unknown pizza ids: {sorted(set(deltas) - found)}')
+            deltas = {pizza_id: delta for pizza_id, delta in deltas.items() if pizza_id in found}
+
+        lines = order.orderitem_set.filter(pizza_id__in=deltas)
+        existing = set(lines.values_list('pizza_id', flat=True))
+        if existing:
+            lines.update(quantity=F('quantity') + Case(
+                *[When(pizza_id=pizza_id, then=Value(deltas[pizza_id])) for pizza_id in existing],
+                output_field=IntegerField(),
+            ))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, pizza_id=pizza_id, quantity=delta)
+            for pizza_id, delta in deltas.items() if pizza_id not in existing and delta > 0
+        ])
+        lines.filter(quantity__lte=0).delete()
+    invalidate_cart_count(customer.user_id)
+    return order
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    """
+    Перенос корзины гостя в открытый заказ при входе пользователя: все позиции добавляются одним вызовом
+    update_cart (одна проверка пицц, одно обновление существующих строк и одна вставка новых), после чего
+    корзина гостя очищается, а ее cookie удаляются (см. main.middleware.CartCookieMiddleware).
+    """
+    if request is None:
+        return
+    guest_cart = get_guest_cart(request)
+    if guest_cart.quantities:
+        update_cart(user.customer, guest_cart.quantities, skip_unknown=True)
+        guest_cart.clear()
+    if 'cart' in request.COOKIES or settings.GUEST_CART_COOKIE in request.COOKIES:
+        request.clear_cart_cookie = True
@@ -1,15 +1,33 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import HttpResponseRedirect, JsonResponse
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect, JsonResponse, QueryDict
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView
+import csv
+import datetime
 import json
-
+import uuid
+
+from main.analytics import REPORT_GROUPS, daily_totals, get_rollup_position, sales_report
+from main.bestsellers import get_bestseller_version, get_bestsellers
+from main.catalog import (TYPE_FILTERS, CATALOG_PAGE_SIZE, CATALOG_MAX_PAGE_SIZE, get_top_pizzas, get_pizza_page,
+                          pizza_to_dict, render_pizza_grid, get_fragment_stats)
+from main.checkout import CheckoutKeyConflict, EmptyCartError, place_guest_order, place_order
+from main.db import pin_request
 from main.forms import RegistrationForm, PizzaCreationForm, CheckoutForm
-from main.models import Pizza, Order, OrderItem, OrderData
-from main.utils import cookieCart, cart_data
+from main.models import Order, Pizza
+from main.payments import PaymentError, capture_payment, confirm_capture, get_provider, start_payment
+from main.perf import get_perf_stats, reset_perf_stats
+from main.utils import CART_ACTIONS, cart_data, cart_state, get_cart, get_cart_count, get_guest_cart
 
 
 def get_base_context(pagename):
@@ -47,8 +65,7 @@ def index_page(request):
     :return: Возвращает страницу с наименованием "Silver Pizza" и количеством товара в корзине.
     """
     context = get_base_context('Silver Pizza')
-    data = cart_data(request)
-    context['notifications'] = data['notifications']
+    context['notifications'] = get_cart_count(request)
     return render(request, 'pages/index.html', context)
 
 
@@ -71,6 +88,11 @@ class RegistrationView(CreateView):
         context['pagename'] = 'Регистрация'
         return context
 
+    def form_valid(self, form):
+        # пользователь и его покупатель (см. Customer.create_customer_from_user) создаются в одной транзакции
+        with transaction.atomic():
+            return super().form_valid(form)
+
 
 @login_required
 def profile_details_page(request, username):
@@ -84,9 +106,7 @@ def profile_details_page(request, username):
     """
     context = get_base_context(f'Профиль {username}')
     context['points'] = request.user.customer.bonus_points
-    customer = request.user.customer
-    order, created = Order.objects.get_or_create(customer=customer, complete=False)
-    context['notifications'] = order.get_cart_items
+    context['notifications'] = get_cart_count(request)
     return render(request, 'pages/profile/details.html', context)
 
 
@@ -94,165 +114,423 @@ def assortment(request):
     """
     Функция страницы с ассортиментом товаров.
 
-    :param pizzas: Вся пицца из базы данных (или отфильтрованная по заданному параметру)
+    :param selected: Выбранные пользователем типы пиццы (можно несколько)
+    :param pizza_grid: Первая страница сетки карточек пиццы (из кэша фрагментов), следующие страницы подгружаются из catalog_api
     :param active_filter: Активированный пользователем фильтр для пиццы
     :param notifications: Количество уведомлений в корзине
     :return: Возвращает страницу с ассортиментом пиццы из базы данных и возможностью ее фильтровать по начинке.
     """
     context = get_base_context('Ассортимент')
-    pizzas = Pizza.get_all()
-    active_filter = ''
-    if request.method == 'POST':
-        selected = request.POST.getlist('list_of_types')
-        if selected == ['chicken']:
-            pizzas = Pizza.get_all().filter(type=0)
-            active_filter = 'с курицей'
-        if selected == ['beef']:
-            pizzas = Pizza.get_all().filter(type=1)
-            active_filter = 'с говядиной'
-        if selected == ['sausage']:
-            pizzas = Pizza.get_all().filter(type=2)
-            active_filter = 'с колбасой'
-        if selected == ['vegetarian']:
-            pizzas = Pizza.get_all().filter(type=3)
-            active_filter = 'вегетарианская'
-    data = cart_data(request)
-    context['notifications'] = data['notifications']
-    context['pizzas'] = pizzas
-    context['active_filter'] = active_filter
+    selected = [name for name in request.POST.getlist('list_of_types') if name in TYPE_FILTERS]
+    types = sorted(TYPE_FILTERS[name] for name in selected)
+    type_names = dict(Pizza.TYPE_VARIANTS)
+
+    def first_page():
+        pizzas, next_cursor = get_pizza_page(types=types)
+        next_url = None
+        if next_cursor:
+            query = QueryDict(mutable=True)
+            query.setlist('type', selected)
+            query['cursor'] = next_cursor
+            next_url = f"{reverse('catalog_api')}?{query.urlencode()}"
+        return {'pizzas': pizzas, 'next_url': next_url}
+
+    context['notifications'] = get_cart_count(request)
+    context['pizza_grid'] = render_pizza_grid(
+        f"assortment:{','.join(map(str, types))}", first_page,
+        'На данный момент страница с ассортиментом не оформлена. Просим прощения за неудобства!',
+    )
+    context['selected'] = selected
+    context['active_filter'] = ', '.join(type_names[pizza_type].lower() for pizza_type in types)
     return render(request, 'pages/assortment.html', context)
 
 
+def catalog_page(query, path):
+    """
+    Страница JSON-каталога по параметрам запроса (синхронная часть catalog_api, выполняется в одном потоке).
+
+    :param query: Параметры запроса (QueryDict)
+    :param path: Адрес каталога для ссылки на следующую страницу
+    :return: Словарь со списком пицц (results) и адресом следующей страницы (next).
+    :raises KeyError: Если тип пиццы неизвестен.
+    :raises ValueError: Если параметры или курсор некорректны.
+    """
+    types = sorted(TYPE_FILTERS[name] for name in query.getlist('type'))
+    price_min = query.get('price_min')
+    price_max = query.get('price_max')
+    limit = int(query.get('limit', CATALOG_PAGE_SIZE))
+    if not 0 < limit <= CATALOG_MAX_PAGE_SIZE:
+        raise ValueError(limit)
+    pizzas, next_cursor = get_pizza_page(
+        types=types,
+        price_min=int(price_min) if price_min else None,
+        price_max=int(price_max) if price_max else None,
+        cursor=query.get('cursor'),
+        limit=limit,
+    )
+
+    next_url = None
+    if next_cursor:
+        next_query = query.copy()
+        next_query['cursor'] = next_cursor
+        next_url = f'{path}?{next_query.urlencode()}'
+    return {'results': [pizza_to_dict(pizza) for pizza in pizzas], 'next': next_url}
+
+
+async def catalog_api(request):
+    """
+    JSON-каталог пиццы с фильтрами и постраничной выдачей.
+
+    Асинхронное представление: в Django 4.0 нет асинхронного ORM, поэтому вся работа с базой выполняется
+    одним переходом в поток (sync_to_async), а под ASGI запрос не занимает поток, пока ждет своей очереди.
+
+    :param type: Тип пиццы (chicken/beef/sausage/vegetarian), параметр можно повторять
+    :param price_min: Минимальная цена
+    :param price_max: Максимальная цена
+    :param cursor: Курсор из поля next предыдущего ответа
+    :param limit: Размер страницы (не больше CATALOG_MAX_PAGE_SIZE)
+    :return: Возвращает JSON со списком пицц (results) и адресом следующей страницы (next).
+    """
+    try:
+        page = await sync_to_async(catalog_page)(request.GET, request.path)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Некорректные параметры фильтра'}, status=400)
+    return JsonResponse(page)
+
+
 def topsellers(request):
     """
     Функция страницы с хитами продаж.
 
+    :param window: Окно, за которое считаются продажи (settings.BESTSELLER_WINDOWS)
     :param notifications: Количество уведомлений в корзине
-    :param data: Все данные о заказе на данный момент
-    :param pizzas: Вся отфильтрованная по пуполярности пицца на данный момент
-    :return: Возвращает страницу с наименованием "Хиты продаж" и отсортированной по популярности пиццы.
+    :param pizza_grid: Сетка самых продаваемых за окно пицц (из кэша фрагментов); пока продаж нет - пицца по рейтингу
+    :return: Возвращает страницу с наименованием "Хиты продаж" и самой продаваемой пиццей.
     """
+    window = request.GET.get('window', settings.BESTSELLER_DEFAULT_WINDOW)
+    if window not in settings.BESTSELLER_WINDOWS:
+        window = settings.BESTSELLER_DEFAULT_WINDOW
     context = get_base_context('Хиты продаж')
-    data = cart_data(request)
-    context['notifications'] = data['notifications']
-    context['pizzas'] = Pizza.objects.order_by('-rating')
+    context['notifications'] = get_cart_count(request)
+    context['windows'] = list(settings.BESTSELLER_WINDOWS)
+    context['window'] = window
+    context['pizza_grid'] = render_pizza_grid(
+        f'top:{window}:{get_bestseller_version()}',
+        lambda: {'pizzas': get_bestsellers(window) or get_top_pizzas()},
+        'На данный момент страница с хитами продаж не оформлена. Просим прощения за неудобства!',
+    )
     return render(request, 'pages/topsellers.html', context)
 
 
 def checkout(request):
     """
-    Функция страницы с оплатой Paypal.
+    Функция страницы корзины и оформления заказа.
 
     :param method: Метод обращения к странице (Изначально GET, после нажатия на клавишу "добавить" - POST)
     :param order: Заказ пользователя на данный момент
     :param items: Все товары, добавленные в заказ
-    :param address: Адрес и телефон заказчика
-    :param form: Заранее заданная форма из forms.py для оформления заказа
-    :return: Возвращает страницу со страницей корзины
+    :param form: Заранее заданная форма из forms.py для оформления заказа (с новым ключом идемпотентности)
+    :return: Возвращает страницу со страницей корзины, после оформления заказа - перенаправляет на страницу оплаты
     """
     context = get_base_context('Корзина')
     context['method'] = 'GET'
-    if request.user.is_authenticated:
-        customer = request.user.customer
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        context['notifications'] = order.get_cart_items
-        items = order.orderitem_set.all()
-        context['form'] = CheckoutForm()
-        if request.method == 'POST':
-            address = OrderData()
-            address.save()
-            form = CheckoutForm(request.POST, request.FILES, instance=address)
-            if form.is_valid():
-                form.save()
-                customer.bonus_points += order.get_bonus_points
-                customer.save()
-                return redirect("/payment/")
-    else:
-        context['form'] = CheckoutForm()
-        if request.method == 'POST':
-            address = OrderData()
-            address.save()
-            form = CheckoutForm(request.POST, request.FILES, instance=address)
-            if form.is_valid():
-                form.save()
-                return redirect("/payment/")
-        cookieData = cookieCart(request)
-        order = cookieData['order']
-        items = cookieData['items']
-        context['notifications'] = cookieData['notifications']
-    context['items'] = items
-    context['order'] = order
+    form = CheckoutForm(initial={'checkout_key': uuid.uuid4().hex})
+    if request.method == 'POST':
+        # корзина и оформление читают только основную базу (см. main.db)
+        pin_request()
+        form = CheckoutForm(request.POST)
+        if form.is_valid():
+            try:
+                if request.user.is_authenticated:
+                    order = place_order(request.user.customer, form)
+                else:
+                    guest_cart = get_guest_cart(request)
+                    order = place_guest_order(guest_cart.lines(), form)
+                    guest_cart.clear()
+            except EmptyCartError:
+                form.add_error(None, 'Корзина пуста')
+            except CheckoutKeyConflict:
+                # чужой ключ не оформляет и не показывает чужой заказ: форма возвращается с новым ключом
+                data = request.POST.copy()
+                data['checkout_key'] = uuid.uuid4().hex
+                form = CheckoutForm(data)
+                form.is_valid()
+                form.add_error(None, 'Форма устарела, подтвердите заказ еще раз')
+            else:
+                response = redirect(f"{reverse('payment')}?order={order.checkout_key}")
+                if not request.user.is_authenticated:
+                    guest_cart.set_cookie(response)
+                return response
+    data = cart_data(request)
+    context['notifications'] = data['notifications']
+    context['items'] = data['items']
+    context['order'] = data['order']
+    context['form'] = form
     return render(request, 'pages/checkout.html', context)
 
 
 @staff_member_required
 def adding_of_position(request):
     """
-    Функция страницы с оплатой Paypal.
+    Функция страницы добавления новой позиции.
 
     :param method: Метод обращения к странице (Изначально GET, после нажатия на клавишу "добавить" - POST)
     :param form: Заранее заданная форма из forms.py для создания новой позиции пиццы
-    :param pizza: Модель одной пиццы для заполнения формы
     :return: Возвращает страницу, которая предназначена для добавления нового вида пиццы в ассортимент товаров.
     """
     context = get_base_context('Добавление позиции')
     context['method'] = 'GET'
     context['form'] = PizzaCreationForm()
     if request.method == 'POST':
-        pizza = Pizza(
-            author=request.user,
-            price=0,
-            rating=0
-        )
-        pizza.save()
-        form = PizzaCreationForm(request.POST, request.FILES, instance=pizza)
+        form = PizzaCreationForm(request.POST, request.FILES, instance=Pizza(author=request.user))
         if form.is_valid():
-            form.save()
+            with transaction.atomic():
+                form.save()
             return HttpResponseRedirect('/assortment/')
         context['form'] = form
     return render(request, 'pages/creating_position.html', context)
 
 
-def update_item(request):
+def parse_cart_changes(body):
+    """
+    Разбор тела запроса update_item.
+
+    :param body: Тело запроса: {"pizzaId": ..., "action": "add"/"remove"} или {"items": [{"pizzaId": ..., "delta": ...}]}
+    :return: Словарь {ID пиццы: изменение количества}.
+    :raises KeyError, TypeError, ValueError: Если тело запроса некорректно.
+    """
+    data = json.loads(body)
+    if 'items' in data:
+        changes = [(item['pizzaId'], int(item['delta'])) for item in data['items']]
+    else:
+        changes = [(data['pizzaId'], CART_ACTIONS[data['action']])]
+    deltas = {}
+    for pizzaId, delta in changes:
+        deltas[int(pizzaId)] = deltas.get(int(pizzaId), 0) + delta
+    return deltas
+
+
+def update_cart_response(request, deltas):
+    """
+    Изменение корзины и ответ с ее новым состоянием (синхронная часть update_item, выполняется в одном потоке).
+    Запрос закрепляется за основной базой данных, чтобы корзина не проверялась по отстающей реплике.
+
+    :raises Pizza.DoesNotExist: Если какой-то из пицц нет в базе данных.
+    """
+    pin_request()
+    cart = get_cart(request)
+    cart.update(deltas)
+    response = JsonResponse(cart_state(cart, list(deltas)))
+    cart.set_cookie(response)
+    return response
+
+
+async def update_item(request):
     """
-     Функция изменения товара.
+     Функция изменения товара в корзине (открытый заказ или корзина гостя, см. utils.get_cart).
+
+     Принимает либо одно действие {"pizzaId": ..., "action": "add"/"remove"}, либо несколько изменений сразу
+     {"items": [{"pizzaId": ..., "delta": ...}, ...]}, которые применяются в одной транзакции.
+     Асинхронное представление: тело запроса разбирается без потока, корзина меняется одним переходом в поток.
 
-     :param pizzaId: ID пиццы
-     :param pizza: Пицца по Id
-     :param action: Действие, производимое над товаром (увеличение или уменьшение количества товара)
-     :param customer: Пользователь
-     :return: Возвращает JSON о том, что предмет был изменен
+     :param deltas: Изменения количества товаров {ID пиццы: изменение}
+     :param cart: Корзина пользователя
+     :return: Возвращает JSON с новым состоянием корзины (см. utils.cart_state), по которому страница обновляется
+         без перезагрузки
      """
-    data = json.loads(request.body)
-    pizzaId = data['pizzaId']
-    action = data['action']
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        deltas = parse_cart_changes(request.body)
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Некорректный запрос'}, status=400)
+
+    try:
+        return await sync_to_async(update_cart_response)(request, deltas)
+    except Pizza.DoesNotExist:
+        raise Http404('Пицца не найдена')
+
 
-    customer = request.user.customer
-    pizza = Pizza.objects.get(id=pizzaId)
-    order, created = Order.objects.get_or_create(customer=customer, complete=False)
-    orderItem, created = OrderItem.objects.get_or_create(order=order, pizza=pizza)
+def cart_summary_payload(request):
+    """
+    Итоги корзины текущего пользователя (синхронная часть cart_summary).
 
-    if action == 'add':
-        orderItem.quantity = (orderItem.quantity + 1)
-    elif action == 'remove':
-        orderItem.quantity = (orderItem.quantity - 1)
+    :return: Словарь с количеством товаров (count), суммой (total) и бонусными очками за заказ (bonus).
+    """
+    summary = get_cart(request).summary()
+    return {'count': summary.get_cart_items, 'total': summary.get_cart_total, 'bonus': summary.get_bonus_points}
 
-    orderItem.save()
 
-    if orderItem.quantity <= 0:
-        orderItem.delete()
-    return JsonResponse('Item Was Added', safe=False)
+async def cart_summary(request):
+    """
+    Функция итогов корзины в JSON (для значка корзины на закэшированных страницах и т.п.).
+    Асинхронное представление: пользователь и корзина читаются одним переходом в поток.
+
+    :return: Возвращает JSON с количеством товаров (count), суммой (total) и бонусными очками (bonus)
+    """
+    return JsonResponse(await sync_to_async(cart_summary_payload)(request))
 
 
 def payment(request):
     """
-    Функция страницы с оплатой Paypal.
+    Функция страницы оплаты оформленного заказа. Сумма берется из заказа на сервере, а не со страницы.
 
+    :param order: Ключ оформления заказа (checkout_key) из адреса страницы
     :param notifications: Количество уведомлений в корзине
-    :param data: Все данные о заказе на данный момент
-    :return: Возвращает страницу с наименованием "оплата" и количеством товара в корзине
+    :param provider: Платежный провайдер (см. main.payments)
+    :return: Возвращает страницу с наименованием "оплата", суммой заказа и кнопкой оплаты
     """
     context = get_base_context('Оплата')
-    data = cart_data(request)
-    context['notifications'] = data['notifications']
+    context['notifications'] = get_cart_count(request)
+    key = request.GET.get('order')
+    order = Order.objects.filter(checkout_key=key, complete=True).first() if key else None
+    if order is not None:
+        context['order'] = order
+        context['amount'] = order.summary.get_cart_total
+        context['paid'] = bool(order.transaction_id)
+    context['provider'] = get_provider()
+    context['currency'] = settings.PAYMENT_CURRENCY
     return render(request, 'pages/payment.html', context)
+
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        data = None
+    return data if isinstance(data, dict) else {}
+
+
+@require_POST
+def payment_intent(request):
+    """
+    Функция создания платежа за заказ {"order": checkout_key}. Сумма считается сервером по заказу.
+
+    :return: Возвращает JSON с ID платежа (intentId), суммой, валютой, провайдером и данными для страницы оплаты
+    """
+    order = Order.objects.filter(checkout_key=str(_json_body(request).get('order', '')), complete=True).first()
+    if order is None:
+        raise Http404('Заказ не найден')
+    try:
+        payment = start_payment(order)
+    except PaymentError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({
+        'intentId': payment.intent_id,
+        'amount': payment.amount,
+        'currency': payment.currency,
+        'provider': payment.provider,
+        'status': payment.status,
+        'clientData': get_provider().client_data(payment.intent_id),
+    })
+
+
+@require_POST
+def payment_capture(request):
+    """
+    Функция списания платежа {"intentId": ...}, одобренного покупателем на странице провайдера.
+
+    :return: Возвращает JSON с состоянием платежа
+    """
+    try:
+        payment = capture_payment(str(_json_body(request).get('intentId', '')))
+    except PaymentError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'status': payment.status})
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    """
+    Функция приема уведомлений платежного провайдера. Повторные уведомления об одном платеже безопасны:
+    платеж отмечается оплаченным один раз.
+
+    :return: Возвращает JSON с состоянием платежа (или 400, если уведомление не прошло проверку)
+    """
+    try:
+        event = get_provider().parse_webhook(request)
+        if event is None:
+            return JsonResponse({'status': 'ignored'})
+        payment = confirm_capture(*event)
+    except PaymentError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'status': payment.status})
+
+
+@staff_member_required
+def fragment_cache_stats(request):
+    """
+    Функция статистики кэша фрагментов для персонала.
+
+    :return: Возвращает JSON с количеством попаданий и промахов кэша сетки пиццы.
+    """
+    return JsonResponse(get_fragment_stats())
+
+
+@staff_member_required
+def sales_analytics(request):
+    """
+    Функция страницы отчетов о продажах для персонала. Отчеты строятся по дневным сводкам (см. main.analytics),
+    а не по заказам.
+
+    :param start: Первый день периода (по умолчанию - 30 дней назад)
+    :param end: Последний день периода (по умолчанию - сегодня)
+    :param group: Группировка: по пиццам (pizza) или по типам (type)
+    :param format: csv - выгрузить отчет файлом
+    :return: Возвращает страницу с отчетом или CSV-файл
+    """
+    end = timezone.localdate()
+    start = end - datetime.timedelta(days=29)
+    try:
+        start = datetime.date.fromisoformat(request.GET.get('start') or start.isoformat())
+        end = datetime.date.fromisoformat(request.GET.get('end') or end.isoformat())
+    except ValueError:
+        return HttpResponse('Некорректная дата', status=400)
+    group = request.GET.get('group', 'pizza')
+    if group not in REPORT_GROUPS:
+        group = 'pizza'
+    report = sales_report(start, end, group)
+
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="sales_{group}_{start}_{end}.csv"'
+        writer = csv.writer(response)
+        writer.writerow(['name', 'quantity', 'revenue'])
+        for row in report:
+            writer.writerow([row['name'], row['quantity'], row['revenue']])
+        return response
+
+    context = get_base_context('Продажи')
+    context['notifications'] = get_cart_count(request)
+    context['start'] = start
+    context['end'] = end
+    context['group'] = group
+    context['report'] = report
+    context['daily'] = daily_totals(start, end)
+    context['position'] = get_rollup_position()
+    return render(request, 'pages/analytics.html', context)
+
+
+@staff_member_required
+def perf_stats(request):
+    """
+    Функция страницы замеров производительности для персонала (см. main.middleware.PerfMiddleware).
+    Статистика хранится в памяти процесса, поэтому при нескольких процессах сервера страница показывает один из них.
+
+    :param format: json - отдать статистику в JSON
+    :return: Возвращает страницу со временем ответа, SQL-запросами и временем шаблонов по представлениям;
+        после POST-запроса статистика сбрасывается
+    """
+    if request.method == 'POST':
+        reset_perf_stats()
+        return redirect('perf_stats')
+    stats = get_perf_stats()
+    if request.GET.get('format') == 'json':
+        return JsonResponse(stats)
+    context = get_base_context('Производительность')
+    context['notifications'] = get_cart_count(request)
+    context['pid'] = stats['pid']
+    context['views'] = stats['views']
+    context['sample_rate'] = settings.PERF_SAMPLE_RATE
+    return render(request, 'pages/perf.html', context)
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pizzeria_project.settings')
 
+# Под ASGI синхронный код каждого запроса может выполняться в новом потоке, а соединение с базой данных у каждого
+# потока свое: постоянные соединения (CONN_MAX_AGE) копились бы по одному на поток, поэтому они выключаются
+# до создания первого соединения.
+for database in settings.DATABASES.values():
+    database['CONN_MAX_AGE'] = 0
+
 application = get_asgi_application()
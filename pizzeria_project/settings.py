@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.PerfMiddleware',
+    'main.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,13 +52,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.middleware.CartCookieMiddleware',
 ]
 
 ROOT_URLCONF = 'pizzeria_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'main.perf.TimedDjangoTemplates',
         'DIRS': [
             'main/templates'
         ],
@@ -82,9 +85,101 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # сколько секунд соединение остается открытым между запросами (только под WSGI: asgi.py выключает постоянные
+        # соединения); сервер разработки открывает поток на каждый запрос, поэтому при разработке они тоже выключены
+        'CONN_MAX_AGE': 0 if DEBUG else 60,
     }
 }
 
+# Реплика только для чтения (main.db.PrimaryReplicaRouter): с нее читаются каталог и отчеты, корзина и оформление
+# работают с основной базой. Для проверки на одной машине подойдет второй файл SQLite, который обновляет
+# manage.py sync_replica: DATABASE_REPLICA = {'NAME': BASE_DIR / 'replica.sqlite3'}; для PostgreSQL -
+# {'NAME': ..., 'HOST': ...} реплики. Недостающие параметры берутся у основной базы.
+DATABASE_REPLICA = None
+if DATABASE_REPLICA:
+    DATABASES['replica'] = {**DATABASES['default'], **DATABASE_REPLICA, 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['main.db.PrimaryReplicaRouter']
+# Проверка постоянных соединений перед каждым запросом (main.db.check_connections, в Django 4.0 нет CONN_HEALTH_CHECKS)
+DATABASE_HEALTH_CHECKS = True
+# Сколько секунд после записи клиент читает с основной базы (должно быть больше отставания реплики)
+DATABASE_REPLICA_PIN_SECONDS = 5
+DATABASE_REPLICA_PIN_COOKIE = 'db_primary'
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+# LocMemCache у каждого процесса свой: версия каталога, количество товаров в корзине и отметка чтения с основной базы
+# (main.catalog, main.utils, main.db) в других процессах не видны, поэтому при нескольких процессах нужен общий кэш
+# (Redis, Memcached, DatabaseCache). Без него каталог отстает от изменений не больше, чем на CATALOG_CACHE_TIMEOUT
+# секунд (manage.py check --deploy предупреждает об этом).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Время жизни версии каталога, закэшированных списков пицц и HTML сеток (см. main.catalog)
+CATALOG_CACHE_TIMEOUT = 60
+
+# Корзина покупателя без регистрации: 'cookie' - JSON в cookie "cart" у клиента,
+# 'server' - в кэше GUEST_CART_CACHE (у клиента только подписанный ID корзины в cookie GUEST_CART_COOKIE).
+# Хранилищем может быть любой кэш Django: например, DatabaseCache (после manage.py createcachetable),
+# FileBasedCache или LocMemCache (только для одного процесса).
+GUEST_CART_STORAGE = 'cookie'
+GUEST_CART_CACHE = 'default'
+GUEST_CART_COOKIE = 'cart_id'
+GUEST_CART_TIMEOUT = 60 * 60 * 24 * 30
+
+# Скользящие окна рейтинга хитов продаж (имя -> длина в часах), см. main.bestsellers
+BESTSELLER_WINDOWS = {'24h': 24, '7d': 24 * 7, '30d': 24 * 30}
+BESTSELLER_DEFAULT_WINDOW = '7d'
+
+# Доля запросов, для которых main.middleware.PerfMiddleware считает SQL-запросы и время шаблонов (0 - только время ответа)
+PERF_SAMPLE_RATE = 1.0 if DEBUG else 0.05
+# Заголовок Server-Timing раскрывает время SQL и шаблонов любому клиенту, поэтому по умолчанию он есть только в DEBUG
+PERF_SERVER_TIMING = DEBUG
+
+# Платежный провайдер (см. main.payments): StubProvider - локальная заглушка для разработки и тестов (только
+# с DEBUG: с ней заказ может отметить оплаченным кто угодно), PayPal - 'main.payments.PayPalProvider'.
+# Ключи PayPal берутся из переменных окружения PAYPAL_CLIENT_ID, PAYPAL_SECRET и PAYPAL_WEBHOOK_ID
+# (PAYPAL_BASE_URL - адрес API, по умолчанию песочница); без них manage.py check --deploy сообщает об ошибке.
+PAYMENT_PROVIDER = 'main.payments.StubProvider' if DEBUG else 'main.payments.PayPalProvider'
+PAYMENT_PROVIDER_OPTIONS = {}
+if PAYMENT_PROVIDER == 'main.payments.PayPalProvider':
+    PAYMENT_PROVIDER_OPTIONS = {
+        'client_id': os.environ.get('PAYPAL_CLIENT_ID'),
+        'secret': os.environ.get('PAYPAL_SECRET'),
+        'webhook_id': os.environ.get('PAYPAL_WEBHOOK_ID'),
+    }
+    if os.environ.get('PAYPAL_BASE_URL'):
+        PAYMENT_PROVIDER_OPTIONS['base_url'] = os.environ['PAYPAL_BASE_URL']
+PAYMENT_CURRENCY = 'RUB'
+
+# Общий HTTP-клиент для внешних сервисов (main.http): таймауты (соединение, чтение) в секундах и размер пула
+HTTP_CLIENT_TIMEOUT = (3.05, 10)
+HTTP_CLIENT_POOL_SIZE = 10
+
+# Очередь фоновых задач в базе данных (main.tasks, исполнитель - manage.py run_tasks): количество попыток,
+# задержка перед первым повтором (удваивается с каждой попыткой), через сколько секунд задача упавшего
+# исполнителя возвращается в очередь и сколько секунд хранятся выполненные задачи.
+# TASK_QUEUE_EAGER = True - выполнять задачи в процессе сайта сразу после фиксации транзакции, без исполнителя
+# (при разработке, чтобы не запускать run_tasks; в рабочем режиме исполнитель обязателен).
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 30
+TASK_LOCK_TIMEOUT = 10 * 60
+TASK_RETENTION = 7 * 24 * 60 * 60
+TASK_QUEUE_EAGER = DEBUG
+
+# Архив оформленных заказов (main.archive, manage.py archive_orders): каталог файлов архива и возраст заказов в днях,
+# после которого они переносятся из таблиц Order и OrderItem в архив
+ORDER_ARCHIVE_ROOT = os.path.join(BASE_DIR, 'archive')
+ORDER_ARCHIVE_DAYS = 180
+
+# Чеки за заказы (main.checkout.send_receipt): при разработке письма печатаются в консоль исполнителя
+if DEBUG:
+    EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -128,6 +223,12 @@ STATICFILES_DIRS = [
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Uploads are always streamed to a temporary file and then moved into the storage,
+# so large pictures are never held in memory
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -31,11 +31,19 @@ urlpatterns = [
         'pagename': 'Авторизация'
     })),
     path('assortment/', assortment, name="assortment"),
+    path('api/pizzas/', views.catalog_api, name="catalog_api"),
     path('topsellers/', topsellers, name="top"),
     path('checkout/', checkout, name="checkout"),
     path('creating_position/', adding_of_position, name="creation"),
     path('update_item/', update_item, name="update_item"),
+    path('api/cart/', views.cart_summary, name="cart_summary"),
     path('payment/', payment, name="payment"),
+    path('payment/intent/', views.payment_intent, name="payment_intent"),
+    path('payment/capture/', views.payment_capture, name="payment_capture"),
+    path('payment/webhook/', views.payment_webhook, name="payment_webhook"),
+    path('staff/cache/', views.fragment_cache_stats, name="fragment_cache_stats"),
+    path('staff/analytics/', views.sales_analytics, name="sales_analytics"),
+    path('staff/perf/', views.perf_stats, name="perf_stats"),
 
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
@@ -1,37 +1,17 @@
-var updateBtns = document.getElementsByClassName('update-cart')
-
-for (i = 0; i < updateBtns.length; i++) {
-  updateBtns[i].addEventListener('click', function(){
-  var pizzaId = this.dataset.pizza
-  var action = this.dataset.action
-
-  if (user === 'AnonymousUser') {
-      addCookieItem(pizzaId, action)
-  }else{
-      updateUserOrder(pizzaId, action)
-    }
-  })
-}
-
-function addCookieItem(pizzaId, action) {
-  if (action == 'add') {
-    if (cart[pizzaId] == undefined) {
-      cart[pizzaId] = {'quantity': 1}
-  } else {
-    cart[pizzaId]['quantity'] += 1
+// Clicks are handled on the document, so cards loaded later by catalog.js work too
+document.addEventListener('click', function(event){
+  var button = event.target.closest('.update-cart')
+  if (button === null) {
+    return
   }
-}
-  if (action == 'remove') {
-    cart[pizzaId]['quantity'] -= 1
-    if (cart[pizzaId]['quantity'] <= 0) {
-      delete cart[pizzaId]
-    }
-  }
-  document.cookie = 'cart=' + JSON.stringify(cart) + ";domain=;path=/"
-  location.reload()
-}
+  var pizzaId = button.dataset.pizza
+  var action = button.dataset.action
 
-function updateUserOrder(pizzaId, action) {
+  // guest carts are updated by the server too (in a cookie or in the cache, see GUEST_CART_STORAGE)
+  updateOrder(pizzaId, action)
+})
+
+function updateOrder(pizzaId, action) {
     var url = '/update_item/'
 
     fetch(url, {
@@ -44,10 +24,45 @@ function updateUserOrder(pizzaId, action) {
     })
 
     .then((response) => {
+        if (!response.ok) {
+            throw new Error('Cart update failed: ' + response.status)
+        }
         return response.json()
     })
 
     .then((data) => {
-        location.reload()
+        renderCart(data)
     })
 }
+
+// Patches the badge and the checkout table with the cart state returned by update_item
+function renderCart(data) {
+    var badge = document.getElementById('cart-count')
+    if (badge !== null) {
+        badge.textContent = data.count
+        badge.classList.toggle('d-none', data.count === 0)
+    }
+    setText('cart-items', data.count)
+    setText('cart-total', data.total)
+    setText('cart-bonus', data.bonus)
+
+    data.items.forEach(function(item) {
+        var row = document.querySelector('tr[data-line="' + item.pizzaId + '"]')
+        if (row === null) {
+            return
+        }
+        if (item.quantity === 0) {
+            row.remove()
+            return
+        }
+        row.querySelector('.line-quantity').textContent = item.quantity
+        row.querySelector('.line-total').textContent = item.total
+    })
+}
+
+function setText(id, value) {
+    var element = document.getElementById(id)
+    if (element !== null) {
+        element.textContent = value
+    }
+}
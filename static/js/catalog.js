@@ -0,0 +1,53 @@
+var grid = document.getElementById('pizza-grid')
+var loadMoreBtn = document.getElementById('load-more')
+
+function pizzaCard(pizza) {
+  var col = document.createElement('div')
+  col.className = 'col'
+  col.innerHTML =
+    '<div class="card h-100">' +
+      '<picture><img class="image card-img-top" alt="pizza"></picture>' +
+      '<div class="card-body"><h5 class="card-title"></h5><p class="card-text"></p></div>' +
+      '<div class="card-footer">' +
+        '<p><b>Цена:</b> <span class="pizza-price"></span></p>' +
+        '<button class="btn btn-danger add-btn float-right update-cart" data-action="add">В корзину</button>' +
+      '</div>' +
+    '</div>'
+  var img = col.querySelector('img')
+  pizza.imageSources.forEach(function(imageSource) {
+    var source = document.createElement('source')
+    source.type = imageSource.type
+    source.srcset = imageSource.srcset
+    source.sizes = '(max-width: 768px) 100vw, 33vw'
+    img.before(source)
+  })
+  img.src = pizza.imageURL
+  col.querySelector('.card-title').textContent = pizza.name
+  col.querySelector('.card-text').textContent = pizza.description
+  col.querySelector('.pizza-price').textContent = pizza.price
+  col.querySelector('.update-cart').dataset.pizza = pizza.id
+  return col
+}
+
+if (loadMoreBtn !== null) {
+  loadMoreBtn.addEventListener('click', function(){
+    loadMoreBtn.disabled = true
+    fetch(loadMoreBtn.dataset.next)
+
+    .then((response) => {
+        return response.json()
+    })
+
+    .then((data) => {
+        data.results.forEach(function(pizza) {
+          grid.appendChild(pizzaCard(pizza))
+        })
+        if (data.next) {
+          loadMoreBtn.dataset.next = data.next
+          loadMoreBtn.disabled = false
+        } else {
+          loadMoreBtn.remove()
+        }
+    })
+  })
+}
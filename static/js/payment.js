@@ -0,0 +1,60 @@
+// The amount is never sent from here: the server computes it from the order when creating the intent
+var container = document.getElementById('payment-container')
+
+function postJSON(url, body) {
+    return fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type':'application/json',
+            'X-CSRFToken': csrftoken,
+        },
+        body: JSON.stringify(body)
+    }).then((response) => {
+        return response.json().then((data) => {
+            if (!response.ok) {
+                throw new Error(data.error || response.status)
+            }
+            return data
+        })
+    })
+}
+
+function createIntent() {
+    return postJSON('/payment/intent/', {'order': container.dataset.order})
+}
+
+function showStatus(data) {
+    var status = document.getElementById('payment-status')
+    if (data.status === 'captured') {
+        status.innerHTML = '<h3>Заказ оплачен, спасибо!</h3>'
+        container.remove()
+    } else {
+        status.textContent = 'Не удалось подтвердить оплату, попробуйте еще раз'
+    }
+}
+
+function showError(error) {
+    document.getElementById('payment-status').textContent = 'Ошибка оплаты: ' + error.message
+}
+
+if (container.dataset.provider === 'paypal') {
+    paypal.Buttons({
+        createOrder: function() {
+            return createIntent().then((intent) => intent.intentId)
+        },
+        onApprove: function(data) {
+            return postJSON('/payment/capture/', {'intentId': data.orderID}).then(showStatus).catch(showError)
+        }
+    }).render('#payment-container')
+} else if (container.dataset.provider === 'stub') {
+    // the stub provider has no payment page of its own, so its capture notification comes from here
+    document.getElementById('stub-pay').addEventListener('click', function() {
+        createIntent().then((intent) => {
+            return postJSON('/payment/webhook/', {
+                'intent': intent.intentId,
+                'signature': intent.clientData.signature,
+                'amount': intent.amount,
+            })
+        }).then(showStatus).catch(showError)
+    })
+}